@@ -0,0 +1,199 @@
+# The benchmarks. Each one is a setup function registered with @benchmark.
+# Setup does the untimed work (reading fixtures, warming caches) and returns
+# a function to time and the number of items that one call processes, so
+# that results can be reported as items per second.
+#
+# Everything runs offline against the files in test/fixtures.
+
+import os
+import copy
+import subprocess
+import sys
+
+from lxml import etree
+
+from congress.tasks import utils, bills, bill_info, vote_info, govinfo, voteview
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FIXTURES = os.path.join(ROOT, "test", "fixtures")
+
+BENCHMARKS = []
+
+
+def benchmark(setup):
+    BENCHMARKS.append((setup.__name__, setup))
+    return setup
+
+
+def fixture(*path, mode="rb"):
+    with open(os.path.join(FIXTURES, *path), mode) as f:
+        return f.read()
+
+
+def use_fixture_legislators():
+    # Point the legislator lookups at a small fixture instead of the
+    # congress-legislators repository, which would need the network.
+    utils.legislator_files = (os.path.join(FIXTURES, "legislators.yaml"),)
+    utils.has_congress_legislators_repo = True
+    utils.lookup_legislator_cache = []
+    utils._translate_legislator_id_cache = None
+
+
+BILLSTATUS_FIXTURES = ("BILLSTATUS-117hr3684.xml", "BILLSTATUS-113s54.xml")
+
+
+def billstatus_dicts():
+    return [
+        bills.read_fdsys_bulk_bill_status_file(os.path.join(FIXTURES, "billstatus", fn), None)
+        for fn in BILLSTATUS_FIXTURES]
+
+
+@benchmark
+def billstatus_parse():
+    bodies = [fixture("billstatus", fn).decode("utf8") for fn in BILLSTATUS_FIXTURES]
+
+    def run():
+        import xmltodict
+        for body in bodies:
+            xmltodict.parse(body, force_list=('item', 'amendment', 'committeeReport', 'link'))
+    return run, len(bodies)
+
+
+@benchmark
+def form_bill_json_dict():
+    # form_bill_json_dict modifies some of its input, so give it a fresh
+    # copy each time. The copy is part of the timing but is small next to
+    # the conversion.
+    dicts = billstatus_dicts()
+
+    def run():
+        for d in copy.deepcopy(dicts):
+            bills.form_bill_json_dict(d)
+    return run, len(dicts)
+
+
+@benchmark
+def parse_bill_action():
+    # Replay each action with the status the bill had before it.
+    actions = []
+    for d in billstatus_dicts():
+        bill = bills.form_bill_json_dict(d)
+        status = "INTRODUCED"
+        for action in bill["actions"]:
+            actions.append(({"text": action["text"], "acted_at": action["acted_at"], "type": "action"}, status, bill["bill_id"], bill["official_title"]))
+            status = action.get("status", status)
+
+    def run():
+        for action, status, bill_id, title in actions:
+            bill_info.parse_bill_action(action, status, bill_id, title)
+    return run, len(actions)
+
+
+@benchmark
+def create_govtrack_xml():
+    bill_data = [bills.form_bill_json_dict(d) for d in billstatus_dicts()]
+
+    def run():
+        for bill in bill_data:
+            bill_info.create_govtrack_xml(bill, {})
+    return run, len(bill_data)
+
+
+def vote_benchmark(fn, parse_func):
+    use_fixture_legislators()
+    dom = etree.fromstring(fixture("votes", fn))
+    vote_id = fn.replace(".xml", "")
+    chamber, number, congress, session = utils.split_vote_id(vote_id)
+    template = {'vote_id': vote_id, 'chamber': chamber, 'congress': int(congress), 'session': session, 'number': int(number)}
+    parse_func(dom, dict(template))  # load the legislators
+
+    def run():
+        parse_func(dom, dict(template))
+    return run, 1
+
+
+@benchmark
+def parse_house_vote():
+    return vote_benchmark("h185-117.2021.xml", vote_info.parse_house_vote)
+
+
+@benchmark
+def parse_senate_vote():
+    return vote_benchmark("s314-117.2021.xml", vote_info.parse_senate_vote)
+
+
+@benchmark
+def lookup_legislator():
+    use_fixture_legislators()
+    import datetime
+    when = datetime.date(2021, 7, 1)
+    lookups = [
+        (117, "rep", "Smith", "NJ", "R", "bioguide"),
+        (117, "rep", "Smith, Adam", "WA", "D", "bioguide"),
+        (117, "rep", "DeFazio", "OR", "D", "bioguide"),
+        (117, "sen", "Leahy", "VT", "D", "lis"),
+        (117, "sen", "Durbin", "IL", "D", "lis"),
+    ]
+    utils.lookup_legislator(*lookups[0][:5], when, lookups[0][5])
+
+    def run():
+        for congress, role_type, name, state, party, id_requested in lookups:
+            utils.lookup_legislator(congress, role_type, name, state, party, when, id_requested)
+    return run, len(lookups)
+
+
+@benchmark
+def parse_sitemap():
+    bodies = [fixture("sitemap", fn) for fn in ("BILLSTATUS-sitemapindex.xml", "BILLSTATUS-117hr-sitemap.xml")]
+    entries = sum(len(govinfo.parse_sitemap(body, fn)[1]) for body, fn in zip(bodies, ("index", "sitemap")))
+
+    def run():
+        for body in bodies:
+            govinfo.parse_sitemap(body, "fixture")
+    return run, entries
+
+
+@benchmark
+def parse_vote_list_file():
+    use_fixture_legislators()
+    body = fixture("voteview", "h117.ord").decode("utf8")
+    rows = len(voteview.parse_vote_list_file(body))
+
+    def run():
+        voteview.parse_vote_list_file(body)
+    return run, rows
+
+
+@benchmark
+def unescape():
+    # Pages as they come from download(), plus some plain text.
+    texts = [fixture("billstatus", fn).decode("utf8") for fn in BILLSTATUS_FIXTURES]
+    texts += [fixture("votes", "h185-117.2021.xml").decode("utf8")]
+    texts += [bill_info.strip_tags("<p>Plain text with no entities at all.</p>") * 20]
+
+    def run():
+        for text in texts:
+            utils.unescape(text)
+    return run, len(texts)
+
+
+@benchmark
+def json_dumps():
+    bill_data = [bills.form_bill_json_dict(d) for d in billstatus_dicts()]
+
+    def run():
+        for bill in bill_data:
+            utils.json_dumps(bill)
+    return run, len(bill_data)
+
+
+@benchmark
+def startup():
+    # A cold start of usc-run --list-tasks, in a new interpreter each time.
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join([ROOT] + [p for p in env.get("PYTHONPATH", "").split(os.pathsep) if p])
+    code = "import sys; sys.argv = ['usc-run', '--list-tasks']; import congress.run; congress.run.main()"
+
+    def run():
+        subprocess.check_call([sys.executable, "-c", code], env=env, stdout=subprocess.DEVNULL)
+    return run, 1
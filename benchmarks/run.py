@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+#
+# Offline benchmarks of the parsers and converters, run from the
+# repository root:
+#
+# python benchmarks/run.py
+#
+# Options:
+#
+# --filter=regex: run only the benchmarks whose names match.
+# --repeat=5: time each benchmark this many times and keep the best.
+# --min_time=0.2: seconds each timing should last at least. The number of
+#    calls per timing is raised until it does.
+# --output=path.json: save the results.
+# --compare=baseline.json: compare against results saved earlier with
+#    --output, and exit with an error if any benchmark is slower than the
+#    baseline by more than --threshold percent (default 10).
+
+import datetime
+import json
+import logging
+import os
+import platform
+import re
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.append(os.path.join(ROOT, "congress", "tasks"))
+
+from congress.run import parse_options
+
+
+def time_benchmark(run, repeat, min_time):
+    # Find how many calls make one timing last at least min_time.
+    loops = 1
+    while True:
+        start = time.perf_counter()
+        for i in range(loops):
+            run()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            break
+        loops *= 2 if elapsed == 0 else max(2, int(min_time / elapsed) + 1)
+
+    best = elapsed / loops
+    for i in range(repeat - 1):
+        start = time.perf_counter()
+        for j in range(loops):
+            run()
+        best = min(best, (time.perf_counter() - start) / loops)
+    return best, loops
+
+
+def run_benchmarks(options):
+    from benchmarks.cases import BENCHMARKS
+
+    repeat = int(options.get("repeat", 5))
+    min_time = float(options.get("min_time", 0.2))
+
+    results = {}
+    for name, setup in BENCHMARKS:
+        if options.get("filter") and not re.search(options["filter"], name):
+            continue
+        run, items = setup()
+        seconds, loops = time_benchmark(run, repeat, min_time)
+        results[name] = {
+            "seconds": seconds,
+            "items": items,
+            "items_per_second": items / seconds,
+            "loops": loops,
+        }
+        print("%-24s %12.1f items/s  %10.1f us/call" % (name, items / seconds, seconds * 1000000))
+    return results
+
+
+def compare(results, baseline, threshold):
+    # Returns the names of the benchmarks that regressed by more than
+    # threshold percent.
+    regressions = []
+    print()
+    print("%-24s %12s %12s %8s" % ("benchmark", "baseline us", "now us", "change"))
+    for name in sorted(results):
+        if name not in baseline:
+            continue
+        before = baseline[name]["seconds"]
+        after = results[name]["seconds"]
+        change = (after - before) / before * 100
+        flag = ""
+        if change > threshold:
+            regressions.append(name)
+            flag = "  REGRESSION"
+        print("%-24s %12.1f %12.1f %+7.1f%%%s" % (name, before * 1000000, after * 1000000, change, flag))
+    return regressions
+
+
+def main():
+    options = parse_options(sys.argv[1:])
+    logging.basicConfig(format='%(message)s', level="ERROR")
+
+    # Caches (e.g. of the parsed legislators file) go in a temporary
+    # directory rather than the repository's cache directory.
+    os.chdir(ROOT)
+    from congress.tasks import utils
+    with tempfile.TemporaryDirectory() as cache:
+        utils.cache_dir = lambda: cache
+        results = run_benchmarks(options)
+
+    if options.get("output"):
+        with open(options["output"], "w") as f:
+            json.dump({
+                "date": datetime.datetime.now().isoformat(),
+                "python": platform.python_version(),
+                "machine": platform.machine(),
+                "benchmarks": results,
+            }, f, indent=2, sort_keys=True)
+
+    if options.get("compare"):
+        with open(options["compare"]) as f:
+            baseline = json.load(f)["benchmarks"]
+        threshold = float(options.get("threshold", 10))
+        regressions = compare(results, baseline, threshold)
+        if regressions:
+            print("\n%d benchmarks regressed by more than %s%%: %s" % (len(regressions), threshold, ", ".join(regressions)))
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
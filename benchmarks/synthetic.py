@@ -0,0 +1,570 @@
+#!/usr/bin/env python
+#
+# Generate a synthetic corpus of bill status files, roll call votes and
+# GovInfo sitemaps for load testing the tasks offline at production scale.
+#
+# python benchmarks/synthetic.py --root=synthetic --bills=500000
+#
+# The files are laid out under {root}/data and {root}/cache the way the
+# tasks expect, so from inside the root directory (or with config.yml
+# output paths pointing there) these run without the network:
+#
+# usc-run govinfo --bulkdata=BILLSTATUS --cached
+# usc-run bills
+# usc-run votes --congress=117
+#
+# Options:
+#
+# --bills=N: the total number of bills and resolutions (default 1000),
+#    spread over the Congresses and bill types in realistic proportions.
+# --congresses=115-117: the Congresses to generate.
+# --schema=mixed: the BILLSTATUS shape, 1.0, 3.0.0, or mixed (1.0 before
+#    the 118th Congress, 3.0.0 from then on).
+# --votes=N: House and Senate roll call votes per session (default 100).
+# --processed=0.9: the fraction of bills marked as already processed by
+#    usc-run bills, so that the rest look changed.
+# --seed=0: the random seed. The same options always generate the same files.
+
+import datetime
+import os
+import random
+import sys
+from xml.sax.saxutils import escape
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from congress.run import parse_options
+
+# Share of each bill type, roughly as in recent Congresses.
+BILL_TYPES = (("hr", .55), ("s", .30), ("hres", .06), ("sres", .04), ("hjres", .02), ("sjres", .01), ("hconres", .01), ("sconres", .01))
+
+HOUSE_COMMITTEES = (
+    ("hsag00", "Agriculture"), ("hsap00", "Appropriations"), ("hsas00", "Armed Services"),
+    ("hsba00", "Financial Services"), ("hsed00", "Education and Labor"), ("hsif00", "Energy and Commerce"),
+    ("hsju00", "Judiciary"), ("hspw00", "Transportation and Infrastructure"), ("hswm00", "Ways and Means"),
+)
+SENATE_COMMITTEES = (
+    ("ssaf00", "Agriculture, Nutrition, and Forestry"), ("ssap00", "Appropriations"), ("ssas00", "Armed Services"),
+    ("ssbk00", "Banking, Housing, and Urban Affairs"), ("ssfi00", "Finance"), ("ssju00", "Judiciary"),
+)
+SUBJECTS = (
+    "Agriculture and Food", "Armed Forces and National Security", "Crime and Law Enforcement", "Economics and Public Finance",
+    "Education", "Energy", "Environmental Protection", "Finance and Financial Sector", "Government Operations and Politics",
+    "Health", "Immigration", "International Affairs", "Labor and Employment", "Taxation", "Transportation and Public Works",
+)
+LEGISLATIVE_SUBJECTS = (
+    "Administrative law and regulatory procedures", "Appropriations", "Congressional oversight", "Criminal justice information and records",
+    "Department of Transportation", "Federal-state relations", "Government information and archives", "Health care costs and insurance",
+    "Highway and street construction", "Income tax credits", "Mass transit", "Medicare", "Motor vehicles", "Small business",
+    "State and local finance", "Student aid and college costs", "Veterans' education, employment, rehabilitation",
+)
+LAST_NAMES = (
+    "Adams", "Baker", "Carter", "Diaz", "Evans", "Foster", "Garcia", "Harris", "Ingram", "Jackson", "Kim", "Lopez", "Miller",
+    "Nguyen", "Owens", "Patel", "Quinn", "Reyes", "Smith", "Turner", "Underwood", "Vargas", "Walker", "Young", "Zimmerman",
+)
+FIRST_NAMES = ("Alex", "Barbara", "Carlos", "Diane", "Edward", "Frances", "George", "Helen", "Isaac", "Julia", "Kevin", "Linda", "Maria", "Nathan")
+STATES = ("AL", "AZ", "CA", "CO", "FL", "GA", "IL", "MA", "MI", "NC", "NJ", "NY", "OH", "OR", "PA", "TX", "VA", "WA")
+WORDS = (
+    "to", "amend", "the", "Act", "provide", "for", "improve", "establish", "program", "Federal", "State", "and", "require",
+    "Secretary", "of", "grants", "certain", "other", "purposes", "support", "public", "health", "safety", "infrastructure",
+)
+
+
+def members(chamber, count):
+    # A stable set of synthetic legislators for one chamber.
+    people = []
+    for i in range(count):
+        rng = random.Random("%s%d" % (chamber, i))
+        state = STATES[i % len(STATES)]
+        people.append({
+            "bioguide": "%s%06d" % (chamber.upper(), i),
+            "lis": "S%03d" % i,
+            "first": rng.choice(FIRST_NAMES),
+            "last": LAST_NAMES[i % len(LAST_NAMES)] + ("" if i < len(LAST_NAMES) else "-" + LAST_NAMES[(i // len(LAST_NAMES)) % len(LAST_NAMES)]),
+            "party": rng.choice("DDRRI") if chamber == "s" else rng.choice("DR"),
+            "state": state,
+            "district": str(i // len(STATES) + 1),
+        })
+    return people
+
+
+REPRESENTATIVES = members("h", 441)
+SENATORS = members("s", 100)
+
+
+def full_name(person, chamber):
+    if chamber == "h":
+        return "Rep. %s, %s [%s-%s-%s]" % (person["last"], person["first"], person["party"], person["state"], person["district"])
+    return "Sen. %s, %s [%s-%s]" % (person["last"], person["first"], person["party"], person["state"])
+
+
+def words(rng, n):
+    return " ".join(rng.choice(WORDS) for i in range(n))
+
+
+def date_after(rng, date, days):
+    return date + datetime.timedelta(days=rng.randint(1, days))
+
+
+# Actions
+
+
+def actions_for(rng, congress, bill_type, number, introduced, committee, stage):
+    # Returns the actions in chronological order as tuples of
+    # (date, time, text, action code, source system code, source name, committee).
+    # stage is how far the bill got: 0 introduced, 1 reported, 2 passed the
+    # originating chamber, 3 passed both chambers, 4 enacted.
+    house = bill_type.startswith("h")
+    is_bill = bill_type in ("hr", "s", "hjres", "sjres")
+    code, name = committee
+    date = introduced
+    actions = []
+
+    def add(text, action_code="", source=("9", "Library of Congress"), committee=None, time=None):
+        actions.append((date, time, text, action_code, source[0], source[1], committee))
+
+    if house:
+        add("Introduced in House", "Intro-H")
+        add("Referred to the House Committee on %s." % name, "H11100", ("2", "House floor actions"), committee)
+    else:
+        add("Introduced in Senate", "10000")
+        add("Read twice and referred to the Committee on %s." % name, "", ("0", "Senate"), committee)
+
+    if stage >= 1:
+        date = date_after(rng, date, 60)
+        if house:
+            add("Ordered to be Reported by Voice Vote.", "H19000", ("1", "House committee actions"), committee)
+            date = date_after(rng, date, 20)
+            add("Reported by the Committee on %s. H. Rept. %d-%d." % (name, congress, rng.randint(1, 700)), "H12200", ("2", "House floor actions"), committee)
+            add("Placed on the Union Calendar, Calendar No. %d." % rng.randint(1, 500), "H12410", ("2", "House floor actions"))
+        else:
+            add("Committee on %s. Reported by Senator %s without amendment. Without written report." % (name, rng.choice(SENATORS)["last"]), "", ("0", "Senate"), committee)
+            add("Placed on Senate Legislative Calendar under General Orders. Calendar No. %d." % rng.randint(1, 600), "", ("0", "Senate"))
+
+    if stage >= 2:
+        date = date_after(rng, date, 30)
+        if house:
+            yeas = rng.randint(218, 420)
+            what = "the bill" if is_bill else "the resolution"
+            add("On passage Passed by the Yeas and Nays: %d - %d (Roll no. %d)." % (yeas, 430 - yeas, rng.randint(1, 500)) if is_bill
+                else "On agreeing to %s Agreed to by voice vote." % what,
+                "H37100" if is_bill else "H37300", ("2", "House floor actions"), time="%02d:%02d:00" % (rng.randint(10, 22), rng.randint(0, 59)))
+        else:
+            add("Passed Senate without amendment by Unanimous Consent." if is_bill
+                else "Submitted in the Senate. The resolution was agreed to without amendment by Unanimous Consent.",
+                "", ("0", "Senate"))
+
+    if stage >= 3:
+        date = date_after(rng, date, 30)
+        if house:
+            add("Received in the Senate.", "", ("0", "Senate"))
+            date = date_after(rng, date, 30)
+            add("Passed Senate without amendment by Unanimous Consent.", "", ("0", "Senate"))
+        else:
+            add("Received in the House.", "H14000", ("2", "House floor actions"))
+            date = date_after(rng, date, 30)
+            add("On motion to suspend the rules and pass the bill Agreed to by voice vote.", "H30000", ("2", "House floor actions"),
+                time="%02d:%02d:00" % (rng.randint(10, 22), rng.randint(0, 59)))
+
+    if stage >= 4:
+        date = date_after(rng, date, 10)
+        add("Presented to President.", "28000")
+        date = date_after(rng, date, 10)
+        add("Signed by President.", "36000")
+        add("Became Public Law No: %d-%d." % (congress, rng.randint(1, 350)), "36000")
+
+    return actions
+
+
+def stage_for(rng, bill_type):
+    r = rng.random()
+    if bill_type in ("hr", "s", "hjres", "sjres"):
+        return 0 if r < .7 else 1 if r < .85 else 2 if r < .93 else 3 if r < .97 else 4
+    if bill_type in ("hconres", "sconres"):
+        return 0 if r < .8 else 1 if r < .9 else 2 if r < .95 else 3
+    return 0 if r < .6 else 1 if r < .7 else 2
+
+
+# BILLSTATUS XML
+
+
+def billstatus_xml(rng, congress, bill_type, number, schema):
+    v3 = (schema == "3.0.0")
+    house = bill_type.startswith("h")
+    chamber = "h" if house else "s"
+    year = 1787 + 2 * congress
+    introduced = datetime.date(year, 1, 3) + datetime.timedelta(days=rng.randint(0, 600))
+    committee = rng.choice(HOUSE_COMMITTEES if house else SENATE_COMMITTEES)
+    stage = stage_for(rng, bill_type)
+    actions = actions_for(rng, congress, bill_type, number, introduced, committee, stage)
+    last_date = actions[-1][0]
+    update_date = "%sT%02d:%02d:%02dZ" % (date_after(rng, last_date, 30).isoformat(), rng.randint(0, 23), rng.randint(0, 59), rng.randint(0, 59))
+    sponsor = rng.choice(REPRESENTATIVES if house else SENATORS)
+    out = []
+    w = out.append
+
+    def tag(name, value, indent):
+        if value is None or value == "":
+            w("%s<%s/>\n" % (indent, name))
+        else:
+            w("%s<%s>%s</%s>\n" % (indent, name, escape(str(value)), name))
+
+    w('<?xml version="1.0" encoding="utf-8"?>\n<billStatus>\n')
+    if v3:
+        w("  <version>3.0.0</version>\n")
+    w("  <bill>\n")
+    if v3:
+        tag("number", number, "    ")
+        tag("type", bill_type.upper(), "    ")
+    else:
+        tag("billNumber", number, "    ")
+        tag("billType", bill_type.upper(), "    ")
+    tag("updateDate", update_date, "    ")
+    tag("originChamber", "House" if house else "Senate", "    ")
+    tag("introducedDate", introduced.isoformat(), "    ")
+    tag("congress", congress, "    ")
+
+    # Committees.
+    w("    <committees>\n")
+    if not v3:
+        w("      <billCommittees>\n")
+    w("        <item>\n")
+    tag("systemCode", committee[0], "          ")
+    tag("name", committee[1] + " Committee", "          ")
+    tag("chamber", "House" if house else "Senate", "          ")
+    tag("type", "Standing", "          ")
+    w("          <activities>\n")
+    for activity in (["Reported by", "Markup by"] if stage >= 1 else []) + ["Referred to"]:
+        w("            <item>\n")
+        tag("name", activity, "              ")
+        tag("date", introduced.isoformat() + "T12:00:00Z", "              ")
+        w("            </item>\n")
+    w("          </activities>\n")
+    w("        </item>\n")
+    if not v3:
+        w("      </billCommittees>\n")
+    w("    </committees>\n")
+
+    # Related bills.
+    if rng.random() < .3:
+        w("    <relatedBills>\n")
+        for i in range(rng.randint(1, 3)):
+            other = rng.choice(BILL_TYPES)[0]
+            w("      <item>\n")
+            tag("title", words(rng, 6), "        ")
+            tag("congress", congress, "        ")
+            tag("number", rng.randint(1, 5000), "        ")
+            tag("type", other.upper(), "        ")
+            w("        <relationshipDetails>\n          <item>\n")
+            tag("type", rng.choice(("Related bill", "Identical bill", "Procedurally-related")), "            ")
+            tag("identifiedBy", rng.choice(("CRS", "House", "Senate")), "            ")
+            w("          </item>\n        </relationshipDetails>\n")
+            w("      </item>\n")
+        w("    </relatedBills>\n")
+
+    # Actions, newest first as in the bulk data.
+    w("    <actions>\n")
+    for date, time, text, action_code, source_code, source_name, committee_node in reversed(actions):
+        w("      <item>\n")
+        tag("actionDate", date.isoformat(), "        ")
+        if time:
+            tag("actionTime", time, "        ")
+        tag("text", text, "        ")
+        if action_code:
+            tag("actionCode", action_code, "        ")
+        w("        <sourceSystem>\n")
+        tag("code", source_code, "          ")
+        tag("name", source_name, "          ")
+        w("        </sourceSystem>\n")
+        if committee_node:
+            if v3:
+                w("        <committees>\n          <item>\n")
+                tag("systemCode", committee_node[0], "            ")
+                tag("name", committee_node[1] + " Committee", "            ")
+                w("          </item>\n        </committees>\n")
+            else:
+                w("        <committee>\n")
+                tag("systemCode", committee_node[0], "          ")
+                tag("name", committee_node[1] + " Committee", "          ")
+                w("        </committee>\n")
+        w("      </item>\n")
+    w("    </actions>\n")
+
+    # Sponsor and cosponsors.
+    w("    <sponsors>\n      <item>\n")
+    tag("bioguideId", sponsor["bioguide"], "        ")
+    tag("fullName", full_name(sponsor, chamber), "        ")
+    tag("firstName", sponsor["first"], "        ")
+    tag("lastName", sponsor["last"], "        ")
+    tag("party", sponsor["party"], "        ")
+    tag("state", sponsor["state"], "        ")
+    if house:
+        tag("district", sponsor["district"], "        ")
+    if v3:
+        tag("isByRequest", "N", "        ")
+    else:
+        tag("byRequestType", None, "        ")
+    w("      </item>\n    </sponsors>\n")
+
+    cosponsor_count = min(int(rng.expovariate(1 / 6.0)), 250)
+    if cosponsor_count:
+        w("    <cosponsors>\n")
+        for person in rng.sample(REPRESENTATIVES if house else SENATORS, min(cosponsor_count, 99)):
+            w("      <item>\n")
+            tag("bioguideId", person["bioguide"], "        ")
+            tag("fullName", full_name(person, chamber), "        ")
+            tag("firstName", person["first"], "        ")
+            tag("lastName", person["last"], "        ")
+            tag("party", person["party"], "        ")
+            tag("state", person["state"], "        ")
+            if house:
+                tag("district", person["district"], "        ")
+            tag("sponsorshipDate", date_after(rng, introduced, 90).isoformat(), "        ")
+            tag("isOriginalCosponsor", rng.choice(("True", "False")), "        ")
+            w("      </item>\n")
+        w("    </cosponsors>\n")
+
+    # Amendments, occasionally many of them.
+    amendment_count = 0
+    if stage >= 2 and rng.random() < .3:
+        amendment_count = min(int(rng.expovariate(1 / 8.0)) + 1, 400)
+    if amendment_count:
+        w("    <amendments>\n")
+        for i in range(amendment_count):
+            amendment_chamber = rng.choice("hs")
+            offered = date_after(rng, introduced, 200)
+            amendment_sponsor = rng.choice(REPRESENTATIVES if amendment_chamber == "h" else SENATORS)
+            w("      <amendment>\n")
+            tag("number", number * 10 + i, "        ")
+            tag("congress", congress, "        ")
+            tag("type", amendment_chamber.upper() + "AMDT", "        ")
+            tag("purpose", words(rng, 10), "        ")
+            tag("updateDate", update_date, "        ")
+            tag("submittedDate", offered.isoformat() + "T05:00:00Z", "        ")
+            w("        <sponsors>\n          <item>\n")
+            tag("bioguideId", amendment_sponsor["bioguide"], "            ")
+            tag("fullName", full_name(amendment_sponsor, amendment_chamber), "            ")
+            tag("state", amendment_sponsor["state"], "            ")
+            if amendment_chamber == "h":
+                tag("district", amendment_sponsor["district"], "            ")
+            w("          </item>\n        </sponsors>\n")
+            w("        <amendedBill>\n")
+            tag("congress", congress, "          ")
+            tag("type", bill_type.upper(), "          ")
+            tag("number", number, "          ")
+            w("        </amendedBill>\n")
+            w("        <actions>\n          <actions>\n            <item>\n")
+            tag("actionDate", date_after(rng, offered, 5).isoformat(), "              ")
+            if amendment_chamber == "s":
+                tag("text", "Amendment SA %d agreed to in Senate by Voice Vote." % (number * 10 + i), "              ")
+            else:
+                tag("text", "On agreeing to the %s amendment (A%03d) Agreed to by voice vote." % (amendment_sponsor["last"], i + 1), "              ")
+            w("              <sourceSystem>\n")
+            tag("code", "9", "                ")
+            tag("name", "Library of Congress", "                ")
+            w("              </sourceSystem>\n")
+            w("            </item>\n          </actions>\n        </actions>\n")
+            w("      </amendment>\n")
+        w("    </amendments>\n")
+
+    # Titles.
+    short_title = "%s %s Act of %d" % (rng.choice(LAST_NAMES), rng.choice(("Protection", "Improvement", "Reform", "Access", "Security")), year)
+    official_title = "To %s." % words(rng, rng.randint(8, 30))
+    w("    <titles>\n")
+    for title_type, title in (("Display Title", short_title), ("Short Titles as Introduced", short_title), ("Official Title as Introduced", official_title)):
+        w("      <item>\n")
+        tag("titleType", title_type, "        ")
+        tag("title", title, "        ")
+        w("      </item>\n")
+    w("    </titles>\n")
+
+    # Subjects and policy area.
+    policy_area = rng.choice(SUBJECTS)
+    subjects = rng.sample(LEGISLATIVE_SUBJECTS, rng.randint(0, 8))
+    w("    <subjects>\n")
+    if not v3:
+        w("      <billSubjects>\n")
+    if subjects:
+        w("        <legislativeSubjects>\n")
+        for subject in subjects:
+            w("          <item>\n")
+            tag("name", subject, "            ")
+            w("          </item>\n")
+        w("        </legislativeSubjects>\n")
+    elif not v3:
+        w("        <legislativeSubjects/>\n")
+    w("        <policyArea>\n")
+    tag("name", policy_area, "          ")
+    w("        </policyArea>\n")
+    if not v3:
+        w("      </billSubjects>\n")
+    w("    </subjects>\n")
+    w("    <policyArea>\n")
+    tag("name", policy_area, "      ")
+    w("    </policyArea>\n")
+
+    # Summaries. The 1.0 schema always has at least one.
+    summary_count = rng.choice((0, 1, 1, 1, 2, 3) if v3 else (1, 1, 1, 2, 3))
+    if summary_count:
+        w("    <summaries>\n")
+        if not v3:
+            w("      <billSummaries>\n")
+        for i in range(summary_count):
+            w("        <%s>\n" % ("summary" if v3 else "item"))
+            tag("actionDate", introduced.isoformat(), "          ")
+            tag("actionDesc", "Introduced in House" if house else "Introduced in Senate", "          ")
+            tag("updateDate", "%sT1%d:00:00Z" % (date_after(rng, introduced, 100).isoformat(), i), "          ")
+            w("          <text><![CDATA[<p><strong>%s</strong></p> <p>This bill %s.</p>]]></text>\n" % (escape(short_title), escape(words(rng, rng.randint(20, 200)))))
+            w("        </%s>\n" % ("summary" if v3 else "item"))
+        if not v3:
+            w("      </billSummaries>\n")
+        w("    </summaries>\n")
+
+    w("  </bill>\n</billStatus>\n")
+    return "".join(out), update_date, amendment_count
+
+
+# Roll call votes
+
+
+def house_vote_xml(rng, congress, session_year, number):
+    date = datetime.date(int(session_year), 1, 3) + datetime.timedelta(days=number * 300 // 1000)
+    out = ['<?xml version="1.0" encoding="UTF-8"?>\n<rollcall-vote>\n<vote-metadata>\n']
+    out.append("<congress>%d</congress>\n<rollcall-num>%d</rollcall-num>\n" % (congress, number))
+    out.append("<legis-num>H R %d</legis-num>\n<vote-question>On Passage</vote-question>\n<vote-type>YEA-AND-NAY</vote-type>\n" % rng.randint(1, 9000))
+    out.append("<vote-result>Passed</vote-result>\n<action-date>%s</action-date>\n" % date.strftime("%d-%b-%Y").lstrip("0"))
+    out.append("<action-time>%d:%02d PM</action-time>\n<vote-desc>%s</vote-desc>\n</vote-metadata>\n<vote-data>\n" % (rng.randint(1, 9), rng.randint(0, 59), escape(words(rng, 6))))
+    for person in REPRESENTATIVES[:435]:
+        out.append('<recorded-vote><legislator name-id="%s" sort-field="%s" unaccented-name="%s" party="%s" state="%s" role="legislator">%s</legislator><vote>%s</vote></recorded-vote>\n' % (
+            person["bioguide"], person["last"], person["last"], person["party"], person["state"], person["last"], rng.choice(("Yea", "Yea", "Nay", "Nay", "Not Voting"))))
+    out.append("</vote-data>\n</rollcall-vote>\n")
+    return "".join(out)
+
+
+def senate_vote_xml(rng, congress, session_year, number):
+    date = datetime.date(int(session_year), 1, 3) + datetime.timedelta(days=number * 300 // 1000)
+    out = ['<?xml version="1.0" encoding="UTF-8"?>\n<roll_call_vote>\n']
+    out.append("<congress>%d</congress>\n<congress_year>%s</congress_year>\n<vote_number>%d</vote_number>\n" % (congress, session_year, number))
+    out.append("<vote_date>%s, %d:%02d AM</vote_date>\n" % (date.strftime("%B %d, %Y"), rng.randint(1, 11), rng.randint(0, 59)))
+    out.append("<vote_question_text>On Passage of the Bill S. %d</vote_question_text>\n<question>On Passage of the Bill</question>\n" % rng.randint(1, 5000))
+    out.append("<vote_title>%s</vote_title>\n<majority_requirement>1/2</majority_requirement>\n<vote_result>Bill Passed</vote_result>\n" % escape(words(rng, 6)))
+    out.append("<vote_result_text>Bill Passed</vote_result_text>\n<members>\n")
+    for person in SENATORS:
+        out.append("<member><member_full>%s (%s-%s)</member_full><last_name>%s</last_name><first_name>%s</first_name><party>%s</party><state>%s</state><vote_cast>%s</vote_cast><lis_member_id>%s</lis_member_id></member>\n" % (
+            person["last"], person["party"], person["state"], person["last"], person["first"], person["party"], person["state"], rng.choice(("Yea", "Nay", "Not Voting")), person["lis"]))
+    out.append("</members>\n</roll_call_vote>\n")
+    return "".join(out)
+
+
+# Output
+
+
+def write(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        f.write(content)
+
+
+def bill_counts(total, congresses):
+    # How many of each bill type to make in each Congress.
+    counts = {}
+    for i, congress in enumerate(congresses):
+        for bill_type, share in BILL_TYPES:
+            counts[(congress, bill_type)] = max(1, int(round(total * share / len(congresses))))
+    return counts
+
+
+def generate_bills(options, root, congresses, counts):
+    data_dir = os.path.join(root, "data")
+    sitemap_dir = os.path.join(root, "cache", "govinfo", "sitemap", "BILLSTATUS-bulkdata")
+    schema = options.get("schema", "mixed")
+    processed = float(options.get("processed", .9))
+    seed = options.get("seed", "0")
+
+    index = []
+    stats = {"bills": 0, "amendments": 0, "bytes": 0}
+    for congress in congresses:
+        for bill_type, share in BILL_TYPES:
+            entries = []
+            for number in range(1, counts[(congress, bill_type)] + 1):
+                rng = random.Random("%s-%s%d-%d" % (seed, bill_type, number, congress))
+                bill_schema = schema if schema != "mixed" else ("3.0.0" if congress >= 118 else "1.0")
+                body, lastmod, amendments = billstatus_xml(rng, congress, bill_type, number, bill_schema)
+
+                bill_dir = os.path.join(data_dir, str(congress), "bills", bill_type, "%s%d" % (bill_type, number))
+                write(os.path.join(bill_dir, "fdsys_billstatus.xml"), body)
+                write(os.path.join(bill_dir, "fdsys_billstatus-lastmod.txt"), lastmod)
+                if rng.random() < processed:
+                    write(os.path.join(bill_dir, "data-fromfdsys-lastmod.txt"), lastmod)
+                entries.append(("https://www.govinfo.gov/bulkdata/BILLSTATUS/%d/%s/BILLSTATUS-%d%s%d.xml" % (congress, bill_type, congress, bill_type, number), lastmod))
+
+                stats["bills"] += 1
+                stats["amendments"] += amendments
+                stats["bytes"] += len(body)
+
+            # The sitemap of this Congress and bill type, with its lastmod
+            # recorded as govinfo does so that it is read from the cache.
+            sitemap_lastmod = max(lastmod for url, lastmod in entries)
+            name = "%d%s" % (congress, bill_type)
+            write(os.path.join(sitemap_dir, name, "sitemap.xml"), sitemap_xml("urlset", "url", entries))
+            write(os.path.join(sitemap_dir, name, "sitemap-lastmod.yaml"), "lastmod: '%s'\n" % sitemap_lastmod)
+            index.append(("https://www.govinfo.gov/sitemap/bulkdata/BILLSTATUS/%s/sitemap.xml" % name, sitemap_lastmod))
+
+    write(os.path.join(sitemap_dir, "sitemap.xml"), sitemap_xml("sitemapindex", "sitemap", index))
+    return stats
+
+
+def sitemap_xml(root_tag, entry_tag, entries):
+    out = ['<?xml version="1.0" encoding="UTF-8"?>\n<%s xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n' % root_tag]
+    for loc, lastmod in entries:
+        out.append("  <%s>\n    <loc>%s</loc>\n    <lastmod>%s</lastmod>\n  </%s>\n" % (entry_tag, escape(loc), lastmod, entry_tag))
+    out.append("</%s>\n" % root_tag)
+    return "".join(out)
+
+
+def generate_votes(options, root, congresses):
+    cache_dir = os.path.join(root, "cache")
+    count = int(options.get("votes", 100))
+    seed = options.get("seed", "0")
+    total = 0
+    for congress in congresses:
+        for session_year in (str(1787 + 2 * congress), str(1788 + 2 * congress)):
+            votes_dir = os.path.join(cache_dir, str(congress), "votes", session_year)
+
+            # The House index page links to pages of 100 votes each.
+            groups = sorted(set((number - 1) // 100 for number in range(1, count + 1)))
+            write(os.path.join(votes_dir, "pages", "house.html"), "<html><body>%s</body></html>\n" % "".join(
+                '<a href="ROLL_%d.asp">Roll Calls %d-%d</a>\n' % (group * 100, group * 100 + 1, group * 100 + 100) for group in groups))
+            for group in groups:
+                write(os.path.join(votes_dir, "pages", "house_%d.html" % (group * 100)), "<html><body><table>%s</table></body></html>\n" % "".join(
+                    '<tr><td><a href="http://clerk.house.gov/cgi-bin/vote.asp?year=%s&amp;rollnumber=%d">%d</a></td></tr>\n' % (session_year, number, number)
+                    for number in range(group * 100 + 1, min(count, group * 100 + 100) + 1)))
+
+            write(os.path.join(votes_dir, "pages", "senate.xml"),
+                "<vote_summary>\n<congress>%d</congress>\n<congress_year>%s</congress_year>\n<votes>\n%s</votes>\n</vote_summary>\n" % (
+                    congress, session_year, "".join("<vote><vote_number>%05d</vote_number></vote>\n" % number for number in range(count, 0, -1))))
+
+            for number in range(1, count + 1):
+                rng = random.Random("%s-vote-%d-%s-%d" % (seed, congress, session_year, number))
+                write(os.path.join(votes_dir, "h%d" % number, "h%d.xml" % number), house_vote_xml(rng, congress, session_year, number))
+                write(os.path.join(votes_dir, "s%d" % number, "s%d.xml" % number), senate_vote_xml(rng, congress, session_year, number))
+                total += 2
+    return total
+
+
+def main():
+    options = parse_options(sys.argv[1:])
+    root = options.get("root", "synthetic")
+    start, end = (options.get("congresses", "115-117").split("-") + [None])[:2]
+    congresses = list(range(int(start), int(end or start) + 1))
+    total = int(options.get("bills", 1000))
+
+    stats = generate_bills(options, root, congresses, bill_counts(total, congresses))
+    print("Wrote %d bills with %d amendments (%.1f MB of BILLSTATUS XML) to %s." % (stats["bills"], stats["amendments"], stats["bytes"] / 1000000, root))
+    votes = generate_votes(options, root, congresses)
+    print("Wrote %d roll call votes." % votes)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,8 @@
 # -*- coding: utf-8 -*-
 """
 A module that monkey-patches the output_bill method to push the bill identifier
-onto a task queue after the data file has been written to disk. To use this
+onto a task queue after the data file has been written to disk (and not when
+the file was left alone because nothing in it changed). To use this
 module, invoke the bills scraper with the --patch option like so:
 
   usc-run bills --patch=contrib.beanstalkd
@@ -76,6 +77,8 @@ def process_bill_wrapper(process_bill):
     @wraps(process_bill)
     def _process_bill(bill, options, *args, **kwargs):
         orig_result = process_bill(bill, options, *args, **kwargs)
+        if orig_result.get('unchanged'):
+            return orig_result
 
         (conn, config) = init_guard()
         for _ in range(2):
@@ -101,6 +104,8 @@ def process_amendment_wrapper(process_amendment):
     @wraps(process_amendment)
     def _process_amendment(amdt_dict, bill_id, options, *args, **kwargs):
         orig_result = process_amendment(amdt_dict, bill_id, options, *args, **kwargs)
+        if orig_result is False:
+            return orig_result
         amdt = amendment_info.build_amendment_id(amdt_dict['type'].lower(), amdt_dict['number'], amdt_dict['congress'])
 
         (conn, config) = init_guard()
@@ -127,6 +132,8 @@ def output_vote_wrapper(output_vote):
     @wraps(output_vote)
     def _output_vote(vote, options, *args, **kwargs):
         orig_result = output_vote(vote, options, *args, **kwargs)
+        if orig_result is False:
+            return orig_result
 
         (conn, config) = init_guard()
         for _ in range(2):
@@ -2,25 +2,83 @@
 
 import sys
 import os
-import traceback
-import pprint as pp
 import logging
 import importlib
 
 # set global HTTP timeouts to 10 seconds
 import socket
 
-def main():
-    socket.setdefaulttimeout(10)
-
-    CONGRESS_ROOT = os.path.dirname(os.path.abspath(__file__))
-
-    # name of the task comes first
-    task_name = sys.argv[1]
-
+# The tasks that can be run with usc-run, mapped to the modules that implement
+# them. A task module is only imported when its task is run, so that a short
+# run doesn't pay for importing every task's dependencies.
+TASKS = {
+    "adler_wilkerson_bills": "congress.tasks.adler_wilkerson_bills",
+    "bills": "congress.tasks.bills",
+    "cache_store": "congress.tasks.cache_store",
+    "committee_meetings": "congress.tasks.committee_meetings",
+    "daemon": "congress.tasks.daemon",
+    "govinfo": "congress.tasks.govinfo",
+    "http_archive": "congress.tasks.http_archive",
+    "nomination_info": "congress.tasks.nomination_info",
+    "nominations": "congress.tasks.nominations",
+    "pack_cache": "congress.tasks.pack_cache",
+    "statutes": "congress.tasks.statutes",
+    "upcoming_house_floor": "congress.tasks.upcoming_house_floor",
+    "votes": "congress.tasks.votes",
+    "voteview": "congress.tasks.voteview",
+}
+
+
+def load_task(task_name):
+    if task_name not in TASKS:
+        raise ValueError("Unknown task %s (run usc-run --list-tasks to see the tasks)." % task_name)
+    return importlib.import_module(TASKS[task_name])
+
+
+def split_task_names(task_name):
+    # A task name like govinfo+bills chains tasks together.
+    task_names = task_name.split("+")
+    for name in task_names:
+        if name not in TASKS:
+            raise ValueError("Unknown task %s (run usc-run --list-tasks to see the tasks)." % name)
+    return task_names
+
+
+def run_tasks(task_names, options):
+    # Run the tasks one after the other in this process. When a task's run()
+    # returns something other than None, the next task gets it as
+    # options["handoff"] (e.g. govinfo hands bills the files it downloaded).
+    from congress.tasks import utils
+
+    utils.use_http_archive(options)
+    utils.start_download_memo(options)
+    utils.start_http_stats()
+    utils.start_write_behind(options)
+    utils.start_manifest(options)
+    handoff = None
+    try:
+        for task_name in task_names:
+            task_options = dict(options)
+            if handoff is not None:
+                task_options["handoff"] = handoff
+            handoff = load_task(task_name).run(task_options)
+            # With --write_behind, the task's files are on disk before the
+            # next task starts.
+            utils.flush_writes()
+    finally:
+        utils.stop_write_behind()
+        # With --manifest, publish the list of files that changed.
+        utils.finish_manifest()
+        utils.stop_download_memo()
+        # Summarize the requests made to each website.
+        utils.log_http_stats()
+    return handoff
+
+
+def parse_options(args):
     # parse any command line flags off
     options = {}
-    for arg in sys.argv[2:]:
+    for arg in args:
         if arg.startswith("--"):
 
             if "=" in arg:
@@ -34,8 +92,22 @@ def main():
             elif value == 'False':
                 value = False
             options[key.lower()] = value
+    return options
 
 
+def main():
+    socket.setdefaulttimeout(10)
+
+    if len(sys.argv) < 2 or sys.argv[1] == "--list-tasks":
+        for task_name in sorted(TASKS):
+            print(task_name)
+        return
+
+    # name of the task comes first
+    task_name = sys.argv[1]
+
+    options = parse_options(sys.argv[2:])
+
     # configure logging
     if options.get('debug', False):
         log_level = "debug"
@@ -51,13 +123,17 @@ def main():
     else:
         logging.basicConfig(format='%(message)s', level=log_level.upper())
 
+    try:
+        task_names = split_task_names(task_name)
+    except ValueError as e:
+        logging.error("%s The tasks are: %s." % (e, ", ".join(sorted(TASKS))))
+        sys.exit(1)
 
+    CONGRESS_ROOT = os.path.dirname(os.path.abspath(__file__))
     sys.path.append(os.path.join(CONGRESS_ROOT, "tasks"))
-    import utils
+    from congress.tasks import utils
 
     try:
-        task_mod = __import__(task_name)
-
         if 'patch' in options:
             patch_mod = importlib.import_module(options['patch'])
             patch_func = getattr(patch_mod, 'patch', None)
@@ -68,9 +144,10 @@ def main():
                 logging.error("You specified a --patch argument but {}.patch is not callable".format(options['patch']))
                 sys.exit(1)
             else:
-                patch_mod.patch(task_name)
+                for name in task_names:
+                    patch_mod.patch(name)
 
-        task_mod.run(options)
+        run_tasks(task_names, options)
     except Exception as exception:
         utils.admin(exception)
 
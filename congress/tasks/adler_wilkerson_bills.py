@@ -11,14 +11,15 @@ from congress.tasks import utils
 
 def run(options):
     # Download the TSV file.
-    cache_zip_path = "adler-wilkerson-bills.zip"
+    # It is opened from disk, so it doesn't go into the cache store.
+    cache_zip_path = utils.cache_dir() + "/adler-wilkerson-bills.zip"
     utils.download(
         "http://congressionalbills.org/billfiles/bills80-92.zip",
         cache_zip_path,
-        utils.merge(options, {'binary': True, 'needs_content': False}))
+        utils.merge(options, {'binary': True, 'needs_content': False, 'to_cache': False}))
 
     # Unzip in memory and process the records.
-    zfile = zipfile.ZipFile(utils.cache_dir() + "/" + cache_zip_path)
+    zfile = zipfile.ZipFile(cache_zip_path)
     csvreader = csv.DictReader(zfile.open("bills80-92.txt"), delimiter="\t")
     for record in csvreader:
         rec = process_bill(record)
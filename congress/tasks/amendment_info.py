@@ -2,7 +2,6 @@ import re
 import logging
 import datetime
 import time
-import json
 from lxml import etree
 
 from congress.tasks import utils
@@ -16,13 +15,15 @@ def process_amendment(amdt_data, bill_id, options):
     logging.info("[%s] Saving %s to %s..." % (bill_id, amdt['amendment_id'], path))
 
     # output JSON - so easy!
-    utils.write(
-        json.dumps(amdt, sort_keys=True, indent=2, default=utils.format_datetime),
+    wrote_json = utils.write(
+        utils.json_dumps(amdt),
         path
     )
 
-    with open(output_for_amdt(amdt['amendment_id'], "xml"), 'wb') as xml_file:
-        xml_file.write(create_govtrack_xml(amdt, options))
+    wrote_xml = utils.write(create_govtrack_xml(amdt, options), output_for_amdt(amdt['amendment_id'], "xml"))
+
+    # False if the amendment didn't change.
+    return wrote_json or wrote_xml
 
 def build_amendment_json_dict(amdt_dict, options):
     # good set of tests for each situation:
@@ -1,3 +1,4 @@
+import itertools
 import json
 import logging
 import os
@@ -19,21 +20,36 @@ def run(options):
     if bill_id:
         to_fetch = bill_id.split(",")
     else:
-        if options.get("matching_action_regex"):
-            options["matching_action_regex"] = re.compile(options["matching_action_regex"])
+        if "handoff" in options:
+            # Chained after govinfo (usc-run govinfo+bills), which hands us
+            # the files it just downloaded, so there is no need to scan the
+            # data directory for bills that changed. Bills that an earlier
+            # chained run failed on (or didn't get to) are retried too.
+            to_fetch = add_pending_bills(get_bills_in_paths(options["handoff"], options), options)
+        else:
+            if options.get("matching_action_regex"):
+                options["matching_action_regex"] = re.compile(options["matching_action_regex"])
+
+            # This is a generator, so bills are found (and the limit applied)
+            # as they are processed rather than all up front.
+            to_fetch = get_bills_to_process(options)
 
-        to_fetch = get_bills_to_process(options)
+        limit = options.get('limit', None)
+        if limit:
+            to_fetch = itertools.islice(to_fetch, int(limit))
 
-        if not to_fetch:
+        to_fetch = utils.peek(to_fetch)
+        if to_fetch is None:
             logging.warn("No bills changed.")
             return None
 
-        limit = options.get('limit', None)
-        if limit:
-            to_fetch = to_fetch[:int(limit)]
-
     utils.process_set(to_fetch, processor_func, options)
 
+    if "handoff" in options and not bill_id:
+        # Keep the bills that are still out of date for the next run.
+        utils.flush_writes()
+        save_pending_bills(list(filter(bill_is_stale, load_pending_bills(options))), options)
+
 
 def get_bills_to_process(options):
     # Return a generator over bill_ids that need to be processed.
@@ -98,6 +114,10 @@ def get_bills_to_process(options):
 
                 bill_id = bill_type_and_number + "-" + congress
 
+                # With --shard, leave the bills of other shards alone.
+                if not utils.in_shard(bill_id, options):
+                    continue
+
                 if options.get("matching_action_regex"):
                     # Include bills that have an action that matches a regular expression.
                     fn = get_data_path(congress, bill_type, bill_type_and_number, "data.json")
@@ -118,13 +138,99 @@ def get_bills_to_process(options):
                     if bulkfile_lastmod != parse_lastmod or options.get("force"):
                         yield bill_id
 
+def get_bills_in_paths(paths, options):
+    # Return a generator over the bill_ids of the GovInfo bill status files
+    # among paths, in the order get_bills_to_process would return them.
+    congresses = None
+    if options.get('congress'):
+        congresses = set(options['congress'].split(','))
+    bill_ids = []
+    for path in paths:
+        if os.path.basename(path) != govinfo.FDSYS_BILLSTATUS_FILENAME:
+            continue
+        # data/{congress}/bills/{billtype}/{billtypenumber}/fdsys_billstatus.xml
+        congress, _, bill_type, bill_type_and_number = path.split("/")[-5:-1]
+        if congresses is not None and congress not in congresses:
+            continue
+        bill_ids.append((int(congress), bill_type, int(bill_type_and_number.replace(bill_type, "")), bill_type_and_number + "-" + congress))
+    for congress, bill_type, number, bill_id in sorted(bill_ids):
+        yield bill_id
+
+
+def bill_sort_key(bill_id):
+    bill_type, number, congress = utils.split_bill_id(bill_id)
+    return (int(congress), bill_type, int(number))
+
+
+def bill_is_stale(bill_id):
+    # Whether the GovInfo bill status file is newer than our data.json, i.e.
+    # its lastmod file differs from the copy saved when it was processed.
+    fn = _path_to_billstatus_file(bill_id)
+    if not os.path.exists(fn):
+        return False
+    bulkfile_lastmod = utils.read(fn.replace(".xml", "-lastmod.txt"))
+    parse_lastmod = utils.read(os.path.join(os.path.dirname(fn), "data-fromfdsys-lastmod.txt"))
+    return bulkfile_lastmod != parse_lastmod
+
+
+# The bills a chained run (govinfo+bills) was handed are listed in
+# cache/journals/bills.pending.txt while it runs, and afterwards the ones
+# still out of date stay listed, so that the next chained run retries the
+# bills this one failed on or was interrupted before.
+def pending_bills_path(options):
+    name = "bills.pending"
+    if utils.get_shard(options):
+        name += "-shard%dof%d" % utils.get_shard(options)
+    return os.path.join(utils.cache_dir(), "journals", name + ".txt")
+
+
+def load_pending_bills(options):
+    path = pending_bills_path(options)
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def save_pending_bills(bill_ids, options):
+    path = pending_bills_path(options)
+    utils.mkdir_p(os.path.dirname(path))
+    with open(path + ".tmp", "w") as f:
+        for bill_id in bill_ids:
+            f.write(bill_id + "\n")
+    os.replace(path + ".tmp", path)
+
+
+def add_pending_bills(bill_ids, options):
+    # Return the bill_ids plus the ones left pending by an earlier run that
+    # are still out of date, in the order get_bills_to_process would return
+    # them, and record them as pending. Pending bills of other congresses
+    # than --congress stay listed.
+    bill_ids = set(bill_ids)
+    others = []
+    congresses = None
+    if options.get('congress'):
+        congresses = set(options['congress'].split(','))
+    for bill_id in load_pending_bills(options):
+        if bill_id in bill_ids or not bill_is_stale(bill_id):
+            continue
+        if congresses is not None and utils.split_bill_id(bill_id)[2] not in congresses:
+            others.append(bill_id)
+        else:
+            bill_ids.add(bill_id)
+    bill_ids = sorted(bill_ids, key=bill_sort_key)
+    save_pending_bills(sorted(set(others) | set(bill_ids), key=bill_sort_key), options)
+    return bill_ids
+
+
 def process_bill(bill_id, options):
     fdsys_xml_path = _path_to_billstatus_file(bill_id)
     logging.info("[%s] Processing %s..." % (bill_id, fdsys_xml_path))
 
     # Read FDSys bulk data file.
     xml_as_dict = read_fdsys_bulk_bill_status_file(fdsys_xml_path, bill_id)
-    bill_data = form_bill_json_dict(xml_as_dict)
+    with utils.trace_stage("transform"):
+        bill_data = form_bill_json_dict(xml_as_dict)
     if isinstance(bill_data, str): # Non-error failure
         return {
             "ok": True,
@@ -133,29 +239,44 @@ def process_bill(bill_id, options):
         }
 
     # Convert and write out data.json and data.xml.
-    utils.write(
-        json.dumps(bill_data, indent=2, sort_keys=True),
+    with utils.trace_stage("serialize"):
+        bill_json = utils.json_dumps(bill_data)
+    wrote_json = utils.write(
+        bill_json,
         os.path.dirname(fdsys_xml_path) + '/data.json',
         {
             "diff": options.get("diff")
         })
 
     from congress.tasks.bill_info import create_govtrack_xml
-    with open(os.path.dirname(fdsys_xml_path) + '/data.xml', 'wb') as xml_file:
-        xml_file.write(create_govtrack_xml(bill_data, options))
+    with utils.trace_stage("serialize"):
+        bill_xml = create_govtrack_xml(bill_data, options)
+    wrote_xml = utils.write(bill_xml, os.path.dirname(fdsys_xml_path) + '/data.xml')
 
+    wrote_amendments = False
     if options.get("amendments", True):
-        process_amendments(bill_id, xml_as_dict, options)
+        with utils.trace_stage("amendments"):
+            wrote_amendments = process_amendments(bill_id, xml_as_dict, options)
 
     # Mark this bulk data file as processed by saving its lastmod
-    # file under a new path.
+    # file under a new path. (With --write_behind, it is written only
+    # once the files above are.)
     utils.write(
         utils.read(_path_to_billstatus_file(bill_id).replace(".xml", "-lastmod.txt")),
         os.path.join(os.path.dirname(fdsys_xml_path), "data-fromfdsys-lastmod.txt"),
         {
-            "diff": options.get("diff")
+            "diff": options.get("diff"),
+            "marker": True,
         })
 
+    if not (wrote_json or wrote_xml or wrote_amendments):
+        return {
+            "ok": True,
+            "saved": False,
+            "unchanged": True,
+            "reason": "unchanged",
+        }
+
     return {
         "ok": True,
         "saved": True,
@@ -166,7 +287,8 @@ def _path_to_billstatus_file(bill_id):
 
 def read_fdsys_bulk_bill_status_file(fn, bill_id):
     fdsys_billstatus = utils.read(fn)
-    return xmltodict.parse(fdsys_billstatus, force_list=('item', 'amendment', 'committeeReport', 'link'))
+    with utils.trace_stage("parse"):
+        return xmltodict.parse(fdsys_billstatus, force_list=('item', 'amendment', 'committeeReport', 'link'))
 
 def form_bill_json_dict(xml_as_dict):
     """
@@ -286,12 +408,16 @@ def output_for_bill(bill_id, format, is_data_dot=True):
     return "%s/%s/bills/%s/%s%s/%s" % (utils.data_dir(), congress, bill_type, bill_type, number, fn)
 
 def process_amendments(bill_id, bill_amendments, options):
+    # Returns whether any of the amendments changed.
     amdt_list = bill_amendments['billStatus']['bill'].get('amendments')
     if amdt_list is None:  # many bills don't have amendments
-        return
+        return False
 
+    wrote = False
     for amdt in amdt_list['amendment']:
-        amendment_info.process_amendment(amdt, bill_id, options)
+        if amendment_info.process_amendment(amdt, bill_id, options):
+            wrote = True
+    return wrote
 
 def reparse_actions(bill_id, options):
     # Load an existing bill status JSON file.
@@ -338,7 +464,7 @@ def reparse_actions(bill_id, options):
             return source != revised
 
     # Write new data.json file.
-    revised = json.dumps(bill_data, indent=2, sort_keys=True)
+    revised = utils.json_dumps(bill_data)
     if confirmer(source, revised, data_json_fn):
       utils.write(revised, data_json_fn)
       wrote_any = True
@@ -350,8 +476,7 @@ def reparse_actions(bill_id, options):
         source = xml_file.read()
     revised = create_govtrack_xml(bill_data, options)
     if confirmer(source, revised.decode("utf8"), data_xml_fn):
-      with open(data_xml_fn, 'wb') as xml_file:
-        xml_file.write(revised)
+      utils.write(revised, data_xml_fn)
       wrote_any = True
 
     return {
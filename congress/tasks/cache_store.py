@@ -0,0 +1,192 @@
+# An optional store for the files that utils.download caches, in place of
+# one file per download under the cache directory. Turn it on in config.yml:
+#
+# output:
+#   cache_store: true
+#
+# or with --cache_store for a single run. The files then go into one SQLite
+# database, cache/store.sqlite (or the path given instead of true). Their
+# contents are compressed (with zstd if the zstandard package is installed,
+# otherwise zlib) and stored once per distinct content, keyed by its SHA-256
+# hash. An index maps each cache path to its content and to the ETag and
+# Last-Modified headers to revalidate it with.
+#
+# Files that are already in the cache directory keep being read from there.
+# To move them into the store, run:
+#
+# usc-run cache_store
+#
+# Options:
+# --delete: remove each file from the cache directory once it is in the store.
+# --gc: afterwards, drop content that no cache path refers to anymore.
+#
+# Files that are read directly rather than through utils.download (ZIP
+# files, the pickles of parsed YAML files, the GovInfo sitemap lastmod files,
+# the process_set journals, ...; see utils.is_read_by_path) stay in the cache
+# directory.
+
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+from congress.tasks import utils
+
+
+def run(options):
+    store = utils.get_cache_store(utils.merge(options, {"cache_store": options.get("cache_store", True)}))
+    root = utils.cache_dir()
+    delete = options.get("delete", False)
+
+    migrated = 0
+    for path in migratable_files(root, store):
+        destination = os.path.relpath(path, root)
+        with open(path, "rb") as f:
+            data = f.read()
+        validators = {}
+        if os.path.exists(path + "-http.json"):
+            with open(path + "-http.json") as f:
+                validators = json.load(f)
+        store.put(destination, data, validators.get("etag"), validators.get("last_modified"), os.path.getmtime(path))
+        migrated += 1
+
+        if delete:
+            os.unlink(path)
+            if os.path.exists(path + "-http.json"):
+                os.unlink(path + "-http.json")
+
+        if migrated % 10000 == 0:
+            logging.warn("Moved %d files into %s..." % (migrated, store.path))
+
+    if delete:
+        remove_empty_directories(root)
+    logging.warn("Moved %d files into %s." % (migrated, store.path))
+
+    if options.get("gc", False):
+        logging.warn("Dropped %d unused blobs." % store.delete_unreferenced())
+
+
+def migratable_files(root, store):
+    store_files = {os.path.abspath(store.path + suffix) for suffix in ("", "-wal", "-shm", "-journal")}
+    for dirpath, dirnames, filenames in os.walk(root):
+        if os.path.relpath(dirpath, root) == ".":
+            dirnames[:] = [d for d in dirnames if d != "journals"]
+        dirnames.sort()
+        for fn in sorted(filenames):
+            path = os.path.join(dirpath, fn)
+            if os.path.abspath(path) in store_files:
+                continue
+            if utils.is_read_by_path(root, path):
+                continue
+            yield path
+
+
+def remove_empty_directories(root):
+    for dirpath, dirnames, filenames in os.walk(root, topdown=False):
+        if dirpath != root and not os.listdir(dirpath):
+            os.rmdir(dirpath)
+
+
+# Compression. zstd is used for new content when it's available. Each blob
+# records how it was compressed, so a store can hold both.
+_zstandard = None
+
+
+def compress(data):
+    global _zstandard
+    if _zstandard is None:
+        try:
+            import zstandard
+            _zstandard = zstandard
+        except ImportError:
+            _zstandard = False
+    if _zstandard:
+        return "zstd", _zstandard.ZstdCompressor(level=10).compress(data)
+    return "zlib", zlib.compress(data, 6)
+
+
+def decompress(codec, data):
+    if codec == "zlib":
+        return zlib.decompress(data)
+    if codec == "zstd":
+        import zstandard
+        return zstandard.ZstdDecompressor().decompress(data)
+    raise ValueError("Unknown codec %s in the cache store." % codec)
+
+
+class CacheStore(object):
+
+    def __init__(self, path):
+        self.path = path
+        self.local = threading.local()
+        self.connect().executescript("""
+            CREATE TABLE IF NOT EXISTS blobs (
+                hash TEXT PRIMARY KEY,
+                codec TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                data BLOB NOT NULL);
+            CREATE TABLE IF NOT EXISTS files (
+                path TEXT PRIMARY KEY,
+                hash TEXT NOT NULL,
+                stored_at REAL NOT NULL,
+                etag TEXT,
+                last_modified TEXT);
+            CREATE INDEX IF NOT EXISTS files_hash ON files (hash);
+        """)
+
+    # Each thread (and each process of a process pool) needs its own
+    # connection.
+    def connect(self):
+        if getattr(self.local, "pid", None) != os.getpid():
+            utils.mkdir_p(os.path.dirname(self.path) or ".")
+            db = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            self.local.db = db
+            self.local.pid = os.getpid()
+        return self.local.db
+
+    def key(self, destination):
+        return os.path.normpath(destination).replace(os.sep, "/")
+
+    def get(self, destination):
+        row = self.connect().execute(
+            "SELECT codec, data FROM files JOIN blobs USING (hash) WHERE path = ?",
+            (self.key(destination),)).fetchone()
+        if row is None:
+            return None
+        return decompress(*row)
+
+    def get_validators(self, destination):
+        row = self.connect().execute(
+            "SELECT etag, last_modified FROM files WHERE path = ?",
+            (self.key(destination),)).fetchone()
+        if row is None:
+            return None
+        return {"etag": row[0], "last_modified": row[1]}
+
+    def put(self, destination, data, etag=None, last_modified=None, stored_at=None):
+        hash = hashlib.sha256(data).hexdigest()
+        db = self.connect()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            if db.execute("SELECT 1 FROM blobs WHERE hash = ?", (hash,)).fetchone() is None:
+                codec, compressed = compress(data)
+                db.execute("INSERT INTO blobs (hash, codec, size, data) VALUES (?, ?, ?, ?)", (hash, codec, len(data), compressed))
+            db.execute(
+                "INSERT OR REPLACE INTO files (path, hash, stored_at, etag, last_modified) VALUES (?, ?, ?, ?, ?)",
+                (self.key(destination), hash, stored_at or time.time(), etag, last_modified))
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        return hash
+
+    def delete_unreferenced(self):
+        db = self.connect()
+        cursor = db.execute("DELETE FROM blobs WHERE hash NOT IN (SELECT hash FROM files)")
+        return cursor.rowcount
@@ -7,9 +7,9 @@ import json
 import lxml.etree
 import uuid
 import logging
-import mechanize
 import zipfile
-import io
+import shutil
+import tempfile
 import requests
 import subprocess
 
@@ -48,12 +48,18 @@ def run(options):
         c["subcommittees"] = dict((s["thomas_id"], s) for s in c.get("subcommittees", []))
 
     if "senate" in chambers:
-        print("Fetching Senate meetings...")
-        meetings = fetch_senate_committee_meetings(committees, options)
-        print("Writing Senate meeting data to disk.")
-        utils.write_json(meetings, output_for("senate"))
+        # The Senate has a single feed, so with --trace it is one item.
+        with utils.trace_item("senate", options):
+            print("Fetching Senate meetings...")
+            meetings = fetch_senate_committee_meetings(committees, options)
+            if meetings is utils.UNCHANGED:
+                print("The Senate meetings have not changed.")
+            else:
+                print("Writing Senate meeting data to disk.")
+                utils.write_json(meetings, output_for("senate"))
 
     if "house" in chambers:
+        # House meetings are traced one event at a time.
         if load_by == None:
             print("Fetching House meetings...")
             meetings = fetch_house_committee_meetings(committees, options)
@@ -61,8 +67,9 @@ def run(options):
             print("Fetching House meetings by event_id...")
             meetings = fetch_meeting_from_event_id(committees, options, load_by)
 
-        print("Writing House meeting data to disk.")
-        utils.write_json(meetings, output_for("house"))
+        with utils.trace_item("house", options):
+            print("Writing House meeting data to disk.")
+            utils.write_json(meetings, output_for("house"))
 
     # Write all meetings to a single file on disk.
 
@@ -84,13 +91,18 @@ def fetch_senate_committee_meetings(committees, options):
     options = dict(options)  # clone
     options["binary"] = True #
     options["force"] = True
+    options["if_changed"] = os.path.exists(output_file)
 
     meetings = []
 
-    dom = lxml.etree.fromstring(utils.download(
+    body = utils.download(
         "https://www.senate.gov/general/committee_schedules/hearings.xml",
         "committee_schedule/senate.xml",
-        options))
+        options)
+    if body is utils.UNCHANGED:
+        return body
+    with utils.trace_stage("parse"):
+        dom = lxml.etree.fromstring(body)
 
     for node in dom.xpath("meeting"):
         committee_id = str(node.xpath('string(cmte_code)'))
@@ -213,7 +225,8 @@ def fetch_house_committee_meetings(committees, options):
             seen_meetings.add(event_id)
 
             # this loads the xml from the page and sends the xml to parse_house_committee_meeting
-            load_xml_from_page(eventurl, options, existing_meetings, committees, event_id, meetings)
+            with utils.trace_item(event_id, options):
+                load_xml_from_page(eventurl, options, existing_meetings, committees, event_id, meetings)
             # if bad zipfile
             if load_xml_from_page == False: continue
 
@@ -240,7 +253,8 @@ def fetch_meeting_from_event_id(committees, options, load_id):
     while current_id <= end_id:
         event_id = str(current_id)
         event_url = "http://docs.house.gov/Committee/Calendar/ByEvent.aspx?EventID=" + event_id
-        load_xml_from_page(event_url, options, existing_meetings, committees, event_id, meetings)
+        with utils.trace_item(event_id, options):
+            load_xml_from_page(event_url, options, existing_meetings, committees, event_id, meetings)
         # bad zipfile
         if load_xml_from_page == False: continue
         current_id += 1
@@ -263,7 +277,8 @@ def load_xml_from_page(eventurl, options, existing_meetings, committees, event_i
 
     # Parse the XML.
     try:
-        meeting = parse_house_committee_meeting(event_id, dom, existing_meetings, committees, options, witnesses, uploaded_documents)
+        with utils.trace_stage("transform"):
+            meeting = parse_house_committee_meeting(event_id, dom, existing_meetings, committees, options, witnesses, uploaded_documents)
         if meeting != None: # an active meeting record
             meetings.append(meeting)
    
@@ -273,9 +288,10 @@ def load_xml_from_page(eventurl, options, existing_meetings, committees, event_i
 
 #look for witnesses and documents in the house meeting package    
 def extract_meeting_package(eventurl, event_id, options):
-    br = mechanize.Browser()
+    br = utils.get_browser()
     # open committee event page
-    br.open(eventurl)
+    with utils.trace_stage("download"):
+        br.open(eventurl)
 
     br.select_form(nr=0)
 
@@ -294,12 +310,23 @@ def extract_meeting_package(eventurl, event_id, options):
     br["__EVENTARGUMENT"] = ""
     
     # get the info
-    request = br.submit()
+    with utils.trace_stage("download"):
+        request = br.submit()
+        if options.get("docs", True):
+            # The package can be big, so spool it to a temporary file
+            # instead of reading it into memory.
+            package_file = tempfile.TemporaryFile()
+            shutil.copyfileobj(request, package_file, utils.DOWNLOAD_CHUNK_SIZE)
+            utils.trace_bytes(bytes_in=package_file.tell())
+        else:
+            body = request.read()
+            utils.trace_bytes(bytes_in=len(body))
 
     # when just downloading the metadata XML, return the DOM and no other info
     if not options.get("docs", True):
         try:
-            dom = lxml.etree.fromstring(request.read())
+            with utils.trace_stage("parse"):
+                dom = lxml.etree.fromstring(body)
         except lxml.etree.XMLSyntaxError as e:
             print(event_id, e)
             return False
@@ -307,27 +334,34 @@ def extract_meeting_package(eventurl, event_id, options):
 
     ## read zipfile
     try:
-        request_bytes = io.BytesIO(request.read())
-        package = zipfile.ZipFile(request_bytes)
+        package = zipfile.ZipFile(package_file)
     except:
+        package_file.close()
         message = "Problem downloading zipfile: %s" % (event_id)
         print(message)
         return False
 
     # save documents in meeting package
-    uploaded_documents = save_documents(package, event_id)
+    with utils.trace_stage("write"):
+        uploaded_documents = save_documents(package, event_id)
     witnesses = None
     # find meeting and witness xml
     for name in package.namelist():
         if ".xml" in name:
             if "WList" in name:
                 bytes = package.read(name)
-                witness_tree = lxml.etree.fromstring(bytes)
-                witness_info = parse_witness_list(witness_tree, uploaded_documents, event_id)
+                with utils.trace_stage("parse"):
+                    witness_tree = lxml.etree.fromstring(bytes)
+                with utils.trace_stage("transform"):
+                    witness_info = parse_witness_list(witness_tree, uploaded_documents, event_id)
                 witnesses = witness_info["hearing_witness_info"]
             else:
                 bytes = package.read(name)
-                dom = lxml.etree.fromstring(bytes)
+                with utils.trace_stage("parse"):
+                    dom = lxml.etree.fromstring(bytes)
+
+    package.close()
+    package_file.close()
 
     # it will return none if there is no witness list in the file
     return {"witnesses": witnesses, "uploaded_documents": uploaded_documents, "dom": dom}
@@ -590,6 +624,7 @@ def save_documents(package, event_id):
             logging.info("saved " + file_name)
             with open(file_name, 'wb') as document_file:
                 document_file.write(bytes)
+            utils.trace_bytes(bytes_out=len(bytes))
             # try to make a text version
             text_doc = text_from_pdf(file_name)
             if text_doc != None:
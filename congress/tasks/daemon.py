@@ -0,0 +1,170 @@
+# Run other tasks on a schedule inside one long-running process.
+#
+# A cron-driven usc-run pays on every run for Python and lxml startup,
+# loading the congress-legislators YAML files, updating the
+# congress-legislators repo, and opening the ZIP files in the cache.
+# The daemon keeps all of that in memory between runs:
+#
+# usc-run daemon
+#
+# The schedule is read from the daemon section of config.yml, or from
+# the YAML file given with --schedule=path. Each entry names a task,
+# how often to run it in minutes, and the options to run it with,
+# written as they would be on the command line:
+#
+# daemon:
+#   - task: govinfo+bills
+#     every: 15
+#     options: --bulkdata=BILLSTATUS --govtrack
+#   - task: votes
+#     every: 5
+#     options: --fast
+#   - task: committee_meetings
+#     every: 60
+#
+# A task is not started again while a previous run of it (with any
+# options) is still going. The next run waits until that one finishes.
+#
+# The legislator indexes and open ZIP files are dropped when their
+# files change. The congress-legislators repo is updated every
+# --legislators_every=minutes (default 60) when no task is running,
+# unless UPDATE_CONGRESS_LEGISLATORS=NO is set.
+#
+# Other options:
+# --once: run each scheduled task one time and exit.
+
+import logging
+import os
+import shlex
+import signal
+import threading
+import time
+
+from congress.tasks import utils
+
+
+class Job(object):
+
+    def __init__(self, task_name, every, options):
+        self.task_name = task_name
+        self.task_names = task_name.split("+")
+        self.every = every
+        self.options = options
+        self.next_run = time.monotonic()
+        self.thread = None
+        self.waiting = False
+
+
+def run(options):
+    from congress import run as usc_run
+
+    jobs = load_schedule(options)
+    if not jobs:
+        logging.error("The daemon has nothing to do. Add a daemon section to config.yml or use --schedule.")
+        return
+
+    once = options.get("once", False)
+    legislators_every = float(options.get("legislators_every", 60)) * 60
+    legislators_updated = time.monotonic()
+
+    # One lock per task, held while any run of that task is going (alone
+    # or in a chain like govinfo+bills).
+    locks = {task_name: threading.Lock() for job in jobs for task_name in job.task_names}
+
+    stop = threading.Event()
+
+    def handle_signal(signum, frame):
+        logging.warn("Stopping the daemon after the running tasks finish.")
+        stop.set()
+    old_handler = signal.signal(signal.SIGTERM, handle_signal)
+
+    try:
+        while not stop.is_set():
+            running = [job for job in jobs if job.thread and job.thread.is_alive()]
+
+            # Updating the repo changes files that running tasks may be reading.
+            if not running and utils.has_congress_legislators_repo \
+               and time.monotonic() - legislators_updated >= legislators_every:
+                if os.environ.get("UPDATE_CONGRESS_LEGISLATORS") != "NO":
+                    utils.update_congress_legislators_repo()
+                legislators_updated = time.monotonic()
+
+            if once and not running and all(job.next_run is None for job in jobs):
+                break
+
+            now = time.monotonic()
+            for job in jobs:
+                if job.next_run is None or job.next_run > now:
+                    continue
+                if start_job(job, [locks[task_name] for task_name in sorted(set(job.task_names))], usc_run):
+                    job.next_run = None if once else now + job.every
+
+            # Jobs that are due but waiting on a running task are checked
+            # again shortly.
+            pending = [max(job.next_run, now + 0.1) for job in jobs if job.next_run is not None]
+            stop.wait(max(0, min(pending) - time.monotonic()) if pending else 0.1)
+    except KeyboardInterrupt:
+        logging.warn("Stopping the daemon after the running tasks finish.")
+
+    for job in jobs:
+        if job.thread:
+            job.thread.join()
+    signal.signal(signal.SIGTERM, old_handler)
+
+
+def start_job(job, locks, usc_run):
+    acquired = []
+    for lock in locks:
+        if not lock.acquire(blocking=False):
+            for lock in acquired:
+                lock.release()
+            if not job.waiting:
+                logging.warn("Waiting to run %s until its previous run finishes." % job.task_name)
+                job.waiting = True
+            return False
+        acquired.append(lock)
+    job.waiting = False
+
+    # Pick up changes to files held in memory before each run.
+    utils.reload_legislator_caches_if_changed()
+    utils.close_changed_zip_files()
+
+    def target():
+        try:
+            logging.warn("Running %s." % job.task_name)
+            started = time.monotonic()
+            usc_run.run_tasks(job.task_names, job.options)
+            logging.warn("Finished %s in %.1f seconds." % (job.task_name, time.monotonic() - started))
+        except Exception as exception:
+            utils.admin(exception)
+        finally:
+            for lock in locks:
+                lock.release()
+
+    job.thread = threading.Thread(target=target, name=job.task_name, daemon=True)
+    job.thread.start()
+    return True
+
+
+def load_schedule(options):
+    from congress import run as usc_run
+
+    if "schedule" in options:
+        import yaml
+        with open(options["schedule"]) as f:
+            schedule = yaml.load(f, Loader=yaml.BaseLoader)
+        if isinstance(schedule, dict):
+            schedule = schedule.get("daemon")
+    else:
+        schedule = (utils.get_config() or {}).get("daemon")
+
+    jobs = []
+    for entry in schedule or []:
+        task_name = entry["task"]
+        if "daemon" in usc_run.split_task_names(task_name):
+            raise ValueError("The daemon cannot schedule itself.")
+        jobs.append(Job(
+            task_name,
+            float(entry.get("every", 60)) * 60,
+            usc_run.parse_options(shlex.split(entry.get("options") or ""))))
+    return jobs
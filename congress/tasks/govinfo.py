@@ -44,7 +44,6 @@
 
 from lxml import etree, html
 import glob
-import json
 import re
 import logging
 import os
@@ -70,21 +69,26 @@ ns = {"x": "http://www.sitemaps.org/schemas/sitemap/0.9"}
 # Main entry point
 
 def run(options):
-    # Process sitemaps.
+    # Process sitemaps. update_sitemap streams the paths of the files it
+    # downloads as it goes. Return them so that a chained task (usc-run
+    # govinfo+bills) can process just what changed.
+    downloaded = set()
     for collection in sorted(options.get("collections", "").split(",")):
         if collection != "":
-            update_sitemap(COLLECTION_SITEMAPINDEX_PATTERN.format(collection=collection), None, [], options)
+            downloaded.update(update_sitemap(COLLECTION_SITEMAPINDEX_PATTERN.format(collection=collection), None, [], options))
     for collection in sorted(options.get("bulkdata", "").split(",")):
         if collection != "":
-            update_sitemap(BULKDATA_SITEMAPINDEX_PATTERN.format(collection=collection), None, [], options)
+            downloaded.update(update_sitemap(BULKDATA_SITEMAPINDEX_PATTERN.format(collection=collection), None, [], options))
+    logging.warn("Downloaded or extracted %d files." % len(downloaded))
+    return downloaded
 
 def update_sitemap(url, current_lastmod, how_we_got_here, options):
-    """Updates the local cache of a sitemap file."""
+    """Updates the local cache of a sitemap file. Generates the paths of the files downloaded."""
 
     # Skip if the year or congress flags are set and this sitemap is
     # not for that year or Congress.
     if should_skip_sitemap(url, options):
-        return []
+        return
 
     # For debugging, remember what URLs we are stepping through.
     how_we_got_here = how_we_got_here + [url]
@@ -96,6 +100,9 @@ def update_sitemap(url, current_lastmod, how_we_got_here, options):
     cache_file = get_sitemap_cache_file(url)
     cache_file = os.path.join("govinfo/sitemap", cache_file, "sitemap.xml")
     lastmod_cache_file = cache_file.replace(".xml", "-lastmod.yaml")
+    if utils.get_shard(options):
+        # Each shard tracks the packages it downloaded separately.
+        lastmod_cache_file = lastmod_cache_file.replace(".yaml", "-shard%dof%d.yaml" % utils.get_shard(options))
     lastmod_cache_file = os.path.join(utils.cache_dir(), lastmod_cache_file)
     if not os.path.exists(lastmod_cache_file):
         lastmod_cache = { }
@@ -104,19 +111,17 @@ def update_sitemap(url, current_lastmod, how_we_got_here, options):
             lastmod_cache = rtyaml.load(f)
 
     try:
-        return update_sitemap2(url, current_lastmod, how_we_got_here, options, lastmod_cache, cache_file)
+        yield from update_sitemap2(url, current_lastmod, how_we_got_here, options, lastmod_cache, cache_file)
     finally:
         # Write the updated last modified dates to disk so we know the next time whether
         # we need to fetch the files. If we didn't download anything, no need to write an
         # empty file.
         with utils.NoInterrupt():
-            with open(lastmod_cache_file, "w") as f:
-                rtyaml.dump(lastmod_cache, f)
+            utils.write(rtyaml.dump(lastmod_cache), lastmod_cache_file, {"marker": True})
 
 
 def update_sitemap2(url, current_lastmod, how_we_got_here, options, lastmod_cache, cache_file):
-    # Return a list of files we downloaded.
-    results = []
+    # Generate the paths of the files we download.
 
     # Download anew if the current_lastmod doesn't match the stored lastmod
     # in our cache, and if --cache is not specified. Or if --force is given.
@@ -137,51 +142,43 @@ def update_sitemap2(url, current_lastmod, how_we_got_here, options, lastmod_cach
         }))
     if not body:
         logging.error("Failed to download %s. Skipping." % url)
-        return results
+        return
 
     # If we downloaded a new file, update the lastmod for our cache.
     if download and current_lastmod:
         lastmod_cache["lastmod"] = current_lastmod
 
-    # Load the XML.
-    try:
-        sitemap = etree.fromstring(body)
-    except etree.XMLSyntaxError as e:
-        raise Exception("XML syntax error in %s: %s" % (url, str(e)))
+    is_index, entries = parse_sitemap(body, url)
 
     # Process the entries.
-    if sitemap.tag == "{http://www.sitemaps.org/schemas/sitemap/0.9}sitemapindex":
+    if is_index:
 
         # This is a sitemap index. Process the sitemaps listed in this
         # sitemapindex recursively.
-        for node in sitemap.xpath("x:sitemap", namespaces=ns):
-            # Get URL and lastmod date of the sitemap.
-            url = str(node.xpath("string(x:loc)", namespaces=ns))
-            lastmod = str(node.xpath("string(x:lastmod)", namespaces=ns))
-            sitemap_results = update_sitemap(url, lastmod, how_we_got_here, options)
-            if sitemap_results is not None:
-                results = results + sitemap_results
+        for url, lastmod in entries:
+            yield from update_sitemap(url, lastmod, how_we_got_here, options)
 
-    elif sitemap.tag == "{http://www.sitemaps.org/schemas/sitemap/0.9}urlset":
+    else:
 
         # This is a regular sitemap with content items listed.
 
-        # Process the items.
-        for node in sitemap.xpath("x:url", namespaces=ns):
-            url = str(node.xpath("string(x:loc)", namespaces=ns))
-            lastmod = str(node.xpath("string(x:lastmod)", namespaces=ns))
-
+        # Process the items. Bulk data files are downloaded together at
+        # the end.
+        bulkdata_files = []
+        for url, lastmod in entries:
             m = re.match(COLLECTION_BASE_URL + r"([^-]+)-(.*)", url)
             if m:
                 collection = m.group(1)
                 package_name = m.group(2)
                 if options.get("filter") and not re.search(options["filter"], package_name): continue
+                if not utils.in_shard(package_name, options): continue
                 try:
-                    mirror_results = mirror_package(collection, package_name, lastmod, lastmod_cache.setdefault("packages", {}), options)
+                    with utils.trace_item(package_name, options):
+                        mirror_results = mirror_package(collection, package_name, lastmod, lastmod_cache.setdefault("packages", {}), options)
                 except:
                     logging.exception("Error fetching package {} in collection {} from {}.".format(package_name, collection, url))
                     mirror_results = []
-                results.extend(mirror_results)
+                yield from mirror_results
 
             else:
                 # This is a bulk data item. Extract components of the URL.
@@ -191,18 +188,31 @@ def update_sitemap2(url, current_lastmod, how_we_got_here, options, lastmod_cach
                 collection = m.group(1)
                 item_path = m.group(2)
                 if options.get("filter") and not re.search(options["filter"], item_path): continue
-                try:
-                    mirror_results = mirror_bulkdata_file(collection, url, item_path, lastmod, options)
-                except:
-                    logging.exception("Error fetching file {} in collection {} from {}.".format(item_path, collection, url))
-                    mirror_results = None
-                if mirror_results is not None and len(mirror_results) > 0:
-                    results = results + mirror_results
+                if not utils.in_shard(item_path, options): continue
+                bulkdata_files.append((collection, url, item_path, lastmod))
+
+        yield from mirror_bulkdata_files(bulkdata_files, options)
+
+def parse_sitemap(body, url):
+    # Parse a sitemap index or a sitemap. Returns whether it is an index
+    # and a list of the (loc, lastmod) pairs of its entries.
+    try:
+        sitemap = etree.fromstring(body)
+    except etree.XMLSyntaxError as e:
+        raise Exception("XML syntax error in %s: %s" % (url, str(e)))
 
+    if sitemap.tag == "{http://www.sitemaps.org/schemas/sitemap/0.9}sitemapindex":
+        is_index = True
+        nodes = sitemap.xpath("x:sitemap", namespaces=ns)
+    elif sitemap.tag == "{http://www.sitemaps.org/schemas/sitemap/0.9}urlset":
+        is_index = False
+        nodes = sitemap.xpath("x:url", namespaces=ns)
     else:
         raise Exception("Unknown sitemap type (%s) at the root sitemap of %s." % (sitemap.tag, url))
 
-    return results
+    return is_index, [
+        (str(node.xpath("string(x:loc)", namespaces=ns)), str(node.xpath("string(x:lastmod)", namespaces=ns)))
+        for node in nodes]
 
 def should_skip_sitemap(url, options):
     # Don't skip sitemap indexes.
@@ -267,19 +277,20 @@ def get_sitemap_cache_file(url):
 def should_download_sitemap(lastmod_cache, current_lastmod, options):
     # Download a sitemap or just read from our cache?
 
-    if not current_lastmod:
-        # No lastmod is known for this file (it's the root of a sitemap
-        # tree - this is the first web request).
-        return True
-
-    elif options.get("force", False):
+    if options.get("force", False):
         # User requests downloading everything.
         return True
 
     elif options.get("cached", False):
-        # User requests downloading nothing.
+        # User requests downloading nothing, not even the root of the
+        # sitemap tree, if it is already in the cache.
         return False
 
+    elif not current_lastmod:
+        # No lastmod is known for this file (it's the root of a sitemap
+        # tree - this is the first web request).
+        return True
+
     else:
         # Download if the lastmod from the parent sitemap doesn't agree with
         # the lastmod stored on disk.
@@ -333,7 +344,7 @@ def mirror_package(collection, package_name, lastmod, lastmod_cache, options):
         # Sometimes files don't download properly. If the ZIP file is
         # corrupt, log the error and delete the file.
         logging.error(str(e) + ". Deleting: " + file_path, exc_info=True)
-        os.unlink(file_path)
+        utils.delete(file_path)
 
     return downloaded_files
 
@@ -400,20 +411,20 @@ def extract_package_files(collection, package_name, package_file, lastmod_cache,
             package_path = package_path.format(collection=collection, package_name=package_name)
             local_path = os.path.join(os.path.dirname(package_file), local_path)
 
-            # Extract it.
+            # Extract it. (The content is used below from memory, since with
+            # --write_behind the file may not be on disk yet.)
             try:
                 with package.open(package_path) as f1:
-                    with open(local_path, 'wb') as f2:
-                        f2.write(f1.read())
+                    content = f1.read()
             except KeyError:
-                # No file of this format is present in this package.
-                continue
-            finally:
-                # Even if the file didn't exist, which is NOT an error condition
-                # because not all packages have documents of all formats, update
-                # the format's file's lastmod in our cache so that we don't try
-                # to extract it again later, unless the package is updated.
+                # No file of this format is present in this package, which is
+                # NOT an error condition because not all packages have
+                # documents of all formats. Update the format's file's lastmod
+                # in our cache so that we don't try to extract it again later,
+                # unless the package is updated.
                 lastmod_cache[format] = lastmod_cache['package']
+                continue
+            utils.write(content, local_path)
 
             logging.warn("Extracted: " + local_path)
             extracted_files.append(local_path)
@@ -422,16 +433,19 @@ def extract_package_files(collection, package_name, package_file, lastmod_cache,
             if format == "text":
                 file_path_text = local_path.replace(".html", ".txt")
                 logging.info("Unwrapping HTML to: " + file_path_text)
-                with open(local_path) as f1:
-                    with open(file_path_text, "wb") as f2:
-                        f2.write(unwrap_text_in_html(f1.read()))
+                with utils.trace_stage("transform"):
+                    text = unwrap_text_in_html(content.decode("utf8"))
+                utils.write(text, file_path_text)
                 extracted_files.append(file_path_text)
 
             if collection == "BILLS" and format == "mods":
                 # When we download bill files, also create the text-versions/data.json file
                 # which extracts commonly used components of the MODS XML, whenever we update
                 # that MODS file.
-                extract_bill_version_metadata(package_name, os.path.dirname(package_file))
+                extract_bill_version_metadata(package_name, content)
+
+            # Only once the format is extracted, so that a failure is retried.
+            lastmod_cache[format] = lastmod_cache['package']
 
     return extracted_files
 
@@ -488,54 +502,71 @@ def unwrap_text_in_html(data):
 # Downloading bulk data files
 
 
-def mirror_bulkdata_file(collection, url, item_path, lastmod, options):
-    # Return a list of files we downloaded.
-    results = []
+def mirror_bulkdata_files(bulkdata_files, options):
+    # Download the bulk data files that are new or changed, --connections
+    # at a time. bulkdata_files is a list of (collection, url, item_path,
+    # lastmod) tuples. Generates the paths of the files downloaded.
 
-    # Where should we store the file?
-    path = "%s/govinfo/%s/%s" % (utils.data_dir(), collection, item_path)
+    # Where should we store the lastmod found in the sitemap of each file
+    # we download so that we can tell later if the file has changed?
+    lastmods = { }
 
-    # For BILLSTATUS, store this along with where we store the rest of bill
-    # status data.
-    if collection == "BILLSTATUS":
-        from congress.tasks.bills import output_for_bill
-        bill_id, version_code = get_bill_id_for_package(os.path.splitext(os.path.basename(item_path.replace("BILLSTATUS-", "")))[0], with_version=False)
-        path = output_for_bill(bill_id, FDSYS_BILLSTATUS_FILENAME, is_data_dot=False)
+    def get_downloads():
+        for collection, url, item_path, lastmod in bulkdata_files:
+            try:
+                path = get_bulkdata_file_path(collection, item_path)
+            except:
+                logging.exception("Error fetching file {} in collection {} from {}.".format(item_path, collection, url))
+                continue
+            lastmod_cache_file = os.path.splitext(path)[0] + "-lastmod.txt"
 
-    # Where should we store the lastmod found in the sitemap so that
-    # we can tell later if the file has changed?
-    lastmod_cache_file = os.path.splitext(path)[0] + "-lastmod.txt"
+            # Do we already have this file up to date?
+            if os.path.exists(lastmod_cache_file) and not options.get("force", False):
+                if lastmod == utils.read(lastmod_cache_file):
+                    continue
 
-    # Do we already have this file up to date?
-    if os.path.exists(lastmod_cache_file) and not options.get("force", False):
-        if lastmod == utils.read(lastmod_cache_file):
-            return
+            # With --cached, skip if the file is already downloaded.
+            if os.path.exists(path) and options.get("cached", False):
+                continue
 
-    # With --cached, skip if the file is already downloaded.
-    if os.path.exists(path) and options.get("cached", False):
-        return
+            logging.warn("Downloading: " + path)
+            lastmods[path] = (lastmod, lastmod_cache_file)
+            yield (url, path)
 
-    # Download.
-    logging.warn("Downloading: " + path)
-    data = utils.download(url, path, utils.merge(options, {
+    for (url, path), data in utils.download_batch(get_downloads(), utils.merge(options, {
         'binary': True,
         'force': True, # decision to cache was made above
         'to_cache': False,
-    }))
-    results.append(path)
+        'needs_content': False,
+    })):
+        lastmod, lastmod_cache_file = lastmods.pop(path)
+        if not data:
+            # Something failed.
+            logging.error("Failed to download {}.".format(url))
+            continue
+
+        # Write the current last modified date back to disk so we know the next time whether
+        # we need to fetch the file again.
+        utils.write(lastmod, lastmod_cache_file)
+        yield path
 
-    if not data:
-        # Something failed.
-        return
 
-    # Write the current last modified date back to disk so we know the next time whether
-    # we need to fetch the file again.
-    utils.write(lastmod, lastmod_cache_file)
+def get_bulkdata_file_path(collection, item_path):
+    # Where should we store the file?
+    path = "%s/govinfo/%s/%s" % (utils.data_dir(), collection, item_path)
+
+    # For BILLSTATUS, store this along with where we store the rest of bill
+    # status data.
+    if collection == "BILLSTATUS":
+        from congress.tasks.bills import output_for_bill
+        bill_id, version_code = get_bill_id_for_package(os.path.splitext(os.path.basename(item_path.replace("BILLSTATUS-", "")))[0], with_version=False)
+        path = output_for_bill(bill_id, FDSYS_BILLSTATUS_FILENAME, is_data_dot=False)
 
-    return results
+    return path
 
 
-def extract_bill_version_metadata(package_name, text_path):
+def extract_bill_version_metadata(package_name, mods_xml):
+    # mods_xml is the content of the package's mods.xml file.
     bill_version_id = get_bill_id_for_package(package_name)
 
     bill_type, number, congress, version_code = utils.split_bill_version_id(bill_version_id)
@@ -547,7 +578,8 @@ def extract_bill_version_metadata(package_name, text_path):
     }
 
     mods_ns = {"mods": "http://www.loc.gov/mods/v3"}
-    doc = etree.parse(os.path.join(text_path, "mods.xml"))
+    with utils.trace_stage("parse"):
+        doc = etree.fromstring(mods_xml).getroottree()
     locations = doc.xpath("//mods:location/mods:url", namespaces=mods_ns)
 
     for location in locations:
@@ -564,8 +596,10 @@ def extract_bill_version_metadata(package_name, text_path):
 
     bill_version["issued_on"] = doc.xpath("string(//mods:dateIssued)", namespaces=mods_ns)
 
+    with utils.trace_stage("serialize"):
+        bill_version_json = utils.json_dumps(bill_version)
     utils.write(
-        json.dumps(bill_version, sort_keys=True, indent=2, default=utils.format_datetime),
+        bill_version_json,
         output_for_bill_version(bill_version_id)
     )
 
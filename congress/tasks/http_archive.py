@@ -0,0 +1,249 @@
+# Recording and replaying HTTP traffic, to run the tasks offline and
+# reproducibly, e.g. to benchmark them or to test how they handle slow or
+# failing websites.
+#
+# usc-run votes --congress=117 --record=archive
+#
+# saves every request made through utils.download and the mechanize browser
+# (used by committee_meetings), with its response, to the archive directory.
+# Then
+#
+# usc-run votes --congress=117 --replay=archive --force
+#
+# answers the same requests from the archive without using the network.
+# Requests that aren't in the archive get a 404. Add --replay_latency=0.5
+# to delay each response by half a second, and --replay_error_rate=0.1 to
+# answer one in ten requests with a --replay_error_status=503 error instead.
+#
+# The archive can also be served by a local web server, so that requests go
+# through real connections:
+#
+# usc-run http_archive --archive=archive --port=8080 --latency=0.5 --error_rate=0.1
+# usc-run votes --congress=117 --replay=http://127.0.0.1:8080 --force
+#
+# The tasks then send each request to the server, as
+# http://127.0.0.1:8080/https://clerk.house.gov/..., and the rate limits
+# still apply to the original website.
+#
+# Each response is saved as two files named by a hash of the request's
+# method, URL and body: a JSON file with the request, status and headers,
+# and the body. A request made again replaces the earlier response.
+
+import hashlib
+import http.server
+import io
+import json
+import logging
+import os
+import random
+import threading
+import time
+
+import mechanize
+import requests
+import requests.adapters
+import requests.structures
+import requests.utils
+
+from congress.tasks import utils
+
+
+def run(options):
+    archive = HTTPArchive(
+        options["archive"],
+        latency=options.get("latency", 0),
+        error_rate=options.get("error_rate", 0),
+        error_status=options.get("error_status", 503))
+    server = http.server.ThreadingHTTPServer((options.get("host", "127.0.0.1"), int(options.get("port", 8080))), archive.request_handler())
+    logging.warn("Serving %s at http://%s:%d." % (archive.path, server.server_address[0], server.server_address[1]))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+# Headers that describe how a body was sent rather than the body. The body
+# is recorded as it was after decompression, so they are dropped.
+TRANSFER_HEADERS = ("content-encoding", "content-length", "transfer-encoding", "connection")
+
+
+def body_bytes(body):
+    if body is None:
+        return b""
+    if isinstance(body, str):
+        return body.encode("utf8")
+    return bytes(body)
+
+
+class HTTPArchive(object):
+
+    def __init__(self, path, record=False, server=None, latency=0, error_rate=0, error_status=503):
+        self.path = path
+        self.record = record
+        self.server = server.rstrip("/") if server else None
+        self.latency = float(latency)
+        self.error_rate = float(error_rate)
+        self.error_status = int(error_status)
+        self.random = random.Random()
+        self.local = threading.local()
+
+    def key(self, method, url, body):
+        return hashlib.sha256(b"%s %s\n%s" % (method.upper().encode("ascii"), url.encode("utf8"), body_bytes(body))).hexdigest()
+
+    def entry_path(self, key):
+        return os.path.join(self.path, key[:2], key)
+
+    def save(self, method, url, body, status, reason, headers, content):
+        # Both files are written right away, not by --write_behind as part
+        # of the item being processed.
+        path = self.entry_path(self.key(method, url, body))
+        utils.write_stream([content], path + ".body")
+        utils.write_stream([json.dumps({
+            "method": method.upper(),
+            "url": url,
+            "body": body_bytes(body).decode("utf8", "replace"),
+            "status": status,
+            "reason": reason,
+            "headers": [(name, value) for name, value in headers if name.lower() not in TRANSFER_HEADERS],
+        }, indent=2).encode("utf8")], path + ".json")
+
+    def load(self, method, url, body):
+        path = self.entry_path(self.key(method, url, body))
+        try:
+            with open(path + ".json") as f:
+                entry = json.load(f)
+            with open(path + ".body", "rb") as f:
+                entry["content"] = f.read()
+        except FileNotFoundError:
+            return None
+        return entry
+
+    # Answer a request from the archive, with the latency and errors that
+    # were asked for. Returns the status, reason, headers and body.
+    def respond(self, method, url, body, request_headers):
+        if self.latency:
+            time.sleep(self.latency)
+        if self.error_rate and self.random.random() < self.error_rate:
+            return self.error_status, "Injected Error", [("Retry-After", "1")], b""
+
+        request_headers = dict((name.lower(), value) for name, value in request_headers.items())
+        entry = self.load(method, url, body)
+        if entry is None:
+            logging.warn("Not in the HTTP archive: %s %s" % (method, url))
+            return 404, "Not In Archive", [], b""
+
+        # Revalidation works like it did on the website.
+        etag = dict((name.lower(), value) for name, value in entry["headers"]).get("etag")
+        if etag and request_headers.get("if-none-match") == etag:
+            return 304, "Not Modified", [("ETag", etag)], b""
+
+        return entry["status"], entry["reason"], entry["headers"], entry["content"]
+
+    # Make a request to the replay server, or answer it from the archive.
+    def fetch(self, method, url, body, request_headers):
+        if not self.server:
+            return self.respond(method, url, body, request_headers)
+
+        session = getattr(self.local, "session", None)
+        if session is None:
+            session = requests.Session()
+            self.local.session = session
+        response = session.request(method, self.server + "/" + url, data=body, headers=request_headers, allow_redirects=False)
+        headers = [(name, value) for name, value in response.headers.items() if name.lower() not in TRANSFER_HEADERS]
+        return response.status_code, response.reason, headers, response.content
+
+    # Set up a requests session (e.g. a scraper) to record to or replay from
+    # the archive.
+    def mount(self, session):
+        if self.record:
+            session.hooks["response"].append(self.record_response)
+        else:
+            adapter = ReplayAdapter(self)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+
+    # A 304 Not Modified response to a revalidation doesn't replace the
+    # response recorded when the page was first downloaded.
+    def record_response(self, response, *args, **kwargs):
+        if response.status_code == 304:
+            return
+        request = response.request
+        self.save(request.method, request.url, request.body, response.status_code, response.reason, response.headers.items(), response.content)
+
+    def request_handler(self):
+        archive = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                status, reason, headers, content = archive.respond(self.command, self.path[1:], body, self.headers)
+                self.send_response(status, reason)
+                for name, value in headers:
+                    if name.lower() not in TRANSFER_HEADERS:
+                        self.send_header(name, value)
+                self.send_header("Content-Length", str(len(content)))
+                self.end_headers()
+                if self.command != "HEAD":
+                    self.wfile.write(content)
+
+            do_POST = do_GET
+            do_HEAD = do_GET
+
+            def log_message(self, format, *args):
+                logging.info(format % args)
+
+        return Handler
+
+
+class ReplayAdapter(requests.adapters.BaseAdapter):
+
+    def __init__(self, archive):
+        super(ReplayAdapter, self).__init__()
+        self.archive = archive
+
+    def send(self, request, stream=False, timeout=None, verify=True, cert=None, proxies=None):
+        status, reason, headers, content = self.archive.fetch(request.method, request.url, request.body, dict(request.headers))
+        response = requests.Response()
+        response.status_code = status
+        response.reason = reason
+        response.headers = requests.structures.CaseInsensitiveDict(headers)
+        response.encoding = requests.utils.get_encoding_from_headers(response.headers)
+        response.raw = io.BytesIO(content)
+        response.url = request.url
+        response.request = request
+        response.connection = self
+        return response
+
+    def close(self):
+        pass
+
+
+# Opens requests from the archive when replaying (before mechanize's own
+# HTTP handlers get to them) and records responses when recording (after
+# mechanize has decompressed them).
+class MechanizeHandler(mechanize.BaseHandler):
+    handler_order = 250
+
+    def __init__(self, archive):
+        self.archive = archive
+
+    def http_open(self, request):
+        if self.archive.record:
+            return None
+        status, reason, headers, content = self.archive.fetch(request.get_method(), request.get_full_url(), request.data, dict(request.header_items()))
+        return mechanize.make_response(content, [tuple(header) for header in headers], request.get_full_url(), status, reason)
+
+    def http_response(self, request, response):
+        if not self.archive.record or response.code == 304:
+            return response
+        content = response.read()
+        headers = list(response.info().items())
+        self.archive.save(request.get_method(), request.get_full_url(), request.data, response.code, response.msg, headers, content)
+        return mechanize.make_response(content, headers, response.geturl(), response.code, response.msg)
+
+    https_open = http_open
+    https_response = http_response
@@ -1,7 +1,6 @@
 from congress.tasks import utils
 import logging
 import re
-import json
 from datetime import datetime
 from lxml import etree
 import time
@@ -243,6 +242,6 @@ def output_nomination(nomination, options):
 
 	# output JSON - so easy!
 	utils.write(
-		json.dumps(nomination, sort_keys=True, indent=2, default=utils.format_datetime),
+		utils.json_dumps(nomination),
 		output_for_nomination(nomination['nomination_id'], "json")
 	)
@@ -0,0 +1,145 @@
+# Packs subtrees of the cache directory that are no longer changing, like
+# the pages downloaded for old Congresses, into ZIP files, to save disk
+# space and inodes. utils.download reads cached files out of a ZIP file
+# named after any directory on their path, e.g. cache/93/bills/hr/hr1/...
+# is found in cache/93.zip (as 93/bills/hr/hr1/...).
+#
+# usc-run pack_cache --paths=93,94
+#
+# packs cache/93/ into cache/93.zip and cache/94/ into cache/94.zip, and
+# then removes the packed files. Or pick the subtrees by age:
+#
+# usc-run pack_cache --older_than=365
+#
+# packs each directory at the top of the cache directory (or --depth=2
+# levels down) in which no file was modified in the last 365 days.
+#
+# Options:
+# --keep: don't remove the files once they are packed.
+# --dry_run: only list the subtrees that would be packed.
+#
+# Files added to a subtree after it was packed are added to the existing
+# ZIP file the next time it's packed. The ZIP files are listed in
+# cache/zip-index.txt so that utils.download can check only those. If you
+# add or remove ZIP files in the cache directory by hand, run
+# `usc-run pack_cache` without options to update the list.
+#
+# Files that are read directly rather than through utils.download (the
+# pickles of parsed YAML files, the GovInfo sitemap lastmod files, the HTTP
+# validators, the process_set journals, the cache store, ...; see
+# utils.is_read_by_path) are left alone.
+
+import logging
+import os
+import time
+import zipfile
+
+from congress.tasks import utils
+
+
+def run(options):
+    root = utils.cache_dir()
+
+    if options.get("paths"):
+        subtrees = [p.strip().strip("/") for p in str(options["paths"]).split(",") if p.strip()]
+    elif options.get("older_than"):
+        cutoff = time.time() - float(options["older_than"]) * 24 * 60 * 60
+        subtrees = list(cold_subtrees(root, int(options.get("depth", 1)), cutoff))
+    else:
+        subtrees = []
+
+    for subtree in subtrees:
+        if not os.path.isdir(os.path.join(root, subtree)):
+            logging.error("%s is not a directory in %s." % (subtree, root))
+            continue
+        if options.get("dry_run", False):
+            logging.warn("Would pack %s." % subtree)
+            continue
+        pack(root, subtree, options)
+
+    if not options.get("dry_run", False):
+        write_zip_index(root)
+
+
+# Yield the directories `depth` levels below root whose files are all older
+# than cutoff.
+def cold_subtrees(root, depth, cutoff):
+    level = [""]
+    for i in range(depth):
+        level = [
+            os.path.join(parent, d)
+            for parent in level
+            for d in sorted(os.listdir(os.path.join(root, parent)))
+            if os.path.isdir(os.path.join(root, parent, d)) and not (parent == "" and d == "journals")
+        ]
+    for subtree in level:
+        newest = max((os.path.getmtime(path) for path in packable_files(root, subtree)), default=None)
+        if newest is not None and newest < cutoff:
+            yield subtree
+
+
+def packable_files(root, subtree):
+    for dirpath, dirnames, filenames in os.walk(os.path.join(root, subtree)):
+        dirnames.sort()
+        for fn in sorted(filenames):
+            path = os.path.join(dirpath, fn)
+            if not utils.is_read_by_path(root, path):
+                yield path
+
+
+def pack(root, subtree, options):
+    zfn = os.path.join(root, subtree) + ".zip"
+    files = list(packable_files(root, subtree))
+    if not files:
+        logging.warn("Nothing to pack in %s." % subtree)
+        return
+
+    # Write the new ZIP file next to the old one and swap it in only once it
+    # is complete, so that readers never see a partial archive. Files already
+    # in an old archive are carried over unless they were downloaded again.
+    # Names are relative to the directory the ZIP file is in (so that
+    # 93/bills.zip has bills/hr/hr1/...), which is where download() looks.
+    names = {os.path.relpath(path, os.path.dirname(zfn)).replace(os.sep, "/"): path for path in files}
+    tmp = "%s.%d.tmp" % (zfn, os.getpid())
+    try:
+        with zipfile.ZipFile(tmp, "w", zipfile.ZIP_DEFLATED) as zf:
+            if os.path.exists(zfn):
+                with zipfile.ZipFile(zfn, "r") as old:
+                    for info in old.infolist():
+                        if info.filename not in names:
+                            zf.writestr(info, old.read(info))
+            for name, path in sorted(names.items()):
+                zf.write(path, name)
+
+        with zipfile.ZipFile(tmp, "r") as zf:
+            bad = zf.testzip()
+            if bad:
+                raise Exception("%s was not packed correctly into %s." % (bad, tmp))
+
+        os.replace(tmp, zfn)
+    finally:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+    logging.warn("Packed %d files from %s into %s." % (len(files), subtree, zfn))
+
+    if not options.get("keep", False):
+        for path in files:
+            os.unlink(path)
+        for dirpath, dirnames, filenames in os.walk(os.path.join(root, subtree), topdown=False):
+            if not os.listdir(dirpath):
+                os.rmdir(dirpath)
+
+
+# List every ZIP file in the cache directory, relative to it, for
+# utils.get_zip_index.
+def write_zip_index(root):
+    zip_files = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        if os.path.relpath(dirpath, root) == ".":
+            dirnames[:] = [d for d in dirnames if d != "journals"]
+        dirnames.sort()
+        for fn in sorted(filenames):
+            if fn.endswith(".zip"):
+                zip_files.append(os.path.relpath(os.path.join(dirpath, fn), root).replace(os.sep, "/"))
+    utils.write("".join(name + "\n" for name in zip_files), os.path.join(root, utils.ZIP_INDEX_FILE))
+    utils.close_changed_zip_files()
@@ -59,7 +59,6 @@ import time
 import datetime
 from lxml import etree
 import glob
-import json
 import os.path
 import subprocess
 
@@ -87,6 +86,9 @@ def run(options):
     else:
         to_fetch = sorted(glob.glob(root_dir + "/*/STATUTE-*"))
 
+    # Shard on the volume directory name (e.g. STATUTE-65).
+    to_fetch = list(utils.filter_shard(to_fetch, options, key=os.path.basename))
+
     logging.warn("Going to process %i volumes" % len(to_fetch))
 
     utils.process_set(to_fetch, proc_statute_volume, options)
@@ -261,7 +263,7 @@ def proc_statute_volume(path, options):
             'sources': sources,
         }
         utils.write(
-            json.dumps(bill_version, sort_keys=True, indent=2, default=utils.format_datetime),
+            utils.json_dumps(bill_version),
             bill_versions.output_for_bill_version(bill_version_id)
         )
 
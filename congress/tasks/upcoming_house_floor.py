@@ -7,7 +7,6 @@ import time
 from dateutil.relativedelta import relativedelta
 from dateutil.relativedelta import MO
 import lxml
-import json
 import re
 import subprocess
 
@@ -48,20 +47,23 @@ def run(options):
 
 def run_for_week(for_the_week, options):
     logging.info('Scraping upcoming bills from docs.house.gov/floor for the week of %s...' % for_the_week)
-    house_floor = fetch_floor_week(for_the_week, options)
+    output_file = "%s/upcoming_house_floor/%s.json" % (utils.data_dir(), for_the_week)
+    house_floor = fetch_floor_week(for_the_week, output_file, options)
+    if house_floor is utils.UNCHANGED:
+        logging.warn("No changes for the week of %s" % for_the_week)
+        return
     if house_floor is None:
         logging.warn("Nothing posted for the week of %s" % for_the_week)
         return
 
-    output_file = "%s/upcoming_house_floor/%s.json" % (utils.data_dir(), for_the_week)
-    output = json.dumps(house_floor, sort_keys=True, indent=2, default=utils.format_datetime)
+    output = utils.json_dumps(house_floor)
     utils.write(output, output_file)
 
     logging.warn("Found %i bills for the week of %s, written to %s" % (len(house_floor['upcoming']), for_the_week, output_file))
 
 
 # For any week, e.g. https://docs.house.gov/floor/Download.aspx?file=/billsthisweek/20131021/20131021.xml
-def fetch_floor_week(for_the_week, options):
+def fetch_floor_week(for_the_week, output_file, options):
     base_url = 'https://docs.house.gov/floor/Download.aspx?file=/billsthisweek/'
     week_url = base_url + '%s/%s.xml' % (for_the_week, for_the_week)
 
@@ -71,9 +73,16 @@ def fetch_floor_week(for_the_week, options):
     options2 = dict(options)
     if "force" not in options2:
         options2["force"] = True
+    options2["binary"] = True
+
+    # If the schedule hasn't changed since we last wrote the week out, there's
+    # nothing to do.
+    if os.path.exists(output_file):
+        options2["if_changed"] = True
 
     body = utils.download(week_url, 'upcoming_house_floor/%s.xml' % for_the_week, options2)
-    if "was not found" in body: return None
+    if body is utils.UNCHANGED: return body
+    if b"was not found" in body: return None
     dom = lxml.etree.fromstring(body)
 
     # can download the actual attached files to disk, if asked
@@ -224,7 +233,7 @@ def fetch_floor_week(for_the_week, options):
 	            os.makedirs(os.path.join(utils.data_dir(), os.path.dirname(text_data_path)))
 	        except OSError:
 	            pass # directory exists
-        	utils.write(json.dumps(bill, sort_keys=True, indent=2, default=utils.format_datetime), text_data_path)
+        	utils.write(utils.json_dumps(bill), text_data_path)
 
 
     # Create and return the house floor file data.
@@ -1,50 +1,420 @@
 import os
 import os.path
 import errno
+import collections
 import sys
 import traceback
 import zipfile
-import platform
+import zlib
+import itertools
+import contextlib
+import contextvars
 import re
 import html.entities
 import json
-from pytz import timezone
 import datetime
 import time
-from lxml import etree
-import scrapelib
-import pprint
 import logging
-import subprocess
 import signal
+import threading
 
-import smtplib
-import email.utils
-from email.mime.text import MIMEText
-import getpass
+# Only cheap standard library modules are imported at the top of this module
+# because every usc-run invocation loads it. Heavier dependencies (lxml,
+# scrapelib, pytz, yaml, smtplib) are imported where they are used, and the
+# config file, time zone and scraper are created the first time they are
+# needed. They are still available as utils.config, utils.scraper and
+# utils.eastern_time_zone.
+
+
+def __getattr__(name):
+    if name == "config":
+        return get_config()
+    if name == "scraper":
+        return get_scraper()
+    if name == "eastern_time_zone":
+        return get_eastern_time_zone()
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
 
 
 # read in an opt-in config file for changing directories and supplying email settings
 # returns None if it's not there, and this should always be handled gracefully
-path = "config.yml"
-if os.path.exists(path):
-    # Don't use a cached config file, just in case, and direct_yaml_load is not yet defined.
-    import yaml
-    config = yaml.load(open(path), Loader=yaml.BaseLoader)
-else:
-    config = None
+_config = False  # not loaded yet
+
+
+def get_config():
+    global _config
+    if _config is False:
+        path = "config.yml"
+        if os.path.exists(path):
+            # Don't use a cached config file, just in case.
+            import yaml
+            with open(path) as f:
+                _config = yaml.load(f, Loader=yaml.BaseLoader)
+        else:
+            _config = None
+    return _config
+
+
+_eastern_time_zone = None
+
+
+def get_eastern_time_zone():
+    global _eastern_time_zone
+    if _eastern_time_zone is None:
+        from pytz import timezone
+        _eastern_time_zone = timezone('US/Eastern')
+    return _eastern_time_zone
+
+# Each thread gets its own scraper (a requests session, which isn't safe to
+# share between threads). Requests are rate limited by the HostLimiters.
+_scraper_local = threading.local()
+
+
+def get_scraper():
+    scraper = getattr(_scraper_local, "scraper", None)
+    if scraper is None or _scraper_local.http_archive is not _http_archive:
+        import scrapelib
+        scraper = scrapelib.Scraper(requests_per_minute=0, retry_attempts=3)
+        scraper.user_agent = "unitedstates/congress (https://github.com/unitedstates/congress)"
+        scraper.hooks["response"].append(_record_response)
+        if _http_archive:
+            _http_archive.mount(scraper)
+        _scraper_local.scraper = scraper
+        _scraper_local.http_archive = _http_archive
+    return scraper
+
+
+# A mechanize browser, for the pages that need forms submitted.
+def get_browser():
+    import mechanize
+    browser = mechanize.Browser()
+    if _http_archive:
+        from congress.tasks.http_archive import MechanizeHandler
+        browser.add_handler(MechanizeHandler(_http_archive))
+    return browser
+
+
+# With --record=archive, the HTTP requests made by the scrapers and browsers
+# and their responses are saved to the archive directory. With
+# --replay=archive (or the URL of a replay server), they are answered from
+# it instead of the network. See http_archive.py.
+_http_archive = None
+
+
+def use_http_archive(options):
+    global _http_archive
+    if options.get("record"):
+        from congress.tasks.http_archive import HTTPArchive
+        _http_archive = HTTPArchive(options["record"], record=True)
+    elif options.get("replay"):
+        from congress.tasks.http_archive import HTTPArchive
+        replay = options["replay"]
+        is_server = replay.startswith(("http://", "https://"))
+        _http_archive = HTTPArchive(
+            None if is_server else replay,
+            server=replay if is_server else None,
+            latency=options.get("replay_latency", 0),
+            error_rate=options.get("replay_error_rate", 0),
+            error_status=options.get("replay_error_status", 503))
+    else:
+        _http_archive = None
+
+
+# Called for every HTTP response, including the ones scrapelib retries.
+def _record_response(response, *args, **kwargs):
+    limiter = getattr(_scraper_local, "limiter", None)
+    if limiter is not None:
+        limiter.record_response(response.status_code, response.elapsed.total_seconds())
+
+# Requests are rate limited per host, with the settings in the http section
+# of config.yml (see config.yml.example):
+#
+# http:
+#   requests_per_minute: 120
+#   hosts:
+#     www.govinfo.gov:
+#       requests_per_minute: 600
+#       burst: 10
+#       adaptive: true
+#
+# Each host gets a token bucket that refills at requests_per_minute and
+# holds up to burst requests (default 1). --requests_per_minute=N sets the
+# rate of the hosts that aren't listed. connections caps the requests to a
+# host in flight at once (otherwise only the download pool's --connections
+# does).
+#
+# With adaptive (or --adaptive for all hosts), the cap starts at one
+# connection and grows by about one per round trip until the host answers
+# 429 or 503 or its successful (2xx) responses get more than twice as slow
+# as the fastest of the last 100 of them, and then it is halved (AIMD). It
+# never exceeds connections (or --connections=8).
+#
+# Each host also gets a circuit breaker. After circuit_failures=5 downloads
+# from it in a row fail (with a connection error, a timeout or a 5xx error,
+# after scrapelib's retries), the circuit opens: for the next
+# circuit_cooldown=600 seconds, downloads from the host are skipped
+# (download() returns None right away), and at the end of the run the
+# number skipped is logged. After the cool-down, one download is let
+# through to probe the host, and the circuit closes once one succeeds.
+# Open circuits are saved in cache/circuit-breakers.json, so a later run
+# starts with the probe too. Set circuit_failures to 0 to turn this off.
+#
+# The settings for a host are read the first time it is contacted.
+#
+# The limiters live in one process. In the N processes of a --pool=process
+# pool, each gets 1/N of a host's requests_per_minute and connections, so
+# that together they stay within the host's limits.
+_host_limiters = {}
+_host_limiters_lock = threading.Lock()
+_pool_processes = 1
+
+
+def get_host_limiter(url, options):
+    import urllib.parse
+    host = urllib.parse.urlparse(url).hostname or ""
+    with _host_limiters_lock:
+        limiter = _host_limiters.get(host)
+        if limiter is None:
+            http = (get_config() or {}).get("http") or {}
+            host_settings = (http.get("hosts") or {}).get(host) or {}
+
+            def setting(key, default):
+                if key in host_settings:
+                    return host_settings[key]
+                if key in options:
+                    return options[key]
+                return http.get(key, default)
+
+            adaptive = str(setting("adaptive", False)).lower() in ("true", "yes", "1")
+            connections = host_settings.get("connections") or http.get("connections")
+            if adaptive:
+                connections = connections or options.get("connections", 8)
+            if connections:
+                connections = max(1, int(connections) // _pool_processes)
+            limiter = HostLimiter(
+                host,
+                float(setting("requests_per_minute", 120)) / _pool_processes,
+                int(setting("burst", 1)),
+                connections or None,
+                adaptive,
+                int(setting("circuit_failures", 5)),
+                float(setting("circuit_cooldown", 600)),
+                persist=True)
+            _host_limiters[host] = limiter
+    return limiter
+
+
+class HostLimiter(object):
+
+    def __init__(self, host, requests_per_minute, burst, connections, adaptive, circuit_failures=0, circuit_cooldown=600, persist=False):
+        self.host = host
+        self.interval = 60.0 / requests_per_minute if requests_per_minute > 0 else 0
+        self.burst = burst
+        self.tokens = burst
+        self.refilled_at = time.monotonic()
+
+        self.max_connections = connections
+        self.adaptive = adaptive
+        self.connections = 1.0 if adaptive else connections
+        self.in_flight = 0
+        self.recent = collections.deque(maxlen=100) # times of 2xx responses
+        self.latency = None
+        self.decreased_at = 0
+        self.condition = threading.Condition()
+
+        self.circuit_failures = circuit_failures
+        self.circuit_cooldown = circuit_cooldown
+        self.persist = persist
+        self.failures = 0
+        self.open_until = load_circuit_breaker(host) if persist and circuit_failures else None
+        self.probing = False # the thread making the probe
+
+        self.stats = new_http_stats()
+
+    # Add to one of the host's stats, and to the current run's. Called with
+    # self.condition held.
+    def count(self, key, amount=1):
+        self.stats[key] += amount
+        run_stats = _http_stats.get()
+        if run_stats is not None:
+            if self.host not in run_stats:
+                run_stats[self.host] = new_http_stats()
+            run_stats[self.host][key] += amount
+
+    def __enter__(self):
+        start = time.monotonic()
+        with self.condition:
+            while self.connections is not None and self.in_flight >= int(self.connections):
+                self.condition.wait()
+            self.in_flight += 1
+
+            # Take a token. The bucket can go below zero: each request then
+            # sleeps until its turn.
+            wait = 0
+            if self.interval:
+                self.tokens = min(self.burst, self.tokens + (start - self.refilled_at) / self.interval)
+                self.refilled_at = start
+                self.tokens -= 1
+                if self.tokens < 0:
+                    wait = -self.tokens * self.interval
+        if wait > 0:
+            time.sleep(wait)
+
+        with self.condition:
+            self.count("requests")
+            self.count("waited", time.monotonic() - start)
+        _scraper_local.limiter = self
+        return self
+
+    def __exit__(self, *exc_info):
+        _scraper_local.limiter = None
+        with self.condition:
+            self.in_flight -= 1
+            self.condition.notify_all()
+
+    def record_response(self, status_code, elapsed):
+        if status_code < 500:
+            self.record_success()
+        with self.condition:
+            if status_code in (429, 503):
+                self.count("throttled")
+                self.back_off()
+            elif self.adaptive and 200 <= status_code < 300:
+                # (Other responses, like a quick 304 or 404, aren't
+                # comparable.)
+                self.recent.append(elapsed)
+                self.latency = elapsed if self.latency is None else .8 * self.latency + .2 * elapsed
+                if self.latency > 2 * min(self.recent):
+                    self.back_off()
+                else:
+                    self.connections = min(self.max_connections, self.connections + 1 / self.connections)
+            self.condition.notify_all()
+
+    def back_off(self):
+        if not self.adaptive:
+            return
+
+        # Back off at most once per round trip. The responses still coming
+        # in were requested before the last decrease.
+        now = time.monotonic()
+        if now - self.decreased_at < (self.latency or 0):
+            return
+        self.decreased_at = now
+        self.connections = max(1.0, self.connections / 2)
+        self.count("backoffs")
+
+    # Whether a download from the host should be tried. While the circuit is
+    # open, it isn't, except for one probe once the cool-down is over.
+    def allow_request(self):
+        with self.condition:
+            if self.open_until is None:
+                return True
+            if time.time() >= self.open_until and not self.probing:
+                self.probing = threading.get_ident()
+                return True
+            self.count("skipped")
+            return False
+
+    # Called when a download is done, however it ended. If it was the probe
+    # and neither record_success nor record_failure was called (e.g. it ended
+    # with too many redirects), the next download can probe again.
+    def end_request(self):
+        with self.condition:
+            if self.probing == threading.get_ident():
+                self.probing = False
+
+    def record_success(self):
+        with self.condition:
+            self.failures = 0
+            self.probing = False
+            if self.open_until is None:
+                return
+            self.open_until = None
+        logging.warning("%s is answering again." % self.host)
+        if self.persist:
+            save_circuit_breaker(self.host, None)
+
+    def record_failure(self):
+        with self.condition:
+            self.failures += 1
+            if not self.circuit_failures or (self.failures < self.circuit_failures and not self.probing):
+                return
+            was_open = self.open_until is not None
+            self.probing = False
+            self.open_until = time.time() + self.circuit_cooldown
+            open_until = self.open_until
+        if not was_open:
+            logging.error("%s failed %d times in a row. Skipping downloads from it for %d seconds." % (self.host, self.failures, self.circuit_cooldown))
+        if self.persist:
+            save_circuit_breaker(self.host, open_until)
 
 
-eastern_time_zone = timezone('US/Eastern')
+CIRCUIT_BREAKERS_FILE = "circuit-breakers.json"
+_circuit_breakers_lock = threading.Lock()
 
-# scraper should be instantiated at class-load time, so that it can rate limit appropriately
-scraper = scrapelib.Scraper(requests_per_minute=120, retry_attempts=3)
-scraper.user_agent = "unitedstates/congress (https://github.com/unitedstates/congress)"
+
+def load_circuit_breaker(host):
+    try:
+        with open(os.path.join(cache_dir(), CIRCUIT_BREAKERS_FILE)) as f:
+            return (json.load(f).get(host) or {}).get("open_until")
+    except (IOError, ValueError):
+        return None
+
+
+def save_circuit_breaker(host, open_until):
+    path = os.path.join(cache_dir(), CIRCUIT_BREAKERS_FILE)
+    with _circuit_breakers_lock:
+        try:
+            with open(path) as f:
+                state = json.load(f)
+        except (IOError, ValueError):
+            state = {}
+        if open_until is None:
+            if host not in state:
+                return
+            del state[host]
+        else:
+            state[host] = {"open_until": open_until}
+        mkdir_p(os.path.dirname(path))
+        with open(path + ".tmp", "w") as f:
+            json.dump(state, f, indent=2)
+        os.replace(path + ".tmp", path)
+
+# Each run (see run.run_tasks) counts the requests it made to each host, how
+# many were throttled by the host, and the time spent waiting on the limits
+# above, and logs them at the end. The counts are kept in a context variable
+# since the daemon runs tasks at the same time on different threads, which
+# share the limiters.
+_http_stats = contextvars.ContextVar("http_stats", default=None)
+
+
+def new_http_stats():
+    return {"requests": 0, "throttled": 0, "waited": 0.0, "backoffs": 0, "skipped": 0}
+
+
+def start_http_stats():
+    _http_stats.set({})
+
+
+def log_http_stats():
+    run_stats = _http_stats.get()
+    _http_stats.set(None)
+    for host, stats in sorted((run_stats or {}).items()):
+        if not stats["requests"] and not stats["skipped"]:
+            continue
+        limiter = _host_limiters.get(host)
+        message = "%s: %d requests, %d throttled (429/503), %.1f seconds waiting on rate limits" % (
+            host, stats["requests"], stats["throttled"], stats["waited"])
+        if limiter is not None and limiter.adaptive:
+            message += ", %d backoffs, now %d connections" % (stats["backoffs"], limiter.connections)
+        if stats["skipped"]:
+            message += ", %d downloads skipped because the host was down" % stats["skipped"]
+        logging.warning(message + ".")
 
 
 def format_datetime(obj):
     if isinstance(obj, datetime.datetime):
-        return eastern_time_zone.localize(obj.replace(microsecond=0)).isoformat()
+        return get_eastern_time_zone().localize(obj.replace(microsecond=0)).isoformat()
     elif isinstance(obj, datetime.date):
         return obj.isoformat()
     elif isinstance(obj, str):
@@ -165,30 +535,61 @@ def split_nomination_id(nomination_id):
 
 
 def process_set(to_fetch, fetch_func, options, *extra_args):
+    # Keep only counts of the items that went OK so that memory stays flat
+    # no matter how many items stream through. Errors are kept in full for
+    # the admin email.
     errors = []
-    saved = []
-    skips = []
+    saved = 0
+    skips = 0
+    unchanged = 0
+
+    # With --workers=N, fetch_func runs concurrently on a pool of N threads
+    # (the default, good for network-bound tasks) or, with --pool=process,
+    # N processes (for CPU-bound tasks like parsing bill status XML). The
+    # bookkeeping below always happens here in the calling thread.
+    workers = int(options.get('workers', 1))
+    if workers > 1 and options.get('diff'):
+        logging.warn("--diff asks for confirmation interactively, ignoring --workers.")
+        workers = 1
+
+    # Record finished items in a checkpoint journal so that an interrupted
+    # run can pick up where it left off with --resume.
+    journal = ProcessSetJournal(fetch_func, options)
+    if journal.completed:
+        to_fetch = (id for id in to_fetch if item_id(id) not in journal.completed)
+
+    if workers > 1:
+        fetched = _fetch_parallel(to_fetch, fetch_func, options, extra_args, workers)
+    else:
+        fetched = _fetch_serial(to_fetch, fetch_func, options, extra_args)
+    if get_write_behind() is not None:
+        fetched = _wait_for_writes(fetched, options)
 
-    for id in to_fetch:
-        try:
-            results = fetch_func(id, options, *extra_args)
-        except Exception as e:
-            if options.get('raise', False):
-                raise
-            else:
-                errors.append((id, e, format_exception(e)))
+    try:
+        for id, results, exception_message in fetched:
+            if exception_message is not None:
+                errors.append((id, results, exception_message))
                 continue
 
-        if results.get('ok', False):
-            if results.get('saved', False):
-                saved.append(id)
-                logging.info("[%s] Updated" % id)
+            if results.get('ok', False):
+                if results.get('saved', False):
+                    saved += 1
+                    logging.info("[%s] Updated" % id)
+                elif results.get('unchanged', False):
+                    skips += 1
+                    unchanged += 1
+                    logging.info("[%s] Unchanged" % id)
+                else:
+                    skips += 1
+                    logging.warn("[%s] Skipping: %s" % (id, results['reason']))
+                journal.add(id)
             else:
-                skips.append(id)
-                logging.warn("[%s] Skipping: %s" % (id, results['reason']))
-        else:
-            errors.append((id, results, None))
-            logging.error("[%s] Error: %s" % (id, results['reason']))
+                errors.append((id, results, None))
+                logging.error("[%s] Error: %s" % (id, results['reason']))
+    except BaseException:
+        journal.close(finished=False)
+        raise
+    journal.close(finished=(len(errors) == 0))
 
     if len(errors) > 0:
         message = "\nErrors for %s items:\n" % len(errors)
@@ -203,18 +604,608 @@ def process_set(to_fetch, fetch_func, options, *extra_args):
         admin(message)  # email if possible
 
     logging.warning("\nErrors for %s." % len(errors))
-    logging.warning("Skipped %s." % len(skips))
-    logging.warning("Saved data for %s." % len(saved))
+    if journal.completed:
+        logging.warning("Resumed past %s." % len(journal.completed))
+    logging.warning("Skipped %s." % skips)
+    if unchanged:
+        logging.warning("Unchanged %s (included in skipped)." % unchanged)
+    logging.warning("Saved data for %s." % saved)
+
+    return {"saved": saved, "skipped": skips, "errors": len(errors)}
+
+# Return an iterator over the same items as seq, or None if seq is empty,
+# without consuming more than the first item of a generator.
+
+
+def peek(seq):
+    seq = iter(seq)
+    try:
+        first = next(seq)
+    except StopIteration:
+        return None
+    return itertools.chain([first], seq)
+
+# process_set items are usually ID strings, but some tasks (voteview) pass
+# whole records that carry their ID in an *_id field.
+
+
+def item_id(item):
+    if isinstance(item, dict):
+        for key in ("vote_id", "bill_id", "amendment_id", "nomination_id"):
+            if key in item:
+                return item[key]
+        return None
+    return str(item)
+
+# --shard=i/n splits the items of a run into n disjoint parts by a stable
+# hash of their IDs and keeps the i'th part (counting from 1), so that n
+# machines sharing a data directory can each run one part of a big job
+# without coordinating. Together the n shards cover every item exactly once.
+
+
+def get_shard(options):
+    shard = options.get("shard")
+    if not shard:
+        return None
+    try:
+        i, n = [int(x) for x in shard.split("/")]
+    except ValueError:
+        raise ValueError("Invalid --shard=%s, use i/n like --shard=1/4." % shard)
+    if not (1 <= i <= n):
+        raise ValueError("Invalid --shard=%s, i must be between 1 and n." % shard)
+    return (i, n)
+
+
+def in_shard(id, options):
+    shard = get_shard(options)
+    if shard is None:
+        return True
+    i, n = shard
+    return zlib.crc32(str(id).encode("utf8")) % n == i - 1
+
+
+def filter_shard(seq, options, key=item_id):
+    if get_shard(options) is None:
+        return seq
+    return (item for item in seq if in_shard(key(item), options))
+
+# process_set keeps a journal: an append-only file of the IDs it has
+# finished, one per line, at cache/journals/{module}.{function}-{key}.txt
+# (with the shard, e.g. votes.fetch_vote-shard1of4-{key}.txt, under --shard),
+# or at --journal=path. The key is a hash of the run's options (other than
+# the ones that only change how the run goes, like --workers), so that runs
+# of different commands don't share a journal. It is removed once the run
+# gets through the whole set, and kept if the run is interrupted or there
+# were errors. Running the same command again with --resume skips the IDs
+# already in it (retrying only the failed items); without --resume, the
+# journal is started over. Lines are fsync'd every --journal-sync=100 items
+# so that a crash loses at most a batch.
+#
+# A run locks its journal. If another run of the same command is still
+# going (from cron, say), this one keeps no journal rather than truncating
+# the other's.
+_journal_ignored_options = {
+    "journal", "resume", "journal_sync", "shard", "workers", "pool", "connections",
+    "write_behind", "write_queue", "trace", "log", "raise", "manifest", "manifest_keep",
+    "download_memo_bytes", "requests_per_minute", "adaptive",
+}
+
+
+def journal_key(options):
+    import hashlib
+    keyed = sorted(
+        (key, value) for key, value in options.items()
+        if key not in _journal_ignored_options and isinstance(value, (str, int, float, bool)))
+    return hashlib.sha1(json.dumps(keyed).encode("utf8")).hexdigest()[:12]
+
+
+class ProcessSetJournal(object):
+
+    def __init__(self, fetch_func, options):
+        import fcntl
+
+        self.file = None
+        self.completed = set()
+        self.path = options.get("journal")
+        if not isinstance(self.path, str):
+            name = "%s.%s" % (fetch_func.__module__.split(".")[-1], fetch_func.__name__)
+            if get_shard(options):
+                name += "-shard%dof%d" % get_shard(options)
+            name += "-" + journal_key(options)
+            self.path = os.path.join(cache_dir(), "journals", name + ".txt")
+        self.sync_every = int(options.get("journal_sync", 100))
+        self.unsynced = 0
+
+        mkdir_p(os.path.dirname(self.path) or ".")
+        while True:
+            f = open(self.path, "a+")
+            try:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                f.close()
+                logging.warn("Another run is using %s, so this one keeps no journal." % self.path)
+                return
+            # (Unless the run that had it locked removed it meanwhile.)
+            try:
+                if os.path.samestat(os.fstat(f.fileno()), os.stat(self.path)):
+                    break
+            except FileNotFoundError:
+                pass
+            f.close()
+
+        if options.get("resume"):
+            f.seek(0)
+            self.completed = set(line.rstrip("\n") for line in f if line.endswith("\n"))
+            if self.completed:
+                logging.warn("Resuming: %d items already completed according to %s." % (len(self.completed), self.path))
+            else:
+                logging.warn("Nothing to resume in %s (the options must match the interrupted run's)." % self.path)
+        else:
+            f.truncate(0)
+        self.file = f
+
+    def add(self, item):
+        if self.file is None:
+            return
+        id = item_id(item)
+        if id is None or "\n" in id:
+            return
+        self.file.write(id + "\n")
+        self.unsynced += 1
+        if self.unsynced >= self.sync_every:
+            self.sync()
+
+    def sync(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.unsynced = 0
+
+    def close(self, finished):
+        if self.file is None:
+            return
+        self.sync()
+        if finished:
+            try:
+                os.unlink(self.path)
+            except FileNotFoundError: # e.g. removed by hand
+                pass
+        self.file.close()
+
+# Call fetch_func on each item, yielding (id, results, None) on success and
+# (id, exception, formatted traceback) when fetch_func raises.
+
+
+def _fetch_serial(to_fetch, fetch_func, options, extra_args):
+    for id in to_fetch:
+        try:
+            results = call_fetch_func(fetch_func, id, options, extra_args)
+        except Exception as e:
+            if options.get('raise', False):
+                raise
+            message = format_exception(e)
+            yield id, e, message
+            continue
+        yield id, results, None
+
+# Run fetch_func on one item, tracing it if --trace is given. This is a
+# module-level function so that it can be sent to a process pool.
+
+
+def call_fetch_func(fetch_func, id, options, extra_args):
+    with trace_item(item_id(id), options):
+        write_behind = get_write_behind()
+        if write_behind is None:
+            return fetch_func(id, options, *extra_args)
+
+        # With --write_behind, queue the item's files together and return
+        # the WriteGroup, which gets the results once they're written.
+        group = _write_group_local.group = WriteGroup(None, [])
+        try:
+            group.results = fetch_func(id, options, *extra_args)
+        finally:
+            _write_group_local.group = None
+            if group.writes:
+                write_behind.put(group)
+        if not group.writes:
+            return group.results
+        return group
+
+# With --write_behind, hold back the items whose files are still being
+# written until they're on disk, then yield them like the items that
+# had nothing to write.
+
+
+def _wait_for_writes(fetched, options):
+    pending = collections.deque()
+
+    def written(id, group):
+        group.done.wait()
+        if group.exception is not None:
+            if options.get('raise', False):
+                raise group.exception
+            return id, group.exception, group.message
+        results = group.results
+        if results.get('saved', False) and group.counts() and not group.changed:
+            results = merge(results, {"saved": False, "unchanged": True, "reason": "unchanged"})
+        return id, results, None
+
+    for id, results, exception_message in fetched:
+        if isinstance(results, WriteGroup):
+            pending.append((id, results))
+        else:
+            yield id, results, exception_message
+        while pending and pending[0][1].done.is_set():
+            yield written(*pending.popleft())
+    while pending:
+        yield written(*pending.popleft())
+
+# Same as _fetch_serial but on a thread or process pool. Only a few items per
+# worker are submitted at a time so that to_fetch can be a long generator.
+
+
+def _fetch_parallel(to_fetch, fetch_func, options, extra_args, workers):
+    import concurrent.futures
+
+    pool = options.get('pool', 'thread')
+    if pool == 'thread':
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+    elif pool == 'process':
+        executor = concurrent.futures.ProcessPoolExecutor(max_workers=workers, initializer=_start_pool_process, initargs=(_manifest.get(), workers))
+    else:
+        raise ValueError("Invalid pool %s (specify: thread, process)." % pool)
+
+    to_fetch = iter(to_fetch)
+    pending = {}
+    try:
+        while True:
+            for id in itertools.islice(to_fetch, workers * 2 - len(pending)):
+                if pool == 'thread':
+                    future = executor.submit(contextvars.copy_context().run, call_fetch_func, fetch_func, id, options, extra_args)
+                else:
+                    future = executor.submit(call_fetch_func, fetch_func, id, options, extra_args)
+                pending[future] = id
+            if not pending:
+                break
+
+            done, _ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                id = pending.pop(future)
+                try:
+                    results = future.result()
+                except Exception as e:
+                    if options.get('raise', False):
+                        raise
+                    message = format_exception(e)
+                    yield id, e, message
+                    continue
+                yield id, results, None
+    finally:
+        # On --raise (or if the caller stops early), don't start anything new.
+        for future in pending:
+            future.cancel()
+        executor.shutdown(wait=True)
+
+
+# With --trace=path.jsonl, each item processed (a bill, a vote, a GovInfo
+# package, ...) appends a line to the trace file with its ID, the wall time
+# spent in each named stage (download, cache, read, parse, transform,
+# serialize, write), whether downloads were cache hits or misses, and the
+# bytes read and written. Stages can nest (e.g. a bill's "amendments" stage
+# includes the amendments' writes). When --trace is not given, trace_stage
+# returns a shared no-op context manager and nothing is recorded.
+_trace_local = threading.local()
+_trace_files = {}
+_trace_lock = threading.Lock()
+_null_stage = contextlib.nullcontext()
+
+
+@contextlib.contextmanager
+def trace_item(id, options):
+    # (The ID also goes in the --manifest.)
+    parent_id = getattr(_current_item, "id", None)
+    _current_item.id = id
+    try:
+        if not options.get("trace"):
+            yield None
+        else:
+            yield from _trace_item(id, options)
+    finally:
+        _current_item.id = parent_id
+
+
+def _trace_item(id, options):
+    record = {"id": id, "stages": {}, "cache": {"hit": 0, "miss": 0}, "bytes_in": 0, "bytes_out": 0}
+    parent = getattr(_trace_local, "record", None)
+    _trace_local.record = record
+    start = time.perf_counter()
+    try:
+        yield record
+    except BaseException:
+        record["error"] = True
+        raise
+    finally:
+        _trace_local.record = parent
+        record["time"] = round(time.perf_counter() - start, 6)
+        for stage in record["stages"]:
+            record["stages"][stage] = round(record["stages"][stage], 6)
+        _trace_write(options["trace"], record)
+
+
+def _trace_write(path, record):
+    # Each process appends whole lines with a single write() to a file opened
+    # with O_APPEND, so lines from pool workers don't interleave.
+    line = (json.dumps(record, sort_keys=True) + "\n").encode("utf8")
+    with _trace_lock:
+        fd = _trace_files.get((os.getpid(), path))
+        if fd is None:
+            mkdir_p(os.path.dirname(path) or ".")
+            fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o666)
+            _trace_files[(os.getpid(), path)] = fd
+        os.write(fd, line)
+
+
+class _TraceStage(object):
+
+    def __init__(self, record, name):
+        self.record = record
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, type, value, traceback):
+        stages = self.record["stages"]
+        stages[self.name] = stages.get(self.name, 0) + (time.perf_counter() - self.start)
+
+
+def trace_stage(name):
+    record = getattr(_trace_local, "record", None)
+    if record is None:
+        return _null_stage
+    return _TraceStage(record, name)
+
 
-    return saved + skips  # all of the OK's
+def trace_cache(hit):
+    record = getattr(_trace_local, "record", None)
+    if record is not None:
+        record["cache"]["hit" if hit else "miss"] += 1
+
+
+def trace_bytes(bytes_in=0, bytes_out=0):
+    record = getattr(_trace_local, "record", None)
+    if record is not None:
+        record["bytes_in"] += bytes_in
+        record["bytes_out"] += bytes_out
+
+
+# With the cache_store setting (see cache_store.py), the files download()
+# caches go into a compressed, content-addressed store instead of the
+# cache directory. Returns the store, or None when it's not turned on.
+_cache_stores = {}
+_cache_stores_lock = threading.Lock()
+
+
+def get_cache_store(options):
+    setting = options.get("cache_store", ((get_config() or {}).get("output") or {}).get("cache_store"))
+    if not setting or str(setting).lower() in ("false", "no"):
+        return None
+    if setting is True or str(setting).lower() in ("true", "yes"):
+        path = os.path.join(cache_dir(), "store.sqlite")
+    else:
+        path = setting
+    with _cache_stores_lock:
+        if path not in _cache_stores:
+            from congress.tasks.cache_store import CacheStore
+            _cache_stores[path] = CacheStore(path)
+        return _cache_stores[path]
+
+# With force, a file already in the cache directory is revalidated with the
+# server instead of downloaded again, using the ETag and Last-Modified
+# headers saved next to it (in {file}-http.json) when it was downloaded. If
+# the server answers 304 Not Modified, the cached file is used. Callers that
+# can skip their work in that case can pass the 'if_changed' option to get
+# UNCHANGED back instead of the content.
+UNCHANGED = object()
+
+# download() also serves files from ZIP archives in the cache directory
+# (see pack_cache.py). The open ZipFile objects are kept, since they are
+# slow to instantiate, up to --open_zip_files=16 at a time, dropping the
+# least recently used one. open_zip_file counts the threads reading from an
+# archive until they call release_zip_file, so that one that is dropped
+# while a thread is reading from it is closed only when the last reader
+# releases it.
+_download_zip_files = collections.OrderedDict()
+_download_zip_files_lock = threading.Lock()
+
+
+class OpenZipFile(object):
+
+    def __init__(self, zfn):
+        self.zipfile = zipfile.ZipFile(zfn, "r")
+        self.mtime = os.path.getmtime(zfn)
+        self.readers = 0
+        self.dropped = False
+
+    # Both called with _download_zip_files_lock held.
+    def drop(self):
+        self.dropped = True
+        if self.readers == 0:
+            self.zipfile.close()
+
+    def release(self):
+        self.readers -= 1
+        if self.dropped and self.readers == 0:
+            self.zipfile.close()
+
+# If the cache directory has a zip-index.txt (written by usc-run
+# pack_cache), it lists every archive there, so download() can look up the
+# archives that could hold a file without checking for one at each level
+# of its path. Without the index, download() checks each level.
+ZIP_INDEX_FILE = "zip-index.txt"
+_zip_indexes = {}
+
+
+def get_zip_index(cache):
+    with _download_zip_files_lock:
+        if cache not in _zip_indexes:
+            path = os.path.join(cache, ZIP_INDEX_FILE)
+            if os.path.exists(path):
+                with open(path) as f:
+                    _zip_indexes[cache] = set(line.strip() for line in f if line.strip())
+            else:
+                _zip_indexes[cache] = None
+        return _zip_indexes[cache]
+
+
+# Files in the cache directory that are read by their path rather than
+# through download(), which cache_store and pack_cache leave in place: ZIP
+# files and their index, the pickles of parsed YAML files, the GovInfo
+# sitemap lastmod files (per shard, too), HTTP validators, the circuit
+# breakers, the process_set journals, the cache store, and temporary files.
+_read_by_path_names = (ZIP_INDEX_FILE, CIRCUIT_BREAKERS_FILE)
+_read_by_path_re = re.compile(r"(\.zip|\.pickle|-lastmod(-shard\d+of\d+)?\.yaml|-http\.json|\.tmp|\.sqlite(-wal|-shm|-journal)?)$")
+
+
+def is_read_by_path(root, path):
+    relpath = os.path.relpath(path, root).replace(os.sep, "/")
+    return relpath in _read_by_path_names or relpath.startswith("journals/") or _read_by_path_re.search(relpath) is not None
+
+
+def open_zip_file(zfn, options):
+    with _download_zip_files_lock:
+        zf = _download_zip_files.get(zfn)
+        if zf:
+            _download_zip_files.move_to_end(zfn)
+            zf.readers += 1
+            return zf
+
+        try:
+            zf = OpenZipFile(zfn)
+        except FileNotFoundError:
+            return None
+        zf.readers += 1
+        _download_zip_files[zfn] = zf
+        logging.warn("Loaded: %s" % zfn)
+
+        while len(_download_zip_files) > int(options.get("open_zip_files", 16)):
+            _download_zip_files.popitem(last=False)[1].drop()
+        return zf
+
+
+def release_zip_file(zf):
+    with _download_zip_files_lock:
+        zf.release()
+
+
+# Drop the ZIP file instances kept open by download() whose files were
+# replaced or removed since they were opened (closing them once no thread
+# is reading from them), and forget the ZIP indexes, so that a long-running
+# process (see the daemon task) sees the new contents.
+def close_changed_zip_files():
+    with _download_zip_files_lock:
+        _zip_indexes.clear()
+        for zfn, zf in list(_download_zip_files.items()):
+            if not os.path.exists(zfn) or os.path.getmtime(zfn) != zf.mtime:
+                del _download_zip_files[zfn]
+                zf.drop()
+                logging.info("Closed changed ZIP file: %s" % zfn)
+
+
+# Within a run (see run.run_tasks), pages that aren't saved to the cache,
+# or that are downloaded again with --force, are kept in memory in case the
+# same run downloads them again, up to --download_memo_bytes=67108864 of
+# them, dropping the least recently used ones. Each run has its own memo
+# (the daemon runs tasks at the same time on different threads), kept in a
+# context variable like the write-behind threads. And at any time, threads
+# that download the same page at once share one request.
+class DownloadMemo(object):
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.bodies = collections.OrderedDict()
+        self.size = 0
+        self.hits = 0
+
+    def get(self, key):
+        body = self.bodies.get(key)
+        if body is not None:
+            self.bodies.move_to_end(key)
+            self.hits += 1
+        return body
+
+    def put(self, key, body):
+        if len(body) > self.max_bytes:
+            return
+        if key in self.bodies:
+            self.size -= len(self.bodies.pop(key))
+        self.bodies[key] = body
+        self.size += len(body)
+        while self.size > self.max_bytes:
+            self.size -= len(self.bodies.popitem(last=False)[1])
+
+
+_download_memo = contextvars.ContextVar("download_memo", default=None)
+_downloads_in_flight = {}
+_downloads_lock = threading.Lock()
+
+
+def start_download_memo(options):
+    _download_memo.set(DownloadMemo(int(options.get("download_memo_bytes", 64 << 20))))
+
+
+def stop_download_memo():
+    memo = _download_memo.get()
+    _download_memo.set(None)
+    if memo and memo.hits:
+        logging.info("%d downloads were served from memory." % memo.hits)
 
 
 # Download file at `url`, cache to `destination`.
 # Takes many options to customize behavior.
-_download_zip_files = {}
+def download(url, destination=None, options={}):
+    # POSTs and downloads that don't return the page, or that the caller
+    # wants to know are unchanged, aren't shared.
+    if options.get('postdata') or options.get('if_changed') \
+       or (options.get('binary', False) and not options.get('needs_content', True)):
+        return _download(url, destination, options)
+
+    key = (url, destination, options.get('to_cache', True), options.get('binary', False), options.get('force', False), options.get('test', False))
+    memoize = destination is None or options.get('force', False)
+
+    memo = _download_memo.get()
+    with _downloads_lock:
+        body = memo.get(key) if memo and memoize else None
+        future = _downloads_in_flight.get(key)
+        if body is None and future is None:
+            import concurrent.futures
+            future = _downloads_in_flight[key] = concurrent.futures.Future()
+            is_owner = True
+        else:
+            is_owner = False
 
+    if body is not None:
+        trace_cache(True)
+        return body
+    if not is_owner:
+        return future.result()
 
-def download(url, destination=None, options={}):
+    try:
+        body = _download(url, destination, options)
+    except BaseException as e:
+        with _downloads_lock:
+            del _downloads_in_flight[key]
+        future.set_exception(e)
+        raise
+
+    with _downloads_lock:
+        if memo and memoize and isinstance(body, (str, bytes)):
+            memo.put(key, body)
+        del _downloads_in_flight[key]
+    future.set_result(body)
+    return body
+
+
+def _download(url, destination=None, options={}):
     # uses cache by default, override (True) to ignore
     force = options.get('force', False)
 
@@ -237,6 +1228,9 @@ def download(url, destination=None, options={}):
     # caller cares about actually bytes or only success/fail
     needs_content = options.get('needs_content', True) or not is_binary or postdata
 
+    # caller can skip its work if the server says the cached file is current
+    if_changed = options.get('if_changed', False)
+
     # form the path to the file if we intend on saving it to disk
     if destination:
         if to_cache:
@@ -249,6 +1243,9 @@ def download(url, destination=None, options={}):
         else:
             cache_path = destination
 
+    # Files in the cache directory may be kept in the cache store instead.
+    store = get_cache_store(options) if destination and to_cache and not test else None
+
     # If we are working in the cache directory, look for a zip file
     # anywhere along the path like "cache/93/bills.zip", and see if
     # the file is already cached inside it (e.g. as 'bills/pages/...").
@@ -258,31 +1255,37 @@ def download(url, destination=None, options={}):
     # archive.
     if destination and to_cache:
         dparts = destination.split(os.sep)
+        zip_index = get_zip_index(cache)
         for i in range(len(dparts) - 1):
             # form the ZIP file name and test if it exists...
+            if zip_index is not None and "/".join(dparts[:i + 1]) + ".zip" not in zip_index:
+                continue
             zfn = os.path.join(cache, *dparts[:i + 1]) + ".zip"
-            if not os.path.exists(zfn):
+            if zip_index is None and not os.path.exists(zfn):
                 continue
 
             # load and keep the ZIP file instance in memory because it's slow to instantiate this object
-            zf = _download_zip_files.get(zfn)
+            zf = open_zip_file(zfn, options)
             if not zf:
-                zf = zipfile.ZipFile(zfn, "r")
-                _download_zip_files[zfn] = zf
-                logging.warn("Loaded: %s" % zfn)
+                continue
 
             # see if the inner file exists, and if so read the bytes
             try:
                 zfn_inner = os.path.join(*dparts[i:])
-                body = zf.read(zfn_inner)
+                with trace_stage("cache"):
+                    body = zf.zipfile.read(zfn_inner)
             except KeyError:
                 # does not exist
                 continue
+            finally:
+                release_zip_file(zf)
 
             if not test:
                 logging.info("Cached: (%s, %s)" % (zfn + "#" + zfn_inner, url))
             if force:
                 raise Exception("Cannot re-download a file already cached to a ZIP file.")
+            trace_cache(True)
+            trace_bytes(bytes_in=len(body))
 
             if not is_binary:
                 body = body.decode("utf8")
@@ -290,31 +1293,107 @@ def download(url, destination=None, options={}):
 
             return body
 
+    # Load the file from the cache store if it's there and force is False.
+    stored = None
+    if store and (not force):
+        with trace_stage("cache"):
+            stored = store.get(destination)
+    if stored is not None:
+        logging.info("Cached: (%s#%s, %s)" % (store.path, destination, url))
+        trace_cache(True)
+        if not needs_content:
+            return True
+        body = stored
+        trace_bytes(bytes_in=len(body))
+        if not is_binary:
+            body = body.decode("utf8")
+
     # Load the file from disk if it's already been downloaded and force is False.
-    if destination and (not force) and os.path.exists(cache_path):
+    elif destination and (not force) and os.path.exists(cache_path):
         if not test:
             logging.info("Cached: (%s, %s)" % (cache_path, url))
+        trace_cache(True)
         if not needs_content:
             return True
-        with open(cache_path, 'rb') as f:
-            body = f.read()
+        with trace_stage("cache"):
+            with open(cache_path, 'rb') as f:
+                body = f.read()
+        trace_bytes(bytes_in=len(body))
         if not is_binary:
             body = body.decode("utf8")
 
     # Download from the network and cache to disk.
     else:
+        if destination and to_cache:
+            trace_cache(False)
+        import requests
+        import scrapelib
+        scraper = get_scraper()
+        limiter = get_host_limiter(url, options)
+        if not limiter.allow_request():
+            logging.info("Skipped (%s is down): %s" % (limiter.host, url))
+            return None
+
+        # The store keeps whole files, so it doesn't stream.
+        if store:
+            needs_content = True
+
+        # Revalidate the cached file, if there is one.
+        validators_path = None
+        validators = None
+        headers = {}
+        if store and not postdata:
+            validators = store.get_validators(destination)
+        elif destination and to_cache and needs_content and not postdata:
+            validators_path = cache_path + "-http.json"
+            if os.path.exists(cache_path) and os.path.exists(validators_path):
+                with open(validators_path) as f:
+                    validators = json.load(f)
+        if validators:
+            if validators.get("etag"):
+                headers["If-None-Match"] = validators["etag"]
+            if validators.get("last_modified"):
+                headers["If-Modified-Since"] = validators["last_modified"]
+
         try:
             logging.info("Downloading: %s" % url)
 
             if postdata:
-                response = scraper.post(url, postdata, **urlopen_kwargs)
+                with limiter, trace_stage("download"):
+                    response = scraper.post(url, postdata, **urlopen_kwargs)
             else:
                 if not needs_content:
-                    mkdir_p(os.path.dirname(cache_path))
-                    scraper.urlretrieve(url, cache_path, **urlopen_kwargs)
+                    # Stream the file to disk so that a big file doesn't
+                    # have to fit in memory.
+                    with limiter, trace_stage("download"):
+                        response = scraper.get(url, stream=True, **urlopen_kwargs)
+                        with response:
+                            written = write_stream(response.iter_content(DOWNLOAD_CHUNK_SIZE), cache_path)
+                    if written is None:
+                        return None
+                    size, sha256 = written
+                    trace_bytes(bytes_in=size)
+                    logging.info("Downloaded %s (%d bytes, SHA-256 %s)" % (cache_path, size, sha256))
                     return True
 
-                response = scraper.get(url, **urlopen_kwargs)
+                with limiter, trace_stage("download"):
+                    response = scraper.get(url, headers=headers, **urlopen_kwargs)
+
+                if response.status_code == 304 and headers:
+                    logging.info("Not modified: (%s, %s)" % (cache_path, url))
+                    if if_changed:
+                        return UNCHANGED
+                    with trace_stage("cache"):
+                        if store:
+                            body = store.get(destination)
+                        else:
+                            with open(cache_path, 'rb') as f:
+                                body = f.read()
+                    trace_bytes(bytes_in=len(body))
+                    if not is_binary:
+                        body = unescape(body.decode("utf8"))
+                    return body
+            trace_bytes(bytes_in=len(response.content))
 
             if not is_binary:
                 body = response.text  # a subclass of a 'unicode' instance
@@ -325,58 +1404,498 @@ def download(url, destination=None, options={}):
                 if isinstance(body, str):
                     raise ValueError("Binary content improperly decoded.")
         except scrapelib.HTTPError as e:
+            if e.response.status_code >= 500:
+                limiter.record_failure()
             logging.error("Error downloading %s:\n\n%s" % (url, format_exception(e)))
             if options.get("return_status_code_on_error"):
                 return e.response.status_code
             return None
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout, requests.exceptions.ChunkedEncodingError):
+            limiter.record_failure()
+            raise
+        finally:
+            limiter.end_request()
 
-        # don't allow 0-byte files
-        if (not body) or (not body.strip()):
+        # don't allow 0-byte files (isspace doesn't copy a big body like strip would)
+        if (not body) or body.isspace():
             return None
 
-        # cache content to disk
-        if destination:
+        # cache content to the store, with the headers to revalidate it with next time
+        if store:
+            with trace_stage("write"):
+                store.put(destination, body if is_binary else body.encode("utf8"),
+                          response.headers.get("ETag"), response.headers.get("Last-Modified"))
+
+        # or to disk
+        elif destination:
             write(body if is_binary else body.encode("utf8"), cache_path)
 
+        # and the headers to revalidate it with next time (as a marker, so
+        # that with --write_behind they are saved only after the file is)
+        if validators_path:
+            validators = {
+                "etag": response.headers.get("ETag"),
+                "last_modified": response.headers.get("Last-Modified"),
+            }
+            if validators["etag"] or validators["last_modified"]:
+                write(json.dumps(validators), validators_path, {"marker": True})
+            elif os.path.exists(validators_path):
+                os.unlink(validators_path)
+
     if not is_binary:
         body = unescape(body)
 
     return body
 
 
+# Download many files at once. downloads is an iterable of (url,
+# destination) or (url, destination, options) tuples, where the options
+# are added to the shared options. Each is passed to download() on a pool
+# of --connections=8 threads, and (download tuple, result) pairs are
+# generated in the order they finish. Only a few downloads per connection
+# are taken from the iterable at a time, so it can be a long generator.
+# An exception raised by download() is logged and its result is None,
+# unless --raise is given. With --trace, each download is traced as an
+# item named by its destination.
+
+
+def download_batch(downloads, options={}):
+    import concurrent.futures
+
+    connections = int(options.get("connections", 8))
+    if connections <= 1:
+        for d in downloads:
+            yield d, _download_one(d, options)
+        return
+
+    downloads = iter(downloads)
+    pending = {}
+    with concurrent.futures.ThreadPoolExecutor(max_workers=connections, thread_name_prefix="download") as executor:
+        try:
+            while True:
+                for d in itertools.islice(downloads, connections * 2 - len(pending)):
+                    pending[executor.submit(contextvars.copy_context().run, _download_one, d, options)] = d
+                if not pending:
+                    break
+
+                done, _ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    yield pending.pop(future), future.result()
+        finally:
+            # If the caller stops early, don't start anything new.
+            for future in pending:
+                future.cancel()
+
+
+def _download_one(d, options):
+    url, destination = d[:2]
+    if len(d) > 2:
+        options = merge(options, d[2])
+    try:
+        with trace_item(destination or url, options):
+            return download(url, destination, options)
+    except Exception:
+        if options.get("raise", False):
+            raise
+        logging.exception("Error downloading %s." % url)
+        return None
+
+
+# Write chunks of bytes to path without holding them all in memory. They
+# go to a temporary file next to path, which replaces path only once all
+# of the chunks are written (and synced to disk, so that a crash can't
+# leave an empty file in its place), so a failed download never leaves a
+# partial file behind. Returns the size and SHA-256 hash of the content, or None
+# (leaving path alone) if there was no content other than whitespace.
+DOWNLOAD_CHUNK_SIZE = 1 << 16
+
+
+def write_stream(chunks, path):
+    import hashlib
+
+    mkdir_p(os.path.dirname(path) or ".")
+    temp_path = "%s.%d-%d.tmp" % (path, os.getpid(), threading.get_ident())
+    sha256 = hashlib.sha256()
+    size = 0
+    has_content = False
+    try:
+        with open(temp_path, "wb") as f:
+            for chunk in chunks:
+                if not chunk:
+                    continue
+                if not has_content and not chunk.isspace():
+                    has_content = True
+                f.write(chunk)
+                sha256.update(chunk)
+                size += len(chunk)
+            f.flush()
+            os.fsync(f.fileno())
+        if not has_content:
+            os.unlink(temp_path)
+            return None
+        existed = _manifest.get() is not None and os.path.exists(path)
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.unlink(temp_path)
+        raise
+    record_change(path, "modified" if existed else "added", sha256.hexdigest(), size)
+    return size, sha256.hexdigest()
+
+
+# With --manifest, each file that a run adds to, changes in or deletes from
+# the data directory gets a line in manifests/changes.jsonl (or at
+# --manifest=path), so that whatever syncs or indexes the data directory
+# can look at just those files. Each line is a JSON object with the file's
+# path relative to the data directory, its SHA-256 hash and size (null if
+# it was deleted), the change ("added", "modified" or "deleted") and the ID
+# of the item (bill, vote, GovInfo package, ...) being processed when it
+# changed, if any.
+#
+# The lines go to a temporary file of the run's own as the run goes along
+# (appended with single writes, so threads and the processes of a process
+# pool can share it), which replaces the manifest at the end of the run.
+# The previous --manifest_keep=10 manifests are kept as changes.jsonl.1 (the
+# last run), changes.jsonl.2, and so on.
+#
+# Like the write-behind threads, the manifest belongs to one run, in a
+# context variable, since the daemon runs tasks at the same time.
+_manifest = contextvars.ContextVar("manifest", default=None)
+_manifest_ids = itertools.count()
+_manifest_lock = threading.Lock()
+_current_item = threading.local()
+
+
+class ChangeManifest(object):
+
+    def __init__(self, path, keep):
+        self.path = path
+        self.keep = keep
+        self.root = os.path.abspath(data_dir()) + os.sep
+        mkdir_p(os.path.dirname(path) or ".")
+        self.temp_path = "%s.%d-%d.tmp" % (path, os.getpid(), next(_manifest_ids))
+        self.fd = os.open(self.temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | os.O_APPEND, 0o666)
+
+    # Sent to the processes of a process pool, which open the file again.
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        del state["fd"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.fd = os.open(self.temp_path, os.O_WRONLY | os.O_APPEND)
+
+    def add(self, path, change, sha256, size, id):
+        path = os.path.abspath(path)
+        if not path.startswith(self.root):
+            return
+        line = json.dumps({"path": path[len(self.root):].replace(os.sep, "/"), "sha256": sha256, "size": size, "change": change, "id": id}, sort_keys=True)
+        os.write(self.fd, (line + "\n").encode("utf8"))
+
+    def finish(self):
+        os.fsync(self.fd)
+        os.close(self.fd)
+        with _manifest_lock:
+            self.publish()
+
+    def publish(self):
+        if os.path.exists(self.path) and self.keep > 0:
+            for i in range(self.keep - 1, 0, -1):
+                if os.path.exists("%s.%d" % (self.path, i)):
+                    os.replace("%s.%d" % (self.path, i), "%s.%d" % (self.path, i + 1))
+            if os.path.exists(self.path + ".1"): # with --manifest_keep=1
+                os.unlink(self.path + ".1")
+            # (A link, so that there is always a manifest at path.)
+            os.link(self.path, self.path + ".1")
+        os.replace(self.temp_path, self.path)
+
+
+def start_manifest(options):
+    if options.get("manifest"):
+        path = options["manifest"]
+        if path is True:
+            path = os.path.join("manifests", "changes.jsonl")
+        _manifest.set(ChangeManifest(path, int(options.get("manifest_keep", 10))))
+
+
+def finish_manifest():
+    manifest = _manifest.get()
+    _manifest.set(None)
+    if manifest is not None:
+        manifest.finish()
+
+
+def use_manifest(manifest):
+    _manifest.set(manifest)
+
+
+# The initializer of process_set's process pools.
+def _start_pool_process(manifest, processes):
+    global _pool_processes
+    _pool_processes = processes
+    # Limiters forked from the parent would have the whole rate.
+    _host_limiters.clear()
+    use_manifest(manifest)
+
+
+def record_change(path, change, sha256=None, size=None):
+    manifest = _manifest.get()
+    if manifest is not None:
+        manifest.add(path, change, sha256, size, getattr(_current_item, "id", None))
+
+
+
+# With --write_behind=N, write() hands files to N background threads instead
+# of writing them itself, so that the next item can be parsed while a slow
+# disk (like a data directory on NFS) catches up. At most --write_queue=64
+# items wait to be written; after that, write() waits for the threads.
+#
+# The files that process_set's fetch_func writes for an item are written
+# together, in order, once fetch_func returns, and process_set counts the
+# item and adds it to its journal only when they are on disk. If a write
+# fails, the item's later files aren't written and the item is counted as
+# an error. Since write() can't know yet whether a file will change, it
+# returns True, and process_set counts the item as unchanged if none of its
+# files changed.
+#
+# Files written with the marker option record that other files are up to
+# date (like a bill's data-fromfdsys-lastmod.txt). They don't count as
+# changes, and outside of an item they are written only after everything
+# already queued is on disk. flush_writes() waits for the queue to empty and
+# raises the first error of a write made outside of an item. It is called
+# at the end of each task.
+#
+# Each run has its own write-behind threads (the daemon runs tasks at the
+# same time on different threads), kept in a context variable that the
+# thread pools of process_set and download_batch copy to their threads.
+_write_behind = contextvars.ContextVar("write_behind", default=None)
+_write_group_local = threading.local()
+
+
+class WriteGroup(object):
+
+    def __init__(self, results, writes):
+        self.results = results # None outside of process_set
+        self.writes = writes # (content, destination, options) tuples
+        self.id = getattr(_current_item, "id", None) # for the manifest
+        self.changed = False
+        self.exception = None
+        self.message = None
+        self.done = threading.Event()
+
+    def counts(self):
+        return any(not options.get("marker") for content, destination, options in self.writes)
+
+
+class WriteBehind(object):
+
+    def __init__(self, threads, queue_size):
+        import queue
+        self.pid = os.getpid()
+        self.queue = queue.Queue(queue_size)
+        self.pending = {} # destination => content not yet written, for read()
+        self.errors = []
+        self.lock = threading.Lock()
+        self.stopped = False
+        self.threads = [threading.Thread(target=contextvars.copy_context().run, args=(self.run,), daemon=True) for i in range(threads)]
+        for thread in self.threads:
+            thread.start()
+
+    def put(self, group):
+        with self.lock:
+            for content, destination, options in group.writes:
+                self.pending[destination] = content
+        with trace_stage("write"):
+            self.queue.put(group)
+
+    def get_pending(self, destination):
+        with self.lock:
+            return self.pending.get(destination)
+
+    def run(self):
+        while True:
+            group = self.queue.get()
+            if group is None:
+                self.queue.task_done()
+                return
+            _current_item.id = group.id
+            try:
+                for content, destination, options in group.writes:
+                    if _write(content, destination, options) and not options.get("marker"):
+                        group.changed = True
+            except Exception as e:
+                group.exception = e
+                group.message = format_exception(e)
+                if group.results is None:
+                    logging.error("Error writing %s: %s" % (destination, e))
+                    with self.lock:
+                        self.errors.append(e)
+            finally:
+                with self.lock:
+                    for content, destination, options in group.writes:
+                        if self.pending.get(destination) is content:
+                            del self.pending[destination]
+                group.done.set()
+                self.queue.task_done()
+
+    def flush(self):
+        self.queue.join()
+        with self.lock:
+            errors, self.errors = self.errors, []
+        if errors:
+            raise errors[0]
+
+    def stop(self):
+        self.stopped = True
+        self.queue.join()
+        for thread in self.threads:
+            self.queue.put(None)
+        for thread in self.threads:
+            thread.join()
+
+
+def start_write_behind(options):
+    threads = int(options.get("write_behind", 0))
+    if threads > 0 and not options.get("diff"):
+        _write_behind.set(WriteBehind(threads, int(options.get("write_queue", 64))))
+
+
+def stop_write_behind():
+    write_behind = _write_behind.get()
+    _write_behind.set(None)
+    if write_behind is not None:
+        write_behind.stop()
+
+
+def flush_writes():
+    write_behind = get_write_behind()
+    if write_behind is not None:
+        write_behind.flush()
+
+
+# The write-behind threads aren't copied into the processes of a process
+# pool, so they write their files themselves.
+def get_write_behind():
+    write_behind = _write_behind.get()
+    if write_behind is None or write_behind.pid != os.getpid() or write_behind.stopped:
+        return None
+    return write_behind
+
+
+# Write content (a str, which is saved as UTF-8, or bytes) to destination.
+# The content goes to a temporary file next to it that is synced to disk
+# and then replaces it, so that a crash (even of the machine) never leaves
+# a partly written or empty file behind. If the file
+# already has this content, it's left alone (keeping its mtime, so tools
+# that sync or watch the data directory don't see a change) and False is
+# returned. Otherwise returns True once the file is written.
+#
+# With the ignore_updated_at option, the time a file was generated
+# (updated_at in JSON, updated="..." in GovTrack XML) is not counted as a
+# change, so it only moves forward when something else in the file changes.
+# Votes are written that way. Files whose update date comes from the source
+# data (bills, or pages in the cache) are written whenever it changes.
 def write(content, destination, options={}):
     if options.get("diff"):
         # Instead of writing the file, do a comparison with what's on disk
         # to test any changes. But be nice and replace any update date with
         # what's in the previous file so we avoid spurrious changes in the
-        # diff. Use how updated_at appears in the JSON and in the XML.
+        # diff.
         if os.path.exists(destination):
             with open(destination) as f:
                 source = f.read()
-            revised = content
-            for pattern in ('"updated_at": ".*?"', 'updated=".*?"'):
-                m1 = re.search(pattern, source)
-                m2 = re.search(pattern, revised)
-                if m1 and m2:
-                    revised = revised.replace(m2.group(0), m1.group(0))
+            revised = keep_updated_at(source, content)
 
             # Avoid writing to disk and spawning `diff` by checking if
             # the files match in memory.
             if revised == source:
-                return
+                return False
 
             if not show_diff_ask_ok(source, revised, destination):
                 # User cancelled save.
-                return
+                return False
+
+    if isinstance(content, str):
+        content = content.encode('utf-8')
+
+    # With --write_behind, leave the writing to the write-behind threads.
+    write_behind = get_write_behind()
+    if write_behind is not None and not options.get("diff"):
+        group = getattr(_write_group_local, "group", None)
+        if group is not None:
+            group.writes.append((content, destination, options))
+            return True
+        if not options.get("marker"):
+            write_behind.put(WriteGroup(None, [(content, destination, options)]))
+            return True
+        write_behind.flush()
+
+    return _write(content, destination, options)
 
-    # Save the content to disk.
-    mkdir_p(os.path.dirname(destination))
-    f = open(destination, 'wb')
+
+def _write(content, destination, options):
+    with trace_stage("write"):
+        # Compare with the file on disk. It only needs to be read if it has
+        # the same size or there's an update date that might differ.
+        ignore_updated_at = options.get("ignore_updated_at", False)
+        existed = True
+        try:
+            if os.path.getsize(destination) == len(content) or (ignore_updated_at and b"updated" in content):
+                with open(destination, 'rb') as f:
+                    source = f.read()
+                if source == content:
+                    return False
+                if ignore_updated_at and keep_updated_at(source, content) == source:
+                    return False
+        except FileNotFoundError:
+            existed = False
+        except IsADirectoryError:
+            pass
+
+        # Save the content to disk.
+        mkdir_p(os.path.dirname(destination) or ".")
+        temp_path = "%s.%d-%d.tmp" % (destination, os.getpid(), threading.get_ident())
+        try:
+            with open(temp_path, 'wb') as f:
+                f.write(content)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_path, destination)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.unlink(temp_path)
+            raise
+        trace_bytes(bytes_out=len(content))
+        if _manifest.get() is not None:
+            import hashlib
+            record_change(destination, "modified" if existed else "added", hashlib.sha256(content).hexdigest(), len(content))
+        return True
+
+
+# Delete a file from the data directory, if it exists. Returns whether it did.
+def delete(destination):
     try:
-        f.write(content.encode('utf-8'))
-    except:
-        f.write(content)
-    f.close()
+        os.unlink(destination)
+    except FileNotFoundError:
+        return False
+    record_change(destination, "deleted")
+    return True
+
+
+# Replace the update date in revised (as it appears in the JSON and in the
+# XML) with the one in source. Both are str or both are bytes.
+_updated_at_patterns = (re.compile('"updated_at": ".*?"'), re.compile('updated=".*?"'))
+_updated_at_patterns_bytes = tuple(re.compile(pattern.pattern.encode("ascii")) for pattern in _updated_at_patterns)
+
+
+def keep_updated_at(source, revised):
+    for pattern in (_updated_at_patterns_bytes if isinstance(revised, bytes) else _updated_at_patterns):
+        m1 = pattern.search(source)
+        m2 = pattern.search(revised)
+        if m1 and m2:
+            revised = revised.replace(m2.group(0), m1.group(0))
+    return revised
 
 
 def show_diff_ask_ok(source, revised, fn):
@@ -391,21 +1910,90 @@ def show_diff_ask_ok(source, revised, fn):
     return input("Apply change? (y/n) ").strip() == "y"
 
 
-def write_json(data, destination):
-    return write(
-        json.dumps(data,
-            sort_keys=True,
-            indent=2,
-            default=format_datetime
-        ),
-        destination
+# Serializes data the way all of the JSON output files are written: keys
+# sorted, indented by two spaces, non-ASCII characters escaped, and dates and
+# times formatted by format_datetime.
+#
+# When orjson is installed it is used instead of the json module, which is
+# several times faster for large bills. Its output is made byte-for-byte the
+# same as json's. Data it would write differently (floats, which it formats
+# differently, or anything but plain dicts, lists, strings, numbers, dates and
+# times, like keys that aren't strings) is written with json.
+_orjson = None
+_orjson_types = frozenset((dict, list, tuple, str, int, bool, type(None), datetime.datetime, datetime.date))
+_non_ascii_re = re.compile("[\x7f-\U0010ffff]")
+
+
+def json_dumps(data):
+    global _orjson
+    if _orjson is None:
+        try:
+            import orjson
+            _orjson = orjson
+        except ImportError:
+            _orjson = False
+
+    if _orjson and orjson_can_dump(data):
+        try:
+            content = _orjson.dumps(data,
+                option=_orjson.OPT_INDENT_2 | _orjson.OPT_SORT_KEYS | _orjson.OPT_PASSTHROUGH_DATETIME,
+                default=format_datetime)
+        except TypeError: # e.g. keys that aren't strings, or integers over 64 bits
+            pass
+        else:
+            if content.isascii() and b"\x7f" not in content:
+                return content.decode("ascii")
+            return _non_ascii_re.sub(escape_json_character, content.decode("utf8"))
+
+    return json.dumps(data,
+        sort_keys=True,
+        indent=2,
+        default=format_datetime
     )
 
 
+def orjson_can_dump(data):
+    stack = [data]
+    while stack:
+        value = stack.pop()
+        if type(value) not in _orjson_types:
+            return False
+        if type(value) is dict:
+            stack.extend(value.values())
+        elif type(value) in (list, tuple):
+            stack.extend(value)
+    return True
+
+
+# Escapes a character like json.dumps does with ensure_ascii.
+def escape_json_character(match):
+    c = ord(match.group(0))
+    if c > 0xffff:
+        c -= 0x10000
+        return "\\u%04x\\u%04x" % (0xd800 | (c >> 10), 0xdc00 | (c & 0x3ff))
+    return "\\u%04x" % c
+
+
+def write_json(data, destination, options={}):
+    with trace_stage("serialize"):
+        content = json_dumps(data)
+    return write(content, destination, options)
+
+
 def read(destination):
+    # A file that is still waiting to be written reads as what it will be.
+    write_behind = get_write_behind()
+    if write_behind is not None:
+        content = write_behind.get_pending(destination)
+        if content is not None:
+            return content.decode("utf8")
+
     if os.path.exists(destination):
-        with open(destination) as f:
-            return f.read()
+        with trace_stage("read"):
+            with open(destination) as f:
+                content = f.read()
+        trace_bytes(bytes_in=len(content))
+        return content
 
 # dict1 gets overwritten with anything in dict2
 
@@ -445,14 +2033,16 @@ def xpath_regex(doc, element, pattern):
         namespaces={"re": "http://exslt.org/regular-expressions"})
 
 # taken from http://effbot.org/zone/re-sub.htm#unescape-html
+# download() runs every page it returns as text through this, so the
+# regular expressions are compiled once and the entities are only looked
+# for when there is an ampersand. Callers that parse the page with lxml
+# can pass the binary option instead to get the bytes, entities and all.
+_entity_re = re.compile(r"&#?\w+;")
+_unicode_control_re = re.compile('[\x00-\x08\x0B-\x0C\x0E-\x1F\x7F]')
 
 
 def unescape(text):
 
-    def remove_unicode_control(str):
-        remove_re = re.compile('[\x00-\x08\x0B-\x0C\x0E-\x1F\x7F]')
-        return remove_re.sub('', str)
-
     def fixup(m):
         text = m.group(0)
         if text[:2] == "&#":
@@ -472,8 +2062,9 @@ def unescape(text):
                 pass
         return text  # leave as is
 
-    text = re.sub("&#?\w+;", fixup, text)
-    text = remove_unicode_control(text)
+    if "&" in text:
+        text = _entity_re.sub(fixup, text)
+    text = _unicode_control_re.sub('', text)
     return text
 
 
@@ -497,6 +2088,7 @@ def extract_bills(text, session):
 def cache_dir():
     cache = None
 
+    config = get_config()
     if config:
         output = config.get('output', None)
         if output:
@@ -517,6 +2109,7 @@ def test_cache_dir():
 def data_dir():
     data = None
 
+    config = get_config()
     if config:
         output = config.get('output', None)
         if output:
@@ -537,6 +2130,7 @@ def admin(body):
 
         logging.error(body)  # always print it
 
+        config = get_config()
         if config:
             details = config.get('email', None)
             if details:
@@ -555,7 +2149,11 @@ def format_exception(exception):
 
 
 def send_email(message):
-    settings = config['email']
+    import smtplib
+    import email.utils
+    from email.mime.text import MIMEText
+
+    settings = get_config()['email']
 
     # adapted from http://www.doughellmann.com/PyMOTW/smtplib/
     msg = MIMEText(message)
@@ -581,6 +2179,7 @@ def send_email(message):
 
 def make_node(parent, tag, text, **attrs):
     """Make a node in an XML document."""
+    from lxml import etree
     n = etree.Element(tag)
     parent.append(n)
     n.text = text
@@ -640,7 +2239,8 @@ def get_file_hash(filename):
 
 
 def get_cache_filename(filename):
-    return os.path.join(cache_dir(), filename + '.pickle')
+    # (Absolute paths are also put under the cache directory.)
+    return os.path.join(cache_dir(), filename.lstrip(os.sep) + '.pickle')
 
 # Check if the cached file is newer.
 
@@ -722,14 +2322,40 @@ def require_congress_legislators_repo():
         os.system("git clone -q --depth 1 https://github.com/unitedstates/congress-legislators congress-legislators")
 
     if os.environ.get("UPDATE_CONGRESS_LEGISLATORS") != "NO":
-        # Update the repo so we have the latest.
-        logging.warn("Updating the congress-legislators repo...")
-        # these two == git pull, but git pull ignores -q on the merge part so is less quiet
-        os.system("cd congress-legislators; git fetch -pq; git merge --ff-only -q origin/main")
+        update_congress_legislators_repo()
 
     # We now have the congress-legislators repo.
     has_congress_legislators_repo = True
 
+
+def update_congress_legislators_repo():
+    # Update the repo so we have the latest.
+    logging.warn("Updating the congress-legislators repo...")
+    # these two == git pull, but git pull ignores -q on the merge part so is less quiet
+    os.system("cd congress-legislators; git fetch -pq; git merge --ff-only -q origin/main")
+
+
+# The in-memory legislator indexes below are built from these files. A
+# long-running process calls reload_legislator_caches_if_changed() to drop
+# the indexes after the files change, and they are rebuilt on next use.
+legislator_files = ("congress-legislators/legislators-historical.yaml", "congress-legislators/legislators-current.yaml")
+_legislator_caches_mtime = None
+
+
+def legislator_files_mtime():
+    return tuple(os.path.getmtime(fn) if os.path.exists(fn) else None for fn in legislator_files)
+
+
+def reload_legislator_caches_if_changed():
+    global lookup_legislator_cache, _translate_legislator_id_cache, _legislator_caches_mtime
+    if _legislator_caches_mtime is None or legislator_files_mtime() == _legislator_caches_mtime:
+        return False
+    logging.warn("The congress-legislators files changed, reloading legislators.")
+    lookup_legislator_cache = []
+    _translate_legislator_id_cache = None
+    _legislator_caches_mtime = None
+    return True
+
 lookup_legislator_cache = []
 
 
@@ -739,16 +2365,21 @@ def lookup_legislator(congress, role_type, name, state, party, when, id_requeste
 
     # On the first load, cache all of the legislators' terms in memory.
     # Group by Congress so we can limit our search later to be faster.
-    global lookup_legislator_cache
+    # The index is built before it is made visible so that other threads
+    # never see it half-filled.
+    global lookup_legislator_cache, _legislator_caches_mtime
     if not lookup_legislator_cache:
         require_congress_legislators_repo()
-        lookup_legislator_cache = {}  # from Congress number to list of (moc,term) tuples that might be in that Congress
-        for filename in ("legislators-historical", "legislators-current"):
-            for moc in yaml_load("congress-legislators/%s.yaml" % (filename)):
+        mtime = legislator_files_mtime()
+        cache = {}  # from Congress number to list of (moc,term) tuples that might be in that Congress
+        for filename in legislator_files:
+            for moc in yaml_load(filename):
                 for term in moc["terms"]:
                     for c in range(congress_from_legislative_year(int(term['start'][0:4])) - 1,
                                     congress_from_legislative_year(int(term['end'][0:4])) + 1 + 1):
-                        lookup_legislator_cache.setdefault(c, []).append((moc, term))
+                        cache.setdefault(c, []).append((moc, term))
+        lookup_legislator_cache = cache
+        _legislator_caches_mtime = mtime
 
     def to_ascii(name):
         name = name.replace("-", " ")
@@ -838,20 +2469,23 @@ class UnmatchedIdentifer(Exception):
 _translate_legislator_id_cache = None
 
 def translate_legislator_id(source_id_type, source_id, dest_id_type):
-    global _translate_legislator_id_cache
+    global _translate_legislator_id_cache, _legislator_caches_mtime
     # On the first load, cache all of the legislators' ids in memory.
     if not _translate_legislator_id_cache:
         require_congress_legislators_repo()
-        _translate_legislator_id_cache = { }
-        for filename in ("legislators-historical", "legislators-current"):
-            for moc in yaml_load("congress-legislators/%s.yaml" % (filename)):
+        mtime = legislator_files_mtime()
+        cache = { }
+        for filename in legislator_files:
+            for moc in yaml_load(filename):
                 for id_type, id_value in moc["id"].items():
                     try:
-                        _translate_legislator_id_cache[(id_type, id_value)] = moc['id']
+                        cache[(id_type, id_value)] = moc['id']
                     except TypeError:
                         # The 'fec' id is a list which is not hashable
                         # and so cannot go in the key of a cached entry.
                         pass
+        _translate_legislator_id_cache = cache
+        _legislator_caches_mtime = mtime
 
     # Get from mapping.
     try:
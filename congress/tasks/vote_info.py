@@ -1,12 +1,9 @@
 from congress.tasks import utils
 import logging
 import re
-import json
 from lxml import etree
 import time
 import datetime
-import os
-import os.path
 
 
 def fetch_vote(vote_id, options):
@@ -14,16 +11,15 @@ def fetch_vote(vote_id, options):
 
     vote_chamber, vote_number, vote_congress, vote_session_year = utils.split_vote_id(vote_id)
 
-    if vote_chamber == "h":
-        url = "https://clerk.house.gov/evs/%s/roll%03d.xml" % (vote_session_year, int(vote_number))
-    else:
-        session_num = int(vote_session_year) - utils.get_congress_first_year(int(vote_congress)) + 1
-        url = "https://www.senate.gov/legislative/LIS/roll_call_votes/vote%d%d/vote_%d_%d_%05d.xml" % (int(vote_congress), session_num, int(vote_congress), session_num, int(vote_number))
+    # (The votes task downloads the files first.)
+    if vote_id in options.get("failed_downloads", ()):
+        return {'saved': False, 'ok': False, 'reason': "failed to download"}
 
     # fetch vote XML page
+    url, destination = vote_source_for(vote_id)
     body = utils.download(
         url,
-        "%s/votes/%s/%s%s/%s%s.xml" % (vote_congress, vote_session_year, vote_chamber, vote_number, vote_chamber, vote_number),
+        destination,
         utils.merge(options, {'binary': True}),
     )
 
@@ -37,8 +33,7 @@ def fetch_vote(vote_id, options):
         # Vacated votes: 2011-484, 2012-327, ...
         # Remove file, since it may previously have existed with data.
         for f in (output_for_vote(vote_id, "json"), output_for_vote(vote_id, "xml")):
-            if os.path.exists(f):
-                os.unlink(f)
+            utils.delete(f)
         return {'saved': False, 'ok': True, 'reason': "vote was vacated"}
 
     if b"roll-call-vote-not-available.htm" in body:
@@ -47,7 +42,8 @@ def fetch_vote(vote_id, options):
         # In the case of very recent votes, this error should be temporary.
         return {"saved": False, "ok": True, "reason": "roll call vote not available"}
 
-    dom = etree.fromstring(body)
+    with utils.trace_stage("parse"):
+        dom = etree.fromstring(body)
 
     vote = {
         'vote_id': vote_id,
@@ -61,14 +57,16 @@ def fetch_vote(vote_id, options):
 
     # do the heavy lifting
 
-    if vote_chamber == "h":
-        parse_house_vote(dom, vote)
-    elif vote_chamber == "s":
-        parse_senate_vote(dom, vote)
+    with utils.trace_stage("transform"):
+        if vote_chamber == "h":
+            parse_house_vote(dom, vote)
+        elif vote_chamber == "s":
+            parse_senate_vote(dom, vote)
 
     # output and return
 
-    output_vote(vote, options)
+    if not output_vote(vote, options):
+        return {'ok': True, 'saved': False, 'unchanged': True, 'reason': "unchanged"}
 
     return {'ok': True, 'saved': True}
 
@@ -76,13 +74,33 @@ def fetch_vote(vote_id, options):
 def output_vote(vote, options, id_type=None):
     logging.info("[%s] Writing to disk..." % vote['vote_id'])
 
+    # A vote whose only change is its updated_at isn't written again.
+    write_options = utils.merge(options, {"ignore_updated_at": True})
+
     # output JSON - so easy!
-    utils.write(
-        json.dumps(vote, sort_keys=True, indent=2, default=utils.format_datetime),
+    with utils.trace_stage("serialize"):
+        vote_json = utils.json_dumps(vote)
+    wrote_json = utils.write(
+        vote_json,
         output_for_vote(vote["vote_id"], "json"),
-        options=options
+        options=write_options
     )
 
+    # output XML
+    with utils.trace_stage("serialize"):
+        xmloutput = govtrack_xml_for_vote(vote, options, id_type)
+
+    wrote_xml = utils.write(
+        xmloutput,
+        output_for_vote(vote['vote_id'], "xml"),
+        options=write_options
+    )
+
+    # False if the vote didn't change (other than its updated_at).
+    return wrote_json or wrote_xml
+
+
+def govtrack_xml_for_vote(vote, options, id_type=None):
     # What kind of IDs are we passed for Members of Congress?
     # For current data, we infer from the chamber. For historical data from voteview,
     # we're passed the type in id_type, which is set to "bioguide".
@@ -173,11 +191,22 @@ def output_vote(vote, options, id_type=None):
     xmloutput = re.sub('(source=".*?") ', r"\1\n  ", xmloutput)
     xmloutput = re.sub('(updated=".*?") ', r"\1\n  ", xmloutput)
 
-    utils.write(
-        xmloutput,
-        output_for_vote(vote['vote_id'], "xml"),
-        options=options
-    )
+    return xmloutput
+
+
+# The URL of a vote's XML file and where it is cached.
+
+
+def vote_source_for(vote_id):
+    vote_chamber, vote_number, vote_congress, vote_session_year = utils.split_vote_id(vote_id)
+
+    if vote_chamber == "h":
+        url = "https://clerk.house.gov/evs/%s/roll%03d.xml" % (vote_session_year, int(vote_number))
+    else:
+        session_num = int(vote_session_year) - utils.get_congress_first_year(int(vote_congress)) + 1
+        url = "https://www.senate.gov/legislative/LIS/roll_call_votes/vote%d%d/vote_%d_%d_%05d.xml" % (int(vote_congress), session_num, int(vote_congress), session_num, int(vote_number))
+
+    return url, "%s/votes/%s/%s%s/%s%s.xml" % (vote_congress, vote_session_year, vote_chamber, vote_number, vote_chamber, vote_number)
 
 
 def output_for_vote(vote_id, format):
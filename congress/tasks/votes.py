@@ -1,4 +1,6 @@
 from congress.tasks import utils
+import collections
+import itertools
 import json
 from iso8601 import iso8601
 import datetime
@@ -42,43 +44,85 @@ def run(options):
             # Fetch for the current session.
             sessions = [(utils.current_congress(), options.get('session', str(utils.current_legislative_year())))]
 
-        # Get the list of votes.
-        to_fetch = []
-        for congress, session_year in sessions:
-            if options.get('chamber', None) in ("house", None):
-                to_fetch += vote_ids_for_house(congress, session_year, options) or []
-            if options.get('chamber', None) in ("senate", None):
-                to_fetch += vote_ids_for_senate(congress, session_year, options) or []
+        # Get the votes. The vote IDs are streamed: each index page is
+        # downloaded when the votes before it have been processed.
+        to_fetch = itertools.chain.from_iterable(
+            vote_ids_for_session(congress, session_year, options)
+            for congress, session_year in sessions)
+        to_fetch = utils.filter_shard(to_fetch, options)
 
-        if not to_fetch:
+        limit = options.get('limit', None)
+        if limit:
+            to_fetch = itertools.islice(to_fetch, int(limit))
+
+        if options.get('pages_only', False):
+            # Just walk the index pages.
+            collections.deque(to_fetch, maxlen=0)
+            return None
+
+        to_fetch = utils.peek(to_fetch)
+        if to_fetch is None:
             if not options.get("fast", False):
                 logging.error("Error figuring out which votes to download, aborting.")
             else:
                 logging.warn("No new or recent votes.")
             return None
 
-        limit = options.get('limit', None)
-        if limit:
-            to_fetch = to_fetch[:int(limit)]
-
     if options.get('pages_only', False):
         return None
 
-    logging.warn("Going to fetch %i votes from congress/session %s" % (len(to_fetch), ", ".join(str(cs) for cs in sessions)))
+    logging.warn("Going to fetch votes from congress/session %s" % ", ".join(str(cs) for cs in sessions))
+
+    # The vote files are downloaded (or re-downloaded with --force) into the
+    # cache ahead of parsing, so fetch_vote reads them from there. It reports
+    # the votes whose download failed as errors rather than reading an older
+    # copy from the cache.
+    failed_downloads = set()
+    to_fetch = prefetch_votes(to_fetch, options, failed_downloads)
+    utils.process_set(to_fetch, vote_info.fetch_vote, utils.merge(options, {'force': False, 'failed_downloads': failed_downloads}))
+
+
+# Download the XML files of the votes --connections at a time. Generates the
+# vote IDs in the order their files arrive. A vote whose download failed is
+# still generated (after it is added to failed_downloads) so that its error
+# is reported.
 
-    utils.process_set(to_fetch, vote_info.fetch_vote, options)
+
+def prefetch_votes(to_fetch, options, failed_downloads):
+    vote_ids = { }
+
+    def get_downloads():
+        for vote_id in to_fetch:
+            url, destination = vote_info.vote_source_for(vote_id)
+            vote_ids[destination] = vote_id
+            yield (url, destination)
+
+    for (url, destination), result in utils.download_batch(get_downloads(), utils.merge(options, {'binary': True, 'needs_content': False})):
+        vote_id = vote_ids.pop(destination)
+        if not result:
+            failed_downloads.add(vote_id)
+        yield vote_id
+
+
+def vote_ids_for_session(congress, session_year, options):
+    if options.get('chamber', None) in ("house", None):
+        yield from vote_ids_for_house(congress, session_year, options)
+    if options.get('chamber', None) in ("senate", None):
+        yield from vote_ids_for_senate(congress, session_year, options)
 
 # page through listing of House votes of a particular congress and session
 
 
 def vote_ids_for_house(congress, session_year, options):
-    vote_ids = []
+    seen = set()
 
     index_page = "https://clerk.house.gov/evs/%s/index.asp" % session_year
     group_page = r"ROLL_(\d+)\.asp"
     link_pattern = r"http://clerk.house.gov/cgi-bin/vote.asp\?year=%s&rollnumber=(\d+)" % session_year
 
     # download index page, find the matching links to the paged listing of votes
+    # (as bytes: lxml decodes the page and its entities itself)
+    options = utils.merge(options, {'binary': True})
     page = utils.download(
         index_page,
         "%s/votes/%s/pages/house.html" % (congress, session_year),
@@ -86,7 +130,7 @@ def vote_ids_for_house(congress, session_year, options):
 
     if not page:
         logging.error("Couldn't download House vote index page, skipping")
-        return None
+        return
 
     # extract matching links
     doc = html.document_fromstring(page)
@@ -94,15 +138,15 @@ def vote_ids_for_house(congress, session_year, options):
         "//a[re:match(@href, '%s')]" % group_page,
         namespaces={"re": "http://exslt.org/regular-expressions"})
 
-    for link in links:
-        # get some identifier for this inside page for caching
-        grp = re.match(group_page, link.get("href")).group(1)
+    # get some identifier for each inside page for caching
+    group_pages = [
+        (urllib.parse.urljoin(index_page, link.get("href")),
+         "%s/votes/%s/pages/house_%s.html" % (congress, session_year, re.match(group_page, link.get("href")).group(1)))
+        for link in links]
 
-        # download inside page, find the matching links
-        page = utils.download(
-            urllib.parse.urljoin(index_page, link.get("href")),
-            "%s/votes/%s/pages/house_%s.html" % (congress, session_year, grp),
-            options)
+    # download the inside pages, find the matching links
+    for (url, destination), page in utils.download_batch(group_pages, options):
+        grp = re.match(r".*/house_(\d+)\.html$", destination).group(1)
 
         if not page:
             logging.error("Couldn't download House vote group page (%s), aborting" % grp)
@@ -116,18 +160,15 @@ def vote_ids_for_house(congress, session_year, options):
         for votelink in votelinks:
             num = re.match(link_pattern, votelink.get("href")).group(1)
             vote_id = "h" + num + "-" + str(congress) + "." + session_year
-            if not should_process(vote_id, options):
+            if vote_id in seen or not should_process(vote_id, options):
                 continue
-            vote_ids.append(vote_id)
-
-    return utils.uniq(vote_ids)
+            seen.add(vote_id)
+            yield vote_id
 
 
 def vote_ids_for_senate(congress, session_year, options):
     session_num = int(session_year) - utils.get_congress_first_year(int(congress)) + 1
 
-    vote_ids = []
-
     url = "https://www.senate.gov/legislative/LIS/roll_call_lists/vote_menu_%s_%d.xml" % (congress, session_num)
     page = utils.download(
         url,
@@ -137,17 +178,17 @@ def vote_ids_for_senate(congress, session_year, options):
 
     if not page or b"Requested Page Not Found (404)" in page:
         logging.error("Couldn't download Senate vote XML index %s, skipping" % url)
-        return None
+        return
 
     dom = etree.fromstring(page)
 
     # Sanity checks.
     if int(congress) != int(dom.xpath("congress")[0].text):
         logging.error("Senate vote XML returns the wrong Congress: %s" % dom.xpath("congress")[0].text)
-        return None
+        return
     if int(session_year) != int(dom.xpath("congress_year")[0].text):
         logging.error("Senate vote XML returns the wrong session: %s" % dom.xpath("congress_year")[0].text)
-        return None
+        return
 
     # Get vote list.
     for vote in dom.xpath("//vote"):
@@ -155,8 +196,7 @@ def vote_ids_for_senate(congress, session_year, options):
         vote_id = "s" + str(num) + "-" + str(congress) + "." + session_year
         if not should_process(vote_id, options):
             continue
-        vote_ids.append(vote_id)
-    return vote_ids
+        yield vote_id
 
 
 def should_process(vote_id, options):
@@ -170,5 +210,5 @@ def should_process(vote_id, options):
         return True
 
     v = json.load(open(f))
-    now = utils.eastern_time_zone.localize(datetime.datetime.now())
+    now = utils.get_eastern_time_zone().localize(datetime.datetime.now())
     return (now - iso8601.parse_date(v["date"])) < datetime.timedelta(days=3)
@@ -1,5 +1,6 @@
 import re
 import io
+import os
 import csv
 import datetime
 import time
@@ -10,7 +11,7 @@ from congress.tasks.vote_info import output_vote
 
 # load some hard-coded codes
 special_vote_options = { }
-for rec in csv.reader(open("tasks/voteview_codedoptions.csv")):
+for rec in csv.reader(open(os.path.join(os.path.dirname(__file__), "voteview_codedoptions.csv"))):
     if rec[0] == "vote date": continue # header
     special_vote_options[rec[1]] = (rec[2], dict((int(r.split(':', 1)[0]), r.split(':', 1)[1]) for r in rec[3].split(';')))
 
@@ -30,7 +31,7 @@ def run(options):
     else:
         votes = get_votes("h", congress, options, session_dates) + get_votes("s", congress, options, session_dates)
 
-    utils.process_set(votes, put_vote, options)
+    utils.process_set(utils.filter_shard(votes, options), put_vote, options)
 
 
 def vote_list_source_urls_for(congress, chamber, options):
@@ -356,14 +357,14 @@ def parse_vote_list_file(vote_list_file):
         if icpsr_id == 14240: icpsr_id = 94240 # per our id
 
         try:
-            bioguide_id = utils.get_person_id("icpsr" if vote_info["state_name"] != "USA" else "icpsr_prez", icpsr_id, "bioguide")
-        except KeyError as e:
+            bioguide_id = utils.translate_legislator_id("icpsr" if vote_info["state_name"] != "USA" else "icpsr_prez", icpsr_id, "bioguide")
+        except utils.UnmatchedIdentifer as e:
             # skip some guys named Poe (99999) and Chambers (10509) that don't seem to have existed and didn't cast actual votes,
             # and Jack Swigert (15067) who died before being sworn in.
             # and presidents may not have bioguide IDs
             if icpsr_id not in (99999, 10509, 15067) and vote_info["state_name"] != "USA":
                 logging.error("Problem with member %s ([%d] %s) of %s %s: %s" % (vote_info["member_name"], vote_info["icpsr_party"], vote_info["party"],
-                                                                             vote_info["state_name"], vote_info["district"], e.message))
+                                                                             vote_info["state_name"], vote_info["district"], e))
                 #logging.error(vote_info)
             bioguide_id = None
         else:
@@ -658,7 +659,8 @@ def get_votes(chamber, congress, options, session_dates):
 
 
 def put_vote(vote, options):
-    output_vote(vote, options, id_type="bioguide")
+    if not output_vote(vote, options, id_type="bioguide"):
+        return {"ok": True, "saved": False, "unchanged": True, "reason": "unchanged"}
     return {"ok": True, "saved": True}
 
 
@@ -0,0 +1,24 @@
+import unittest
+
+from benchmarks.cases import BENCHMARKS
+from congress.tasks import utils
+
+# Keep the benchmarks from rotting: every one must still set up and run.
+
+
+class Benchmarks(unittest.TestCase):
+
+    def setUp(self):
+        self.legislators = (utils.legislator_files, utils.has_congress_legislators_repo)
+
+    def tearDown(self):
+        utils.legislator_files, utils.has_congress_legislators_repo = self.legislators
+        utils.lookup_legislator_cache = []
+        utils._translate_legislator_id_cache = None
+
+    def test_benchmarks_run(self):
+        for name, setup in BENCHMARKS:
+            with self.subTest(name):
+                run, items = setup()
+                run()
+                self.assertGreater(items, 0)
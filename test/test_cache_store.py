@@ -0,0 +1,66 @@
+import os
+import tempfile
+import unittest
+
+from congress.tasks import utils, cache_store
+
+
+class CacheStore(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, "store.sqlite")
+        self.store = utils.get_cache_store({"cache_store": self.path})
+        self.cache_dir = utils.cache_dir
+
+    def tearDown(self):
+        utils.cache_dir = self.cache_dir
+        del utils._cache_stores[self.path]
+        self.dir.cleanup()
+
+    def test_put_get(self):
+        self.assertIsNone(self.store.get("117/votes/2021/h1/h1.xml"))
+        self.store.put("117/votes/2021/h1/h1.xml", b"<vote/>" * 100, '"v1"', None)
+        self.store.put(os.path.join("117", "votes", "2021", "h2", "h2.xml"), b"<vote/>" * 100)
+        self.assertEqual(self.store.get("117/votes/2021/h1/h1.xml"), b"<vote/>" * 100)
+        self.assertEqual(self.store.get_validators("117/votes/2021/h1/h1.xml"), {"etag": '"v1"', "last_modified": None})
+
+        # The same content is stored once, compressed.
+        db = self.store.connect()
+        self.assertEqual(db.execute("SELECT COUNT(*) FROM blobs").fetchone()[0], 1)
+        self.assertLess(len(db.execute("SELECT data FROM blobs").fetchone()[0]), 700)
+
+        self.store.put("117/votes/2021/h1/h1.xml", b"<vote>changed</vote>")
+        self.store.put("117/votes/2021/h2/h2.xml", b"<vote>changed</vote>")
+        self.assertEqual(self.store.delete_unreferenced(), 1)
+
+    def test_download_from_store(self):
+        self.store.put("pages/house.html", b"fish &amp; chips")
+        options = {"cache_store": self.path}
+        self.assertEqual(utils.download("http://example.com/", "pages/house.html", options), "fish & chips")
+        self.assertEqual(utils.download("http://example.com/", "pages/house.html", dict(options, binary=True)), b"fish &amp; chips")
+        self.assertTrue(utils.download("http://example.com/", "pages/house.html", dict(options, binary=True, needs_content=False)))
+
+    def test_migrate(self):
+        root = os.path.join(self.dir.name, "cache")
+        utils.cache_dir = lambda: root
+        files = {
+            "117/votes/2021/pages/house.html": b"index",
+            "117/votes/2021/h1/h1.xml": b"<vote/>",
+            "117/votes/2021/h1/h1.xml-http.json": b'{"etag": "\\"v1\\"", "last_modified": null}',
+            "govinfo/sitemap/BILLSTATUS-bulkdata/sitemap-lastmod.yaml": b"lastmod: x",
+            "govinfo/sitemap/BILLSTATUS-bulkdata/sitemap-lastmod-shard1of2.yaml": b"lastmod: x",
+            "journals/votes.fetch_vote.txt": b"h1-117.2021",
+            "circuit-breakers.json": b"{}",
+            "zip-index.txt": b"",
+        }
+        for fn, data in files.items():
+            utils.write(data, os.path.join(root, fn))
+
+        cache_store.run({"cache_store": self.path, "delete": True})
+        self.assertEqual(self.store.get("117/votes/2021/pages/house.html"), b"index")
+        self.assertEqual(self.store.get_validators("117/votes/2021/h1/h1.xml")["etag"], '"v1"')
+        self.assertFalse(os.path.exists(os.path.join(root, "117")))
+        self.assertTrue(os.path.exists(os.path.join(root, "govinfo/sitemap/BILLSTATUS-bulkdata/sitemap-lastmod.yaml")))
+        for fn in ("govinfo/sitemap/BILLSTATUS-bulkdata/sitemap-lastmod-shard1of2.yaml", "journals/votes.fetch_vote.txt", "circuit-breakers.json", "zip-index.txt"):
+            self.assertTrue(os.path.exists(os.path.join(root, fn)))
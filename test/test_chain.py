@@ -0,0 +1,73 @@
+import os
+import tempfile
+import unittest
+
+import bills
+from congress import run as usc_run
+
+# usc-run govinfo+bills
+
+
+class Chain(unittest.TestCase):
+
+    def test_handoff(self):
+        import test_chain
+        usc_run.TASKS["test_chain"] = "test_chain"
+        try:
+            self.assertEqual(usc_run.split_task_names("test_chain+test_chain"), ["test_chain", "test_chain"])
+            self.assertEqual(usc_run.run_tasks(["test_chain", "test_chain", "test_chain"], {"x": 1}), 3)
+            self.assertEqual(test_chain.seen, [None, 1, 2])
+        finally:
+            del usc_run.TASKS["test_chain"]
+        with self.assertRaises(ValueError):
+            usc_run.split_task_names("govinfo+nope")
+
+    def test_bills_in_paths(self):
+        paths = [
+            "data/116/bills/hr/hr10/fdsys_billstatus.xml",
+            "data/115/bills/s/s2/fdsys_billstatus.xml",
+            "data/116/bills/hr/hr9/fdsys_billstatus.xml",
+            "data/govinfo/PLAW/116/PLAW-116publ1.xml",
+        ]
+        self.assertEqual(list(bills.get_bills_in_paths(paths, {})), ["s2-115", "hr9-116", "hr10-116"])
+        self.assertEqual(list(bills.get_bills_in_paths(paths, {"congress": "115"})), ["s2-115"])
+
+    def test_pending_bills(self):
+        data_dir, cache_dir = bills.utils.data_dir, bills.utils.cache_dir
+        with tempfile.TemporaryDirectory() as dir:
+            bills.utils.data_dir = lambda: os.path.join(dir, "data")
+            bills.utils.cache_dir = lambda: os.path.join(dir, "cache")
+            try:
+                for bill_id, processed in (("hr1-118", "1"), ("hr2-118", "2")):
+                    path = os.path.dirname(bills._path_to_billstatus_file(bill_id))
+                    os.makedirs(path)
+                    for fn, content in (("fdsys_billstatus.xml", "<billStatus/>"), ("fdsys_billstatus-lastmod.txt", "2"), ("data-fromfdsys-lastmod.txt", processed)):
+                        with open(os.path.join(path, fn), "w") as f:
+                            f.write(content)
+                self.assertTrue(bills.bill_is_stale("hr1-118"))
+                self.assertFalse(bills.bill_is_stale("hr2-118"))
+                self.assertFalse(bills.bill_is_stale("hr3-118"))
+
+                # An earlier run left hr1 and hr2 pending, and hr2 has
+                # been processed since.
+                bills.save_pending_bills(["hr1-118", "hr2-118"], {})
+                self.assertEqual(bills.add_pending_bills(["hr3-118"], {}), ["hr1-118", "hr3-118"])
+                self.assertEqual(bills.load_pending_bills({}), ["hr1-118", "hr3-118"])
+
+                # Other congresses stay pending.
+                self.assertEqual(bills.add_pending_bills(["hr4-117"], {"congress": "117"}), ["hr4-117"])
+                self.assertEqual(bills.load_pending_bills({}), ["hr4-117", "hr1-118"])
+
+                # Each shard has its own list.
+                self.assertEqual(bills.add_pending_bills([], {"shard": "1/2"}), [])
+                self.assertEqual(bills.load_pending_bills({}), ["hr4-117", "hr1-118"])
+            finally:
+                bills.utils.data_dir, bills.utils.cache_dir = data_dir, cache_dir
+
+
+seen = []
+
+
+def run(options):
+    seen.append(options.get("handoff"))
+    return len(seen)
@@ -0,0 +1,95 @@
+import os
+import tempfile
+import threading
+import unittest
+
+import utils
+import daemon
+from congress import run as usc_run
+
+# The daemon runs this module as a task.
+
+runs = []
+release = threading.Event()
+
+
+def run(options):
+    runs.append(options)
+    if options.get("wait"):
+        release.wait(5)
+
+
+class Daemon(unittest.TestCase):
+
+    def setUp(self):
+        usc_run.TASKS["test_daemon_task"] = "test_daemon"
+        del runs[:]
+        release.clear()
+
+    def tearDown(self):
+        del usc_run.TASKS["test_daemon_task"]
+        release.set()
+
+    def write_schedule(self, text):
+        fd, path = tempfile.mkstemp(suffix=".yml")
+        with os.fdopen(fd, "w") as f:
+            f.write(text)
+        return path
+
+    def test_schedule(self):
+        schedule = self.write_schedule(
+            "daemon:\n"
+            "  - task: test_daemon_task\n"
+            "    every: 5\n"
+            "    options: --fast --congress=115\n"
+            "  - task: test_daemon_task\n"
+            "    options: --log=info\n")
+        jobs = daemon.load_schedule({"schedule": schedule})
+        self.assertEqual([job.every for job in jobs], [300, 3600])
+        self.assertEqual(jobs[0].options, {"fast": True, "congress": "115"})
+
+        # Both entries are for the same task, so they run one after the other.
+        daemon.run({"schedule": schedule, "once": True})
+        self.assertEqual(len(runs), 2)
+
+    def test_unknown_task(self):
+        schedule = self.write_schedule("daemon:\n  - task: nope\n")
+        with self.assertRaises(ValueError):
+            daemon.load_schedule({"schedule": schedule})
+
+    def test_no_overlap(self):
+        job = daemon.Job("test_daemon_task", 60, {"wait": True})
+        lock = threading.Lock()
+        self.assertTrue(daemon.start_job(job, [lock], usc_run))
+        first = job.thread
+        self.assertFalse(daemon.start_job(job, [lock], usc_run))
+        self.assertIs(job.thread, first)
+        release.set()
+        first.join()
+        self.assertEqual(len(runs), 1)
+        self.assertFalse(lock.locked())
+
+
+class LegislatorCaches(unittest.TestCase):
+
+    def setUp(self):
+        self.legislator_files = utils.legislator_files
+        fd, path = tempfile.mkstemp()
+        os.close(fd)
+        utils.legislator_files = (path,)
+
+    def tearDown(self):
+        utils.legislator_files = self.legislator_files
+        utils.lookup_legislator_cache = []
+        utils._translate_legislator_id_cache = None
+        utils._legislator_caches_mtime = None
+
+    def test_reload_when_changed(self):
+        utils.lookup_legislator_cache = {115: []}
+        utils._legislator_caches_mtime = utils.legislator_files_mtime()
+        self.assertFalse(utils.reload_legislator_caches_if_changed())
+        self.assertEqual(utils.lookup_legislator_cache, {115: []})
+
+        os.utime(utils.legislator_files[0], (0, 0))
+        self.assertTrue(utils.reload_legislator_caches_if_changed())
+        self.assertEqual(utils.lookup_legislator_cache, [])
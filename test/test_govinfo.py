@@ -0,0 +1,65 @@
+import os
+import tempfile
+import time
+import unittest
+import zipfile
+
+from congress.tasks import govinfo, utils
+
+# Extracting files from GovInfo package ZIP files
+
+MODS = b"""<?xml version="1.0" encoding="UTF-8"?>
+<mods xmlns="http://www.loc.gov/mods/v3">
+  <location><url displayLabel="HTML rendition">https://www.govinfo.gov/content/pkg/BILLS-118hr1ih/html/BILLS-118hr1ih.htm</url></location>
+  <originInfo><dateIssued>2023-01-09</dateIssued></originInfo>
+</mods>"""
+
+
+class ExtractPackageFiles(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.data_dir = utils.data_dir
+        utils.data_dir = lambda: os.path.join(self.dir.name, "data")
+        self.package_file = os.path.join(self.dir.name, "data", "118", "bills", "hr", "hr1", "text-versions", "ih", "package.zip")
+        os.makedirs(os.path.dirname(self.package_file))
+        with zipfile.ZipFile(self.package_file, "w") as z:
+            z.writestr("BILLS-118hr1ih/mods.xml", MODS)
+            z.writestr("BILLS-118hr1ih/html/BILLS-118hr1ih.htm", "<html><body><pre>An Act</pre></body></html>")
+
+    def tearDown(self):
+        utils.data_dir = self.data_dir
+        self.dir.cleanup()
+
+    def test_write_behind(self):
+        # The extracted files are used before the write-behind threads
+        # have written them.
+        _write = utils._write
+
+        def slow_write(*args):
+            time.sleep(0.05)
+            return _write(*args)
+        utils._write = slow_write
+        utils.start_write_behind({"write_behind": "1"})
+        try:
+            lastmod_cache = {"package": "2023-01-10"}
+            files = govinfo.extract_package_files("BILLS", "118hr1ih", self.package_file, lastmod_cache, {"extract": "mods,text,pdf"})
+            utils.flush_writes()
+        finally:
+            utils.stop_write_behind()
+            utils._write = _write
+
+        text_dir = os.path.dirname(self.package_file)
+        self.assertEqual(sorted(os.path.relpath(fn, text_dir) for fn in files), ["document.html", "document.txt", "mods.xml"])
+        self.assertEqual(utils.read(os.path.join(text_dir, "document.txt")), "An Act")
+        self.assertIn('"issued_on": "2023-01-09"', utils.read(os.path.join(text_dir, "data.json")))
+        self.assertEqual(lastmod_cache, {"package": "2023-01-10", "mods": "2023-01-10", "text": "2023-01-10", "pdf": "2023-01-10"})
+
+    def test_failure_is_retried(self):
+        # A format whose extraction fails is extracted again next time.
+        lastmod_cache = {"package": "2023-01-10"}
+        with zipfile.ZipFile(self.package_file, "w") as z:
+            z.writestr("BILLS-118hr1ih/mods.xml", b"<not xml")
+        with self.assertRaises(Exception):
+            govinfo.extract_package_files("BILLS", "118hr1ih", self.package_file, lastmod_cache, {"extract": "mods"})
+        self.assertNotIn("mods", lastmod_cache)
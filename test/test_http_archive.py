@@ -0,0 +1,121 @@
+import http.server
+import os
+import tempfile
+import threading
+import unittest
+
+import requests
+
+from congress.tasks import utils, http_archive
+
+
+class SiteHandler(http.server.BaseHTTPRequestHandler):
+    pages = {
+        "/page.html": b"fish &amp; chips",
+        "/form.html": b'<html><body><form method="POST" action="/submit"><input type="text" name="q" value="x"></form></body></html>',
+    }
+
+    def do_GET(self):
+        if self.path not in self.pages:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("ETag", '"v1"')
+        self.send_header("Content-Type", "text/html")
+        self.end_headers()
+        self.wfile.write(self.pages[self.path])
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain")
+        self.end_headers()
+        self.wfile.write(b"posted " + body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(handler):
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, "http://127.0.0.1:%d" % server.server_port
+
+
+class HTTPArchive(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.options = {"requests_per_minute": 0}
+
+        # Record the site, then take it down.
+        site, self.site = serve(SiteHandler)
+        utils.use_http_archive({"record": self.dir.name})
+        try:
+            self.fetch()
+        finally:
+            utils.use_http_archive({})
+            site.shutdown()
+            site.server_close()
+
+    def tearDown(self):
+        utils.use_http_archive({})
+        self.dir.cleanup()
+
+    def fetch(self):
+        page = utils.download(self.site + "/page.html", None, self.options)
+        posted = utils.download(self.site + "/post", None, dict(self.options, postdata={"a": "1"}))
+        br = utils.get_browser()
+        br.set_handle_robots(False)
+        br.open(self.site + "/form.html")
+        br.select_form(nr=0)
+        submitted = br.submit().read()
+        return page, posted, submitted
+
+    def test_record_write_behind(self):
+        # With --write_behind, recording a response isn't counted as a
+        # change of the item that downloaded it.
+        site, self.site = serve(SiteHandler)
+        path = os.path.join(self.dir.name, "data.txt")
+        utils.write("unchanged", path)
+
+        def fetch_item(id, options):
+            utils.download(self.site + "/page.html", None, self.options)
+            utils.write("unchanged", path)
+            return {"ok": True, "saved": True}
+        utils.use_http_archive({"record": self.dir.name})
+        utils.start_write_behind({"write_behind": "1"})
+        try:
+            self.assertEqual(utils.process_set(["page"], fetch_item, {}), {"saved": 0, "skipped": 1, "errors": 0})
+        finally:
+            utils.stop_write_behind()
+            site.shutdown()
+            site.server_close()
+
+    def test_replay(self):
+        utils.use_http_archive({"replay": self.dir.name})
+        self.assertEqual(self.fetch(), ("fish & chips", "posted a=1", b"posted q=x"))
+
+        # Revalidation and requests that weren't recorded.
+        response = utils.get_scraper().get(self.site + "/page.html", headers={"If-None-Match": '"v1"'})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(utils.download(self.site + "/other.html", None, self.options), None)
+
+    def test_replay_server(self):
+        archive = http_archive.HTTPArchive(self.dir.name, latency=0.05)
+        server, url = serve(archive.request_handler())
+        try:
+            utils.use_http_archive({"replay": url})
+            self.assertEqual(self.fetch(), ("fish & chips", "posted a=1", b"posted q=x"))
+            self.assertGreaterEqual(utils.get_scraper().get(self.site + "/page.html").elapsed.total_seconds(), 0.05)
+
+            # (Not through the scraper, which would retry.)
+            archive.error_rate = 1
+            self.assertEqual(requests.get(url + "/" + self.site + "/page.html").status_code, 503)
+        finally:
+            server.shutdown()
+            server.server_close()
+
+
+if __name__ == "__main__":
+    unittest.main()
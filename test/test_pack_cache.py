@@ -0,0 +1,89 @@
+import os
+import tempfile
+import unittest
+import zipfile
+
+from congress.tasks import utils, pack_cache
+
+
+class PackCache(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.cache_dir = utils.cache_dir
+        utils.cache_dir = lambda: self.dir.name
+        for path, content in (("93/bills/hr1.html", "first &amp; second"), ("93/votes/h1.xml", "<vote/>"), ("93/sitemap-lastmod-shard1of2.yaml", "lastmod: x"), ("118/bills/hr1.html", "current")):
+            utils.write(content, os.path.join(self.dir.name, path))
+
+    def tearDown(self):
+        for zf in utils._download_zip_files.values():
+            zf.drop()
+        utils._download_zip_files.clear()
+        utils._zip_indexes.clear()
+        utils.cache_dir = self.cache_dir
+        self.dir.cleanup()
+
+    def test_pack(self):
+        pack_cache.run({"paths": "93"})
+        self.assertEqual(os.listdir(os.path.join(self.dir.name, "93")), ["sitemap-lastmod-shard1of2.yaml"])
+        with zipfile.ZipFile(os.path.join(self.dir.name, "93.zip")) as zf:
+            self.assertEqual(sorted(zf.namelist()), ["93/bills/hr1.html", "93/votes/h1.xml"])
+        with open(os.path.join(self.dir.name, utils.ZIP_INDEX_FILE)) as f:
+            self.assertEqual(f.read(), "93.zip\n")
+
+        # Pages are read from the ZIP file, and only the ZIP files in the
+        # index are looked for.
+        self.assertEqual(utils.download("http://example.com/", "93/bills/hr1.html", {}), "first & second")
+        self.assertEqual(utils.download("http://example.com/", "118/bills/hr1.html", {}), "current")
+        self.assertEqual(utils.get_zip_index(self.dir.name), {"93.zip"})
+
+        # Files downloaded after packing are added to the ZIP file next time.
+        utils.write("new", os.path.join(self.dir.name, "93/votes/h2.xml"))
+        pack_cache.run({"paths": "93"})
+        self.assertEqual(utils.download("http://example.com/", "93/votes/h2.xml", {}), "new")
+        self.assertEqual(utils.download("http://example.com/", "93/votes/h1.xml", {}), "<vote/>")
+
+    def test_depth(self):
+        pack_cache.run({"paths": "93/bills"})
+        self.assertFalse(os.path.exists(os.path.join(self.dir.name, "93/bills")))
+        with zipfile.ZipFile(os.path.join(self.dir.name, "93/bills.zip")) as zf:
+            self.assertEqual(zf.namelist(), ["bills/hr1.html"])
+        self.assertEqual(utils.get_zip_index(self.dir.name), {"93/bills.zip"})
+        self.assertEqual(utils.download("http://example.com/", "93/bills/hr1.html", {}), "first & second")
+
+    def test_older_than(self):
+        old = os.path.getmtime(os.path.join(self.dir.name, "93/bills/hr1.html")) - 400 * 24 * 60 * 60
+        for path in ("93/bills/hr1.html", "93/votes/h1.xml"):
+            os.utime(os.path.join(self.dir.name, path), (old, old))
+        self.assertEqual(list(pack_cache.cold_subtrees(self.dir.name, 1, old + 1)), ["93"])
+        self.assertEqual(list(pack_cache.cold_subtrees(self.dir.name, 2, old + 1)), ["93/bills", "93/votes"])
+
+        pack_cache.run({"older_than": "365", "keep": True})
+        self.assertTrue(os.path.exists(os.path.join(self.dir.name, "93.zip")))
+        self.assertTrue(os.path.exists(os.path.join(self.dir.name, "93/bills/hr1.html")))
+        self.assertFalse(os.path.exists(os.path.join(self.dir.name, "118.zip")))
+
+    def test_open_zip_files_limit(self):
+        for congress in ("93", "94", "95"):
+            utils.write("x", os.path.join(self.dir.name, congress, "page.html"))
+            pack_cache.pack(self.dir.name, congress, {})
+        pack_cache.write_zip_index(self.dir.name)
+        # An archive that is dropped while a thread reads from it is closed
+        # once the thread is done with it.
+        reading = utils.open_zip_file(os.path.join(self.dir.name, "93.zip"), {})
+        for congress in ("93", "94", "95", "94"):
+            utils.download("http://example.com/", congress + "/page.html", {"open_zip_files": "2"})
+        self.assertEqual([os.path.basename(zfn) for zfn in utils._download_zip_files], ["95.zip", "94.zip"])
+        self.assertTrue(reading.dropped)
+        self.assertEqual(reading.zipfile.read("93/page.html"), b"x")
+        utils.release_zip_file(reading)
+        self.assertIsNone(reading.zipfile.fp)
+
+        # The ones that aren't in use are closed right away.
+        kept = list(utils._download_zip_files.values())
+        utils.download("http://example.com/", "93/page.html", {"open_zip_files": "1"})
+        self.assertEqual([zf.zipfile.fp is None for zf in kept], [True, True])
+
+
+if __name__ == "__main__":
+    unittest.main()
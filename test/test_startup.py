@@ -0,0 +1,30 @@
+import os
+import subprocess
+import sys
+import unittest
+
+# usc-run is run often from cron, so starting it (e.g. with --list-tasks)
+# must not import the heavy dependencies of the tasks or of utils. (The
+# startup benchmark in benchmarks/cases.py times it.)
+
+HEAVY_MODULES = ("lxml", "scrapelib", "requests", "pytz", "yaml", "smtplib", "xmltodict", "mechanize")
+
+
+class Startup(unittest.TestCase):
+
+    def python(self, code):
+        env = dict(os.environ)
+        env["PYTHONPATH"] = os.pathsep.join([os.getcwd()] + [p for p in env.get("PYTHONPATH", "").split(os.pathsep) if p])
+        return subprocess.check_output([sys.executable, "-c", code], env=env, universal_newlines=True)
+
+    def test_no_heavy_imports(self):
+        loaded = self.python(
+            "import sys\n"
+            "sys.argv = ['usc-run', '--list-tasks']\n"
+            "import congress.run\n"
+            "from congress.tasks import utils\n"
+            "congress.run.main()\n"
+            "print('loaded:' + ' '.join(m for m in %r if m in sys.modules))\n" % (HEAVY_MODULES,))
+        lines = loaded.strip().split("\n")
+        self.assertIn("bills", lines)
+        self.assertEqual(lines[-1], "loaded:")
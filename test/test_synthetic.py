@@ -0,0 +1,65 @@
+import glob
+import os
+import shutil
+import tempfile
+import unittest
+
+from benchmarks import synthetic
+from congress.tasks import bills, amendment_info, govinfo
+
+# The synthetic corpus is only useful if the tasks can process all of it.
+
+
+class Synthetic(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def generate(self, **options):
+        options = dict({"bills": "60", "seed": "1"}, **options)
+        return synthetic.generate_bills(options, self.root, [117, 118], synthetic.bill_counts(int(options["bills"]), [117, 118]))
+
+    def test_bills_parse(self):
+        stats = self.generate()
+        files = glob.glob(os.path.join(self.root, "data", "*", "bills", "*", "*", "fdsys_billstatus.xml"))
+        self.assertEqual(len(files), stats["bills"])
+
+        amendments = 0
+        for fn in files:
+            xml_as_dict = bills.read_fdsys_bulk_bill_status_file(fn, None)
+            bill = bills.form_bill_json_dict(xml_as_dict)
+            self.assertEqual(os.path.basename(os.path.dirname(fn)), bill["bill_type"] + bill["number"])
+            self.assertTrue(bill["sponsor"]["name"])
+            for amdt in (xml_as_dict['billStatus']['bill'].get('amendments') or {}).get('amendment', []):
+                amendment_info.build_amendment_json_dict(amdt, {})
+                amendments += 1
+        self.assertEqual(amendments, stats["amendments"])
+
+    def test_deterministic(self):
+        self.generate(schema="3.0.0")
+        fn = os.path.join(self.root, "data", "117", "bills", "hr", "hr1", "fdsys_billstatus.xml")
+        with open(fn) as f:
+            first = f.read()
+        self.assertIn("<version>3.0.0</version>", first)
+        self.generate(schema="3.0.0")
+        with open(fn) as f:
+            self.assertEqual(f.read(), first)
+
+    def test_sitemaps(self):
+        stats = self.generate()
+        sitemap_dir = os.path.join(self.root, "cache", "govinfo", "sitemap", "BILLSTATUS-bulkdata")
+        with open(os.path.join(sitemap_dir, "sitemap.xml"), "rb") as f:
+            is_index, sitemaps = govinfo.parse_sitemap(f.read(), "index")
+        self.assertTrue(is_index)
+
+        urls = 0
+        for url, lastmod in sitemaps:
+            self.assertFalse(govinfo.should_skip_sitemap(url, {}))
+            with open(os.path.join(self.root, "cache", "govinfo", "sitemap", govinfo.get_sitemap_cache_file(url), "sitemap.xml"), "rb") as f:
+                is_index, entries = govinfo.parse_sitemap(f.read(), url)
+            self.assertFalse(is_index)
+            urls += len(entries)
+        self.assertEqual(urls, stats["bills"])
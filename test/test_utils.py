@@ -0,0 +1,769 @@
+import datetime
+import http.server
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+import utils
+
+# process_set bookkeeping, serially and on worker pools
+
+
+def fetch_traced(id, options):
+    with utils.trace_stage("parse"):
+        utils.trace_bytes(bytes_in=10)
+    utils.write("x" * id, os.path.join(options["dir"], str(id)))
+    return {"ok": True, "saved": True}
+
+
+def fetch_even(id, options):
+    if id == "boom":
+        raise ValueError(id)
+    if id % 2 == 0:
+        return {"ok": True, "saved": True}
+    return {"ok": True, "saved": False, "reason": "odd"}
+
+
+def fetch_written(id, options):
+    path = os.path.join(options["dir"], "blocker" if id == "bad" else "", "%s.txt" % id)
+    utils.write(str(id), path)
+    utils.write("lastmod", os.path.join(options["dir"], "%s-lastmod.txt" % id), {"marker": True})
+    return {"ok": True, "saved": True}
+
+
+class ProcessSet(unittest.TestCase):
+
+    def setUp(self):
+        self.admin = utils.admin
+        self.admin_messages = []
+        utils.admin = self.admin_messages.append
+
+    def tearDown(self):
+        utils.admin = self.admin
+
+    def test_serial(self):
+        counts = utils.process_set(range(10), fetch_even, {})
+        self.assertEqual(counts, {"saved": 5, "skipped": 5, "errors": 0})
+        self.assertEqual(self.admin_messages, [])
+
+    def test_unchanged(self):
+        counts = utils.process_set(range(4), lambda id, options: {"ok": True, "saved": False, "unchanged": True, "reason": "unchanged"} if id else fetch_even(id, options), {})
+        self.assertEqual(counts, {"saved": 1, "skipped": 3, "errors": 0})
+
+    def test_thread_pool(self):
+        counts = utils.process_set(list(range(100)) + ["boom"], fetch_even, {"workers": "4"})
+        self.assertEqual(counts, {"saved": 50, "skipped": 50, "errors": 1})
+        self.assertEqual(len(self.admin_messages), 1)
+        self.assertIn("Errors for 1 items", self.admin_messages[0])
+        self.assertIn("ValueError: boom", self.admin_messages[0])
+
+    def test_process_pool(self):
+        counts = utils.process_set(iter(range(20)), fetch_even, {"workers": "2", "pool": "process"})
+        self.assertEqual(counts, {"saved": 10, "skipped": 10, "errors": 0})
+
+    def test_raise(self):
+        with self.assertRaises(ValueError):
+            utils.process_set([1, "boom", 2], fetch_even, {"workers": "2", "raise": True})
+
+    def test_write_behind(self):
+        with tempfile.TemporaryDirectory() as dir:
+            utils.write("1", os.path.join(dir, "1.txt"))
+            utils.write("not a directory", os.path.join(dir, "blocker"))
+            utils.start_write_behind({"write_behind": "2", "write_queue": "1"})
+            try:
+                counts = utils.process_set([1, 2, "bad", 3], fetch_written, {"dir": dir, "workers": "2"})
+                self.assertEqual(counts, {"saved": 2, "skipped": 1, "errors": 1})
+                self.assertIn("[bad] Exception", self.admin_messages[0])
+                self.assertEqual(sorted(os.listdir(dir)), ["1-lastmod.txt", "1.txt", "2-lastmod.txt", "2.txt", "3-lastmod.txt", "3.txt", "blocker"])
+
+                # Outside of process_set, a marker waits for the files
+                # before it, and isn't written if one of them failed.
+                utils.write("queued", os.path.join(dir, "4.txt"))
+                self.assertEqual(utils.read(os.path.join(dir, "4.txt")), "queued")
+                utils.write("x", os.path.join(dir, "blocker", "4.txt"))
+                with self.assertRaises(NotADirectoryError):
+                    utils.write("lastmod", os.path.join(dir, "4-lastmod.txt"), {"marker": True})
+                self.assertTrue(os.path.exists(os.path.join(dir, "4.txt")))
+                self.assertFalse(os.path.exists(os.path.join(dir, "4-lastmod.txt")))
+                utils.flush_writes()
+            finally:
+                utils.stop_write_behind()
+
+    def test_write_behind_per_run(self):
+        # Runs on different threads (like the daemon's) each have their own.
+        with tempfile.TemporaryDirectory() as dir:
+            started, stopped = threading.Event(), threading.Event()
+            results = []
+
+            def other_run():
+                utils.start_write_behind({"write_behind": "1"})
+                try:
+                    started.set()
+                    stopped.wait()
+                    results.append(utils.get_write_behind() is not None)
+                    results.append(utils.process_set([1, 2], fetch_written, {"dir": dir, "workers": "2"}))
+                finally:
+                    utils.stop_write_behind()
+                results.append(sorted(os.listdir(dir)))
+            thread = threading.Thread(target=other_run)
+            thread.start()
+            started.wait()
+            utils.start_write_behind({"write_behind": "1"})
+            utils.stop_write_behind()
+            stopped.set()
+            thread.join()
+            self.assertEqual(results, [True, {"saved": 2, "skipped": 0, "errors": 0}, ["1-lastmod.txt", "1.txt", "2-lastmod.txt", "2.txt"]])
+            self.assertIsNone(utils.get_write_behind())
+
+    def test_peek(self):
+        self.assertIsNone(utils.peek(iter([])))
+        self.assertEqual(list(utils.peek(x for x in range(3))), [0, 1, 2])
+
+    def test_resume(self):
+        journal = os.path.join(tempfile.mkdtemp(), "journal.txt")
+        seen = []
+
+        def fetch(id, options):
+            seen.append(id)
+            return fetch_even(id, options)
+
+        # The first run fails on one item, so the journal is kept.
+        utils.process_set(["1", "2", "boom", "3"], lambda id, options: fetch(int(id) if id.isdigit() else id, options), {"journal": journal})
+        with open(journal) as f:
+            self.assertEqual(f.read().split(), ["1", "2", "3"])
+
+        # Resuming only retries what is not in the journal, and a clean
+        # run removes the journal.
+        del seen[:]
+        utils.process_set(["1", "2", "3", "4"], lambda id, options: fetch(int(id), options), {"journal": journal, "resume": True})
+        self.assertEqual(seen, [4])
+        self.assertFalse(os.path.exists(journal))
+
+        # An overlapping run of the same command keeps no journal, and
+        # leaves this one's alone.
+        def fetch_overlapping(id, options):
+            if id == 1:
+                utils.process_set([2], fetch_even, {"journal": journal})
+            return fetch_even(id, options)
+        self.assertEqual(utils.process_set([1], fetch_overlapping, {"journal": journal}), {"saved": 0, "skipped": 1, "errors": 0})
+        self.assertFalse(os.path.exists(journal))
+
+    def test_default_journal(self):
+        cache_dir = utils.cache_dir
+        with tempfile.TemporaryDirectory() as dir:
+            utils.cache_dir = lambda: dir
+            seen = []
+
+            def fetch(id, options):
+                seen.append(id)
+                return fetch_even(id, options)
+            try:
+                utils.process_set([1, 2], fetch, {})
+                self.assertEqual(os.listdir(os.path.join(dir, "journals")), [])
+
+                # The journal of an interrupted run is named after the task,
+                # the shard and the options.
+                options = {"shard": "1/1", "congress": "118"}
+                utils.process_set([1, "boom", 2], fetch, options)
+                journals = os.listdir(os.path.join(dir, "journals"))
+                self.assertEqual(journals, ["test_utils.fetch-shard1of1-%s.txt" % utils.journal_key(options)])
+
+                # Only a run of the same command resumes it.
+                del seen[:]
+                utils.process_set([1, 2], fetch, {"shard": "1/1", "congress": "117", "resume": True})
+                self.assertEqual(seen, [1, 2])
+                del seen[:]
+                utils.process_set([1, "boom", 2], fetch, dict(options, resume=True, workers="2"))
+                self.assertEqual(seen, ["boom"])
+                self.assertEqual(os.listdir(os.path.join(dir, "journals")), journals)
+            finally:
+                utils.cache_dir = cache_dir
+
+    def test_trace(self):
+        tmpdir = tempfile.mkdtemp()
+        trace = os.path.join(tmpdir, "trace.jsonl")
+        utils.process_set([1, 2, 3], fetch_traced, {"trace": trace, "dir": tmpdir, "workers": "2"})
+        with open(trace) as f:
+            records = sorted((json.loads(line) for line in f), key=lambda r: r["id"])
+        self.assertEqual([r["id"] for r in records], ["1", "2", "3"])
+        self.assertEqual(set(records[0]["stages"]), {"parse", "write"})
+        self.assertEqual(records[2]["bytes_in"], 10)
+        self.assertEqual(records[2]["bytes_out"], 3)
+
+        # Without --trace, stages are a no-op.
+        self.assertIs(utils.trace_stage("parse"), utils.trace_stage("write"))
+
+    def test_shard(self):
+        ids = ["hr%d-115" % i for i in range(200)]
+        shards = [list(utils.filter_shard(ids, {"shard": "%d/3" % i})) for i in (1, 2, 3)]
+        self.assertEqual(sorted(sum(shards, [])), sorted(ids))
+        self.assertTrue(all(shards))
+        self.assertIs(utils.filter_shard(ids, {}), ids)
+        for shard in ("0/3", "4/3", "1", "a/b"):
+            with self.assertRaises(ValueError):
+                utils.get_shard({"shard": shard})
+
+
+# download_batch, with files that are already cached so no network is needed
+
+
+class DownloadBatch(unittest.TestCase):
+
+    def test_download_batch(self):
+        with tempfile.TemporaryDirectory() as dir:
+            downloads = []
+            for i in range(20):
+                path = os.path.join(dir, "%d.txt" % i)
+                with open(path, "w") as f:
+                    f.write("file &amp; %d" % i)
+                downloads.append(("http://example.com/%d.txt" % i, path))
+            downloads.append(("http://example.com/binary.txt", downloads[0][1], {"binary": True}))
+            downloads.append(("http://example.com/directory", dir))  # fails to read
+
+            for connections in ("1", "4"):
+                results = {d[0]: body for d, body in utils.download_batch(iter(downloads), {"to_cache": False, "connections": connections})}
+                self.assertEqual(len(results), len(downloads))
+                self.assertEqual(results["http://example.com/5.txt"], "file & 5")
+                self.assertEqual(results["http://example.com/binary.txt"], b"file &amp; 0")
+                self.assertIsNone(results["http://example.com/directory"])
+
+            with self.assertRaises(IsADirectoryError):
+                list(utils.download_batch(downloads[-1:], {"to_cache": False, "raise": True}))
+
+
+# write, which replaces files atomically and leaves identical ones alone
+
+
+class Write(unittest.TestCase):
+
+    def test_write(self):
+        with tempfile.TemporaryDirectory() as dir:
+            path = os.path.join(dir, "data", "data.json")
+            self.assertTrue(utils.write("{\"a\": \"\u00e9\"}", path))
+            os.utime(path, (0, 0))
+            self.assertFalse(utils.write("{\"a\": \"\u00e9\"}".encode("utf8"), path))
+            self.assertEqual(os.path.getmtime(path), 0)
+            self.assertTrue(utils.write("{\"a\": \"e\u00e9\"}", path))
+            self.assertTrue(utils.write_json({"a": "e"}, path))
+            with open(path) as f:
+                self.assertEqual(f.read(), '{\n  "a": "e"\n}')
+            self.assertEqual(os.listdir(os.path.dirname(path)), ["data.json"])
+
+    def test_updated_at(self):
+        with tempfile.TemporaryDirectory() as dir:
+            path = os.path.join(dir, "data.xml")
+            ignore = {"ignore_updated_at": True}
+            self.assertTrue(utils.write('<roll updated="2021-01-01T10:00:00-05:00" roll="1"/>', path, ignore))
+
+            # A new update date alone isn't a change.
+            self.assertFalse(utils.write('<roll updated="2021-01-02T10:00:00-05:00" roll="1"/>', path, ignore))
+            with open(path) as f:
+                self.assertIn("2021-01-01", f.read())
+
+            # Unless it was asked for (e.g. for source files).
+            self.assertTrue(utils.write('<roll updated="2021-01-02T10:00:00-05:00" roll="1"/>', path))
+
+            # Along with another change, it is saved.
+            self.assertTrue(utils.write('<roll updated="2021-01-03T10:00:00-05:00" roll="2"/>', path, ignore))
+            with open(path) as f:
+                self.assertEqual(f.read(), '<roll updated="2021-01-03T10:00:00-05:00" roll="2"/>')
+
+            path = os.path.join(dir, "data.json")
+            self.assertTrue(utils.write_json({"updated_at": "2021-01-01", "votes": [1]}, path, ignore))
+            self.assertFalse(utils.write_json({"updated_at": "2021-01-02T10:00:00", "votes": [1]}, path, ignore))
+            self.assertTrue(utils.write_json({"updated_at": "2021-01-02T10:00:00", "votes": [1]}, path))
+
+
+# json_dumps, which must write the same bytes with or without orjson
+
+
+class JSONDumps(unittest.TestCase):
+
+    def assertSameJSON(self, data):
+        expected = json.dumps(data, sort_keys=True, indent=2, default=utils.format_datetime)
+        orjson = utils._orjson
+        try:
+            utils._orjson = False
+            self.assertEqual(utils.json_dumps(data), expected)
+            utils._orjson = None
+            self.assertEqual(utils.json_dumps(data), expected)
+        finally:
+            utils._orjson = orjson
+
+    def test_fixtures(self):
+        from lxml import etree
+        from benchmarks import cases
+        from congress.tasks import bills, vote_info
+        for d in cases.billstatus_dicts():
+            self.assertSameJSON(bills.form_bill_json_dict(d))
+        cases.use_fixture_legislators()
+        for fn, parse in (("h185-117.2021.xml", vote_info.parse_house_vote), ("s314-117.2021.xml", vote_info.parse_senate_vote)):
+            vote = {"vote_id": fn[:-4], "chamber": fn[0], "congress": 117, "session": "2021", "number": int(fn[1:4])}
+            parse(etree.fromstring(cases.fixture("votes", fn)), vote)
+            self.assertSameJSON(vote)
+
+    def test_values(self):
+        class Name(str):
+            pass
+        self.assertSameJSON({
+            "text": "caf\u00e9 \U0001f600 \u2028 \x00\x1f\x7f \"quoted\" \\ / \t\n",
+            "\u00e9": [],
+            "empty": {"list": [], "dict": {}, "string": ""},
+            "numbers": [0, -1, 2 ** 63 - 1, 2 ** 64, True, False, None],
+            "dates": [datetime.date(2021, 7, 1), datetime.datetime(2021, 7, 1, 13, 30, 15, 500)],
+            "tuple": (1, "two"),
+            "subclass": Name("x"),
+            "other": object(),
+        })
+        self.assertSameJSON({"float": 1.5, "small": 1e-7, "large": 1e16})
+        self.assertSameJSON({1: "a", 2: "b"})
+        self.assertSameJSON([])
+        self.assertSameJSON("\u00e9")
+
+
+# --manifest, the list of the files in the data directory that a run changed
+
+
+class Manifest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.data_dir = utils.data_dir
+        utils.data_dir = lambda: os.path.join(self.dir.name, "data")
+        self.path = os.path.join(self.dir.name, "manifests", "changes.jsonl")
+
+    def tearDown(self):
+        utils.finish_manifest()
+        utils.data_dir = self.data_dir
+        self.dir.cleanup()
+
+    def run_with_manifest(self, func):
+        utils.start_manifest({"manifest": self.path, "manifest_keep": "1"})
+        try:
+            func(os.path.join(self.dir.name, "data"))
+        finally:
+            utils.finish_manifest()
+        with open(self.path) as f:
+            return [json.loads(line) for line in f]
+
+    def test_manifest(self):
+        data = os.path.join(self.dir.name, "data")
+        utils.write("old", os.path.join(data, "a.txt"))
+
+        def first_run(data):
+            with utils.trace_item("hr1-117", {}):
+                utils.write("new", os.path.join(data, "a.txt"))
+                utils.write("new", os.path.join(data, "a.txt"))
+                utils.write_stream([b"b"], os.path.join(data, "b", "b.xml"))
+            utils.write("not data", os.path.join(self.dir.name, "cache", "c.txt"))
+        self.assertEqual(self.run_with_manifest(first_run), [
+            {"path": "a.txt", "sha256": "11507a0e2f5e69d5dfa40a62a1bd7b6ee57e6bcd85c67c9b8431b36fff21c437", "size": 3, "change": "modified", "id": "hr1-117"},
+            {"path": "b/b.xml", "sha256": "3e23e8160039594a33894f6564e1b1348bbd7a0088d42c4acb73eeaed59c009d", "size": 1, "change": "added", "id": "hr1-117"},
+        ])
+
+        # Files written behind and deleted files.
+        def second_run(data):
+            utils.start_write_behind({"write_behind": "1"})
+            try:
+                with utils.trace_item("h1-2021", {}):
+                    utils.write("c", os.path.join(data, "c.txt"))
+                self.assertTrue(utils.delete(os.path.join(data, "a.txt")))
+                self.assertFalse(utils.delete(os.path.join(data, "a.txt")))
+            finally:
+                utils.stop_write_behind()
+        self.assertEqual(sorted(self.run_with_manifest(second_run), key=lambda change: change["path"]), [
+            {"path": "a.txt", "sha256": None, "size": None, "change": "deleted", "id": None},
+            {"path": "c.txt", "sha256": "2e7d2c03a9507ae265ecf5b5356885a53393a2029d241394997265a1a25aefc6", "size": 1, "change": "added", "id": "h1-2021"},
+        ])
+
+        # The manifest of the previous run is kept.
+        self.assertEqual(self.run_with_manifest(lambda data: None), [])
+        with open(self.path + ".1") as f:
+            self.assertEqual(len(f.readlines()), 2)
+        self.assertFalse(os.path.exists(self.path + ".2"))
+        self.assertEqual(sorted(os.listdir(os.path.dirname(self.path))), ["changes.jsonl", "changes.jsonl.1"])
+
+    def test_process_pool(self):
+        changes = self.run_with_manifest(lambda data: utils.process_set([1, 2], fetch_written, {"dir": data, "workers": "2", "pool": "process"}))
+        self.assertEqual(sorted((change["path"], change["id"]) for change in changes), [
+            ("1-lastmod.txt", "1"), ("1.txt", "1"), ("2-lastmod.txt", "2"), ("2.txt", "2")])
+
+    def test_overlapping_runs(self):
+        # Runs on different threads (like the daemon's) each list their own
+        # files, whichever finishes first.
+        data = os.path.join(self.dir.name, "data")
+        started = threading.Barrier(2)
+        first_finished = threading.Event()
+
+        def run(name, finish_first):
+            utils.start_manifest({"manifest": self.path})
+            started.wait()
+            if not finish_first:
+                first_finished.wait()
+            for i in range(5):
+                utils.write(name, os.path.join(data, "%s%d.txt" % (name, i)))
+            utils.finish_manifest()
+            if finish_first:
+                first_finished.set()
+        threads = [threading.Thread(target=run, args=args) for args in (("a", True), ("b", False))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        for path, name in ((self.path, "b"), (self.path + ".1", "a")):
+            with open(path) as f:
+                self.assertEqual(sorted(json.loads(line)["path"] for line in f), ["%s%d.txt" % (name, i) for i in range(5)])
+        self.assertEqual(sorted(os.listdir(os.path.dirname(self.path))), ["changes.jsonl", "changes.jsonl.1"])
+
+
+# unescape, which download() applies to every text page
+
+
+class Unescape(unittest.TestCase):
+
+    def test_unescape(self):
+        self.assertEqual(utils.unescape("fish &amp; chips &#233;&#x41; &bogus;\x07"), "fish & chips \u00e9A &bogus;")
+        self.assertEqual(utils.unescape("no entities\x1f"), "no entities")
+
+
+# Per-host rate limits and adaptive concurrency
+
+
+class HostLimiter(unittest.TestCase):
+
+    def test_token_bucket(self):
+        limiter = utils.HostLimiter("example.com", 6000, 3, None, False)
+        start = time.monotonic()
+        for i in range(5):
+            with limiter:
+                pass
+        # The first three go at once, then one every 10 ms.
+        self.assertGreaterEqual(time.monotonic() - start, 0.015)
+        self.assertEqual(limiter.stats["requests"], 5)
+
+    def test_aimd(self):
+        limiter = utils.HostLimiter("example.com", 0, 1, 4, True)
+        self.assertEqual(limiter.connections, 1)
+        for i in range(20):
+            limiter.record_response(200, 0.1)
+        self.assertEqual(limiter.connections, 4)
+
+        limiter.record_response(429, 0.1)
+        self.assertEqual(limiter.connections, 2)
+        self.assertEqual(limiter.stats["throttled"], 1)
+        self.assertEqual(limiter.stats["backoffs"], 1)
+
+        # Responses that arrive within a round trip don't back off again.
+        limiter.record_response(503, 0.1)
+        self.assertEqual(limiter.connections, 2)
+
+        # Nor do slow responses, until they move the average.
+        limiter.decreased_at = 0
+        limiter.record_response(200, 0.25)
+        self.assertGreater(limiter.connections, 2)
+        for i in range(5):
+            limiter.record_response(200, 1)
+        self.assertLess(limiter.connections, 2)
+
+    def test_latency_outliers(self):
+        limiter = utils.HostLimiter("example.com", 0, 1, 4, True)
+
+        # Quick 304s and 404s aren't compared with the 200s.
+        limiter.record_response(304, 0.001)
+        limiter.record_response(404, 0.001)
+        for i in range(20):
+            limiter.record_response(200, 0.1)
+        self.assertEqual(limiter.connections, 4)
+        self.assertEqual(limiter.stats["backoffs"], 0)
+
+        # One very quick 200 is forgotten after a while.
+        limiter.record_response(200, 0.001)
+        self.assertEqual(limiter.connections, 2)
+        for i in range(120):
+            limiter.record_response(200, 0.1)
+        self.assertEqual(limiter.connections, 4)
+        self.assertEqual(limiter.stats["backoffs"], 1)
+
+    def test_stats_per_run(self):
+        # Runs on different threads (like the daemon's) each log their own
+        # requests, though they share the limiter.
+        limiter = utils.HostLimiter("stats.example.com", 0, 1, None, False)
+        utils._host_limiters["stats.example.com"] = limiter
+        started, stopped = threading.Event(), threading.Event()
+        logs = []
+
+        def other_run():
+            utils.start_http_stats()
+            with limiter:
+                pass
+            started.set()
+            stopped.wait()
+            with self.assertLogs(level="WARNING") as log:
+                utils.log_http_stats()
+            logs.extend(log.output)
+        try:
+            thread = threading.Thread(target=other_run)
+            thread.start()
+            started.wait()
+            utils.start_http_stats()
+            for i in range(2):
+                with limiter:
+                    pass
+            with self.assertLogs(level="WARNING") as log:
+                utils.log_http_stats()
+            stopped.set()
+            thread.join()
+        finally:
+            utils._host_limiters.pop("stats.example.com", None)
+        self.assertIn("stats.example.com: 2 requests", log.output[0])
+        self.assertEqual(len(logs), 1)
+        self.assertIn("stats.example.com: 1 requests", logs[0])
+        self.assertEqual(limiter.stats["requests"], 3)
+
+    def test_not_adaptive(self):
+        limiter = utils.HostLimiter("example.com", 0, 1, None, False)
+        limiter.record_response(429, 0.1)
+        self.assertIsNone(limiter.connections)
+        self.assertEqual(limiter.stats["throttled"], 1)
+
+    def test_pool_process(self):
+        # Each process of a pool of 4 gets a quarter of a host's limits.
+        utils._start_pool_process(None, 4)
+        try:
+            limiter = utils.get_host_limiter("http://pool.example.com/", {"requests_per_minute": 120, "adaptive": True, "connections": 8})
+            self.assertEqual(limiter.interval, 2.0)
+            self.assertEqual(limiter.max_connections, 2)
+        finally:
+            utils._pool_processes = 1
+            utils._host_limiters.pop("pool.example.com", None)
+
+    def test_circuit_breaker(self):
+        cache_dir = utils.cache_dir
+        with tempfile.TemporaryDirectory() as dir:
+            utils.cache_dir = lambda: dir
+            try:
+                limiter = utils.HostLimiter("down.example.com", 0, 1, None, False, 2, 0.1, persist=True)
+                limiter.record_failure()
+                limiter.record_success()
+                limiter.record_failure()
+                self.assertTrue(limiter.allow_request())
+                limiter.record_failure()
+                self.assertFalse(limiter.allow_request())
+
+                # Downloads fail fast while the circuit is open.
+                utils._host_limiters["down.example.com"] = limiter
+                self.assertIsNone(utils.download("http://down.example.com/", None, {}))
+                self.assertEqual(limiter.stats["skipped"], 2)
+
+                # The next run starts where this one left off.
+                again = utils.HostLimiter("down.example.com", 0, 1, None, False, 2, 0.1, persist=True)
+                self.assertFalse(again.allow_request())
+
+                # After the cool-down, one probe is let through.
+                time.sleep(0.1)
+                self.assertTrue(limiter.allow_request())
+                self.assertFalse(limiter.allow_request())
+                limiter.record_failure()
+                self.assertFalse(limiter.allow_request())
+                time.sleep(0.1)
+                self.assertTrue(limiter.allow_request())
+                limiter.record_response(200, 0.1)
+                self.assertTrue(limiter.allow_request())
+
+                # A probe that ends without a result doesn't keep the
+                # circuit open for good.
+                limiter.record_failure()
+                limiter.record_failure()
+                time.sleep(0.1)
+                self.assertTrue(limiter.allow_request())
+                self.assertFalse(limiter.allow_request())
+                limiter.end_request()
+                self.assertTrue(limiter.allow_request())
+                limiter.record_success()
+                with open(os.path.join(dir, utils.CIRCUIT_BREAKERS_FILE)) as f:
+                    self.assertEqual(json.load(f), {})
+            finally:
+                utils.cache_dir = cache_dir
+                utils._host_limiters.pop("down.example.com", None)
+
+
+# Revalidating cached downloads with conditional GETs and streaming big
+# files to disk, against a local server
+
+
+class ConditionalHandler(http.server.BaseHTTPRequestHandler):
+    requests = []
+    slow_requests = []
+
+    def do_GET(self):
+        if self.path in ("/big.bin", "/blank.bin"):
+            body = b"x" * 1000000 if self.path == "/big.bin" else b" \n" * 1000
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+
+        if self.path == "/slow.txt":
+            self.slow_requests.append(self.path)
+            time.sleep(0.2)
+            self.send_response(200)
+            self.end_headers()
+            self.wfile.write(b"slow")
+            return
+
+        self.requests.append(self.headers.get("If-None-Match"))
+        if self.headers.get("If-None-Match") == '"v1"':
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("ETag", '"v1"')
+        self.send_header("Content-Type", "text/plain; charset=utf-8")
+        self.end_headers()
+        self.wfile.write(b"fish &amp; chips")
+
+    def log_message(self, *args):
+        pass
+
+
+class ConditionalGet(unittest.TestCase):
+
+    def setUp(self):
+        self.server = http.server.HTTPServer(("127.0.0.1", 0), ConditionalHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = "http://127.0.0.1:%d/feed.txt" % self.server.server_port
+        self.destination = "test_conditional_get/feed.txt"
+        del ConditionalHandler.requests[:]
+        del ConditionalHandler.slow_requests[:]
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(os.path.join(utils.cache_dir(), "test_conditional_get"), ignore_errors=True)
+
+    def test_revalidate(self):
+        options = {"force": True, "requests_per_minute": 0}
+        self.assertEqual(utils.download(self.url, self.destination, options), "fish & chips")
+        self.assertEqual(utils.download(self.url, self.destination, options), "fish & chips")
+        self.assertIs(utils.download(self.url, self.destination, dict(options, if_changed=True)), utils.UNCHANGED)
+        self.assertEqual(ConditionalHandler.requests, [None, '"v1"', '"v1"'])
+
+        # Without the cached file, the validators aren't used.
+        os.unlink(os.path.join(utils.cache_dir(), self.destination))
+        self.assertEqual(utils.download(self.url, self.destination, dict(options, if_changed=True)), "fish & chips")
+        self.assertEqual(ConditionalHandler.requests[-1], None)
+
+    def test_revalidate_write_behind(self):
+        # With --write_behind, the validators are saved only once the file
+        # is, so they never outlive a file that failed to be written.
+        _write = utils._write
+
+        def failing_write(content, destination, options):
+            if destination.endswith("feed.txt"):
+                raise IOError("disk full")
+            return _write(content, destination, options)
+        utils._write = failing_write
+        utils.start_write_behind({"write_behind": "1"})
+        try:
+            with self.assertRaises(IOError):
+                utils.download(self.url, self.destination, {"force": True, "requests_per_minute": 0})
+        finally:
+            utils.stop_write_behind()
+            utils._write = _write
+        self.assertFalse(os.path.exists(os.path.join(utils.cache_dir(), self.destination + "-http.json")))
+
+    def test_stream(self):
+        with tempfile.TemporaryDirectory() as dir:
+            path = os.path.join(dir, "file.bin")
+            options = {"binary": True, "needs_content": False, "to_cache": False, "force": True, "requests_per_minute": 0}
+            url = "http://127.0.0.1:%d/" % self.server.server_port
+            self.assertTrue(utils.download(url + "big.bin", path, options))
+            self.assertEqual(os.path.getsize(path), 1000000)
+
+            # A blank response leaves the file there alone.
+            self.assertIsNone(utils.download(url + "blank.bin", path, options))
+            self.assertEqual(os.path.getsize(path), 1000000)
+            self.assertEqual(os.listdir(dir), ["file.bin"])
+
+    def test_write_stream_failure(self):
+        def chunks():
+            yield b"partial"
+            raise IOError("connection reset")
+
+        with tempfile.TemporaryDirectory() as dir:
+            path = os.path.join(dir, "file.bin")
+            self.assertEqual(utils.write_stream([b"old"], path)[0], 3)
+            with self.assertRaises(IOError):
+                utils.write_stream(chunks(), path)
+            self.assertEqual(os.listdir(dir), ["file.bin"])
+            with open(path, "rb") as f:
+                self.assertEqual(f.read(), b"old")
+
+    def test_coalesce(self):
+        # Threads downloading the same page at once share one request.
+        url = "http://127.0.0.1:%d/slow.txt" % self.server.server_port
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(utils.download(url, None, {"requests_per_minute": 0}))) for i in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(results, ["slow"] * 4)
+        self.assertEqual(len(ConditionalHandler.slow_requests), 1)
+
+        # Outside of a run, pages aren't kept in memory.
+        utils.download(url, None, {"requests_per_minute": 0})
+        self.assertEqual(len(ConditionalHandler.slow_requests), 2)
+
+    def test_memo(self):
+        options = {"force": True, "requests_per_minute": 0}
+        utils.start_download_memo({})
+        try:
+            self.assertEqual(utils.download(self.url, None, options), "fish & chips")
+            self.assertEqual(utils.download(self.url, None, options), "fish & chips")
+            self.assertEqual(utils.download(self.url, self.destination, options), "fish & chips")
+            self.assertEqual(utils.download(self.url, self.destination, options), "fish & chips")
+        finally:
+            utils.stop_download_memo()
+        self.assertEqual(ConditionalHandler.requests, [None, None])
+
+        # Runs on different threads (like the daemon's) each have their own
+        # memo, and don't see each other's pages.
+        started, stopped = threading.Event(), threading.Event()
+        results = []
+
+        def other_run():
+            utils.start_download_memo({})
+            try:
+                results.append(utils.download(self.url, None, options))
+                started.set()
+                stopped.wait()
+                results.append(utils.download(self.url, None, options))
+            finally:
+                utils.stop_download_memo()
+        thread = threading.Thread(target=other_run)
+        thread.start()
+        started.wait()
+        utils.start_download_memo({})
+        try:
+            self.assertEqual(utils.download(self.url, None, options), "fish & chips")
+        finally:
+            utils.stop_download_memo()
+        stopped.set()
+        thread.join()
+        self.assertEqual(results, ["fish & chips"] * 2)
+        self.assertEqual(ConditionalHandler.requests, [None, None, None, None])
+
+        memo = utils.DownloadMemo(10)
+        memo.put("a", "x" * 6)
+        memo.put("b", "x" * 3)
+        memo.get("a")
+        memo.put("c", "x" * 3)
+        self.assertEqual(list(memo.bodies), ["a", "c"])
+        memo.put("d", "x" * 11)
+        self.assertIsNone(memo.get("d"))
@@ -0,0 +1,25 @@
+import unittest
+
+from congress.tasks import utils, votes, vote_info
+
+
+class PrefetchVotes(unittest.TestCase):
+
+    def setUp(self):
+        self.download_batch = utils.download_batch
+        utils.download_batch = lambda downloads, options: ((d, None if "/h2/" in d[1] else True) for d in downloads)
+
+    def tearDown(self):
+        utils.download_batch = self.download_batch
+
+    def test_failed_download(self):
+        failed = set()
+        self.assertEqual(list(votes.prefetch_votes(["h1-117.2021", "h2-117.2021"], {"force": True}, failed)), ["h1-117.2021", "h2-117.2021"])
+        self.assertEqual(failed, {"h2-117.2021"})
+
+        # Even if an older copy is in the cache, the vote is an error.
+        self.assertEqual(vote_info.fetch_vote("h2-117.2021", {"failed_downloads": failed}), {"saved": False, "ok": False, "reason": "failed to download"})
+
+
+if __name__ == "__main__":
+    unittest.main()